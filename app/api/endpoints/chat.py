@@ -1,10 +1,17 @@
-from fastapi import APIRouter, HTTPException, Depends
+import anyio
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from app.api.models.schemas import ChatRequest, ChatInfo, PDFInfo, MessageInfo
-from sqlalchemy.orm import Session
-from app.services.llm_service import chat_with_llm, stream_long_response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from app.services.message_history import fetch_recent_messages
+from app.services.chat_sessions import get_chat_session_pool
+from app.services.llm_scheduler import LLMQueueFullError, LLMQueueTimeoutError, LLMDeadlineExceededError
 from app.core.logging import logger
-from app.db.database import get_db
+from app.core.metrics import span
+from app.db.database import get_async_db, async_session
 from app.db.models import Chat, Message, User
 from typing import List, Optional
 import uuid
@@ -12,23 +19,52 @@ from app.auth.auth import get_current_user
 
 router = APIRouter()
 
+MESSAGE_PAGE_SIZE = 50
+MAX_MESSAGE_PAGE_SIZE = 200
+
+async def save_streamed_response(chat_id: str, stream):
+    # Persist whatever was sent, including a partial answer if the client
+    # disconnects or generation fails midway
+    chunks = []
+    try:
+        async for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+    except Exception as e:
+        logger.error(f"Error streaming chat response: {str(e)}", exc_info=True)
+    finally:
+        # On a disconnect Starlette cancels the scope this generator runs in;
+        # the shield lets the write and the connection's return to the pool finish
+        if chunks:
+            with anyio.CancelScope(shield=True), span("chat", "persist"):
+                async with async_session() as db:
+                    bot_message = Message(
+                        id=str(uuid.uuid4()),
+                        chat_id=chat_id,
+                        content="".join(chunks),
+                        is_user=False
+                    )
+                    db.add(bot_message)
+                    await db.commit()
+            # The chat's next turn finds the answer in its session's history
+            get_chat_session_pool().remember(chat_id, bot_message.id, False, bot_message.content)
+
 @router.get("/chats", response_model=List[ChatInfo])
-async def get_chats(current_user: User = Depends(get_current_user)):
-    db = next(get_db())
+async def get_chats(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_async_db)):
     if current_user:
-        chats = db.query(Chat).filter(Chat.user_id == current_user.id).all()
+        result = await db.execute(select(Chat).where(Chat.user_id == current_user.id))
     else:
-        chats = db.query(Chat).filter(Chat.user_id == None).all()
-    db.close()
+        result = await db.execute(select(Chat).where(Chat.user_id == None))
+    chats = result.scalars().all()
     return [ChatInfo(id=chat.id) for chat in chats]
 
 @router.get("/chat/{chat_id}/pdfs", response_model=List[PDFInfo])
 async def get_chat_pdfs(
     chat_id: str,
     current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    chat = db.query(Chat).filter(Chat.id == chat_id).first()
+    chat = await db.get(Chat, chat_id, options=[selectinload(Chat.pdfs)])
     if not chat:
         raise HTTPException(status_code=404, detail="Chat not found")
     # If the chat belongs to a user, ensure the current user is authorized
@@ -38,23 +74,35 @@ async def get_chat_pdfs(
         if chat.user_id != current_user.id:
             raise HTTPException(status_code=403, detail="Not authorized to access this chat")
     pdfs = chat.pdfs
-    return [PDFInfo(id=pdf.id, filename=pdf.filename) for pdf in pdfs]
+    return [
+        PDFInfo(id=pdf.id, filename=pdf.filename, page_count=pdf.page_count, pages_indexed=pdf.pages_indexed, indexing=pdf.indexing, index_error=pdf.index_error)
+        for pdf in pdfs
+    ]
 
 @router.get("/chat/{chat_id}/messages", response_model=List[MessageInfo])
-async def get_chat_messages(chat_id: str, current_user: User = Depends(get_current_user)):
-    db = next(get_db())
-    chat = db.query(Chat).filter(Chat.id == chat_id).first()
+async def get_chat_messages(
+    chat_id: str,
+    response: Response,
+    limit: int = Query(MESSAGE_PAGE_SIZE, ge=1, le=MAX_MESSAGE_PAGE_SIZE),
+    before: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    chat = await db.get(Chat, chat_id)
     if not chat:
-        db.close()
         raise HTTPException(status_code=404, detail="Chat not found")
     if current_user and chat.user_id != current_user.id:
-        db.close()
         raise HTTPException(status_code=403, detail="Not authorized to access this chat")
     if not current_user and chat.user_id is not None:
-        db.close()
         raise HTTPException(status_code=403, detail="This chat belongs to an authenticated user")
-    messages = db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.timestamp).all()
-    db.close()
+    # Returns the latest `limit` messages, oldest first; X-Next-Cursor is passed
+    # back as `before` to fetch the page preceding them
+    try:
+        messages, next_cursor = await fetch_recent_messages(db, chat_id, limit, before)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return [MessageInfo(content=msg.content, is_user=msg.is_user, timestamp=msg.timestamp) for msg in messages]
 
 @router.post("/chat/{chat_id}")
@@ -65,45 +113,52 @@ async def chat_with_pdfs(
 ):
     logger.info(f"Received chat request for Chat ID: {chat_id}")
     try:
-        db = next(get_db())
-        chat = db.query(Chat).filter(Chat.id == chat_id).first()
+        # The session is released before generation starts, so it is not held for the whole stream
+        with span("chat", "db"):
+            async with async_session() as db:
+                chat = await db.get(Chat, chat_id)
 
-        if not chat:
-            db.close()
-            raise HTTPException(status_code=404, detail="Chat not found")
+                if not chat:
+                    raise HTTPException(status_code=404, detail="Chat not found")
 
-        # Check if the chat belongs to a user
-        if chat.user_id:
-            # If the chat belongs to a user, ensure the current user is authorized
-            if not current_user or current_user.id != chat.user_id:
-                db.close()
-                raise HTTPException(status_code=403, detail="Not authorized to access this chat")
-        else:
-            # If it's an anonymous chat, anyone can access it
-            pass
+                # Check if the chat belongs to a user
+                if chat.user_id:
+                    # If the chat belongs to a user, ensure the current user is authorized
+                    if not current_user or current_user.id != chat.user_id:
+                        raise HTTPException(status_code=403, detail="Not authorized to access this chat")
+                else:
+                    # If it's an anonymous chat, anyone can access it
+                    pass
 
-        user_message = Message(
-            id=str(uuid.uuid4()), 
-            chat_id=chat_id, 
-            content=chat_request.message, 
-            is_user=True
-        )
-        db.add(user_message)
-        db.commit()
+                user_message = Message(
+                    id=str(uuid.uuid4()), 
+                    chat_id=chat_id, 
+                    content=chat_request.message, 
+                    is_user=True
+                )
+                db.add(user_message)
+                await db.commit()
 
-        full_response = await chat_with_llm(chat_id, chat_request.message)
-        
-        bot_message = Message(
-            id=str(uuid.uuid4()), 
-            chat_id=chat_id, 
-            content=full_response, 
-            is_user=False
+        # Imported here: llama_index's chat engine is only loaded once the first chat needs it
+        from app.services.llm_service import chat_with_llm
+        answer = await chat_with_llm(chat_id, chat_request.message, user_message.id)
+        stream = save_streamed_response(chat_id, answer.stream)
+        return StreamingResponse(
+            stream,
+            media_type="text/plain",
+            headers={"X-Answer-Cache": "hit" if answer.cache_hit else "miss"},
+            # Frees the LLM slot even if the client disconnects before the stream starts
+            background=BackgroundTask(answer.release),
         )
-        db.add(bot_message)
-        db.commit()
-        db.close()
-
-        return StreamingResponse(stream_long_response(full_response), media_type="text/plain")
+    except LLMQueueFullError as e:
+        logger.warning(f"Rejected chat request for Chat ID {chat_id}: {str(e)}")
+        raise HTTPException(status_code=429, detail="Too many chat requests, please retry later", headers={"Retry-After": "5"})
+    except LLMQueueTimeoutError as e:
+        logger.warning(f"Rejected chat request for Chat ID {chat_id}: {str(e)}")
+        raise HTTPException(status_code=503, detail="The LLM is busy, please retry later", headers={"Retry-After": "5"})
+    except LLMDeadlineExceededError as e:
+        logger.warning(f"Chat request for Chat ID {chat_id} timed out: {str(e)}")
+        raise HTTPException(status_code=504, detail="The LLM did not answer in time")
     except Exception as e:
         logger.error(f"Error in chat: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail="Error processing chat request")
\ No newline at end of file
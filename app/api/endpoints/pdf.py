@@ -1,45 +1,79 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Request, Depends
-from typing import Optional
-from sqlalchemy.orm import Session
-from app.services.pdf_processor import process_pdf
-from app.core.logging import logger
+from typing import List, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.services.pdf_processor import process_pdf, process_pdf_batch
+from app.services.ingestion import IngestionQueueFullError, get_ingestion_queue, load_job
+from app.api.models.schemas import IngestionJobInfo, BulkUploadInfo
 from app.core.config import get_settings
+from app.core.logging import logger
 from app.auth.auth import get_current_user
-from app.db.database import get_db
+from app.db.database import get_async_db
 from app.db.models import User, Chat
 
 router = APIRouter()
 
-# Set the maximum file size (in bytes)
-MAX_FILE_SIZE = get_settings().FILE_SIZE_MB * 1024 * 1024
-
-@router.post("/pdf")
+@router.post("/pdf", status_code=202, response_model=IngestionJobInfo)
 async def upload_pdfs(
     request: Request,
     file: UploadFile = File(...),
     chat_id: Optional[str] = Form(None),
     current_user: Optional[User] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     if chat_id:
-        chat = db.query(Chat).filter(Chat.id == chat_id).first()  # Implement this function to query the database
+        chat = await db.get(Chat, chat_id)
         if not chat:
             raise HTTPException(status_code=404, detail="Chat not found")
-    # Check file size
-    file_size = await file.read()
-    await file.seek(0)  # Reset file pointer to the beginning
-    if len(file_size) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=413, detail=f"File size exceeds the limit of {MAX_FILE_SIZE / (1024 * 1024):.2f} MB")
     logger.info(f"Received file: {file.filename}")
     if not file.filename.lower().endswith('.pdf'):
         raise HTTPException(status_code=400, detail="Only PDF files are allowed")
     try:
-        pdf_id, chat_id = await process_pdf(file, chat_id, current_user)
-        logger.info(f"PDF processed successfully. ID: {pdf_id}, Chat ID: {chat_id}")
-        return {"pdf_id": pdf_id, "chat_id": chat_id}
+        job = await process_pdf(file, chat_id, current_user)
+        logger.info(f"PDF accepted. Job ID: {job.id}, Status: {job.status}, Chat ID: {job.chat_id}")
+        return job.to_dict()
     except HTTPException as he:
         logger.error(f"Error processing PDF: {str(he)}", exc_info=True)
         raise he
+    except IngestionQueueFullError:
+        logger.warning(f"Rejected {file.filename}: ingestion queue is full")
+        raise HTTPException(status_code=429, detail="Too many PDFs are being processed, please retry later", headers={"Retry-After": "5"})
     except Exception as e:
         logger.error(f"Unexpected error processing PDF: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Unexpected error processing PDF: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Unexpected error processing PDF: {str(e)}")
+
+@router.post("/pdf/bulk", response_model=BulkUploadInfo)
+async def upload_pdfs_bulk(
+    files: List[UploadFile] = File(...),
+    chat_id: Optional[str] = Form(None),
+    current_user: Optional[User] = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if chat_id:
+        chat = await db.get(Chat, chat_id)
+        if not chat:
+            raise HTTPException(status_code=404, detail="Chat not found")
+    max_files = get_settings().BULK_UPLOAD_MAX_FILES
+    if len(files) > max_files:
+        raise HTTPException(status_code=400, detail=f"At most {max_files} files can be uploaded at once")
+    logger.info(f"Received bulk upload of {len(files)} files")
+    try:
+        batch = await process_pdf_batch(files, chat_id, current_user)
+    except IngestionQueueFullError:
+        logger.warning(f"Rejected bulk upload of {len(files)} files: bulk ingestion queue is full")
+        raise HTTPException(status_code=429, detail="Too many PDFs are being processed, please retry later", headers={"Retry-After": "5"})
+    except Exception as e:
+        logger.error(f"Unexpected error processing bulk upload: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Unexpected error processing bulk upload: {str(e)}")
+    statuses = [result["status"] for result in batch["results"]]
+    logger.info(f"Bulk upload done in {batch['timings']['total']}s. Chat ID: {batch['chat_id']}, statuses: {statuses}")
+    return batch
+
+@router.get("/pdf/jobs/{job_id}", response_model=IngestionJobInfo)
+async def get_ingestion_job(job_id: str, current_user: Optional[User] = Depends(get_current_user)):
+    # Jobs accepted by another worker process are read from the database
+    job = get_ingestion_queue().get(job_id) or await load_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.user_id is not None and (not current_user or current_user.id != job.user_id):
+        raise HTTPException(status_code=403, detail="Not authorized to access this job")
+    return job.to_dict()
\ No newline at end of file
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from datetime import datetime
+from typing import Dict, List, Optional
 
 class ChatRequest(BaseModel):
     message: str
@@ -13,8 +14,34 @@ class ChatInfo(BaseModel):
 class PDFInfo(BaseModel):
     id: str
     filename: str
+    page_count: Optional[int] = None
+    pages_indexed: Optional[int] = None
+    indexing: bool = False
+    index_error: Optional[str] = None
 
 class MessageInfo(BaseModel):
     content: str
     is_user: bool
-    timestamp: datetime
\ No newline at end of file
+    timestamp: datetime
+
+class IngestionJobInfo(BaseModel):
+    job_id: str
+    status: str
+    filename: str
+    chat_id: str
+    pdf_id: Optional[str] = None
+    error: Optional[str] = None
+    timings: Dict[str, float] = {}
+    stats: Dict[str, Optional[float]] = {}
+
+class BulkFileResult(BaseModel):
+    filename: str
+    status: str
+    pdf_id: Optional[str] = None
+    error: Optional[str] = None
+    timings: Dict[str, float] = {}
+
+class BulkUploadInfo(BaseModel):
+    chat_id: str
+    results: List[BulkFileResult]
+    timings: Dict[str, float] = {}
\ No newline at end of file
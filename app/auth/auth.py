@@ -1,11 +1,17 @@
 import jwt
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from fastapi import Depends
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
-from app.db.database import get_db
+from sqlalchemy import select
+from app.db.database import async_session
 from app.db.models import User
 from app.core.config import get_settings
+from app.auth.user_cache import get_user_cache
+from app.core.metrics import span
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
@@ -23,12 +29,22 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
-def get_user(db, username: str):
-    return db.query(User).filter(User.username == username).first()
+@lru_cache()
+def get_password_hash_pool() -> ThreadPoolExecutor:
+    # bcrypt is slow by design; a small dedicated pool keeps a burst of logins
+    # off the event loop and out of the threadpool that chat streaming uses
+    return ThreadPoolExecutor(max_workers=get_settings().AUTH_HASH_WORKERS, thread_name_prefix="bcrypt")
 
-def authenticate_user(db, username: str, password: str):
-    user = get_user(db, username)
-    if not user or not verify_password(password, user.hashed_password):
+async def run_password_work(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(get_password_hash_pool(), fn, *args)
+
+async def get_user(db, username: str):
+    result = await db.execute(select(User).where(User.username == username))
+    return result.scalars().first()
+
+async def authenticate_user(db, username: str, password: str):
+    user = await get_user(db, username)
+    if not user or not await run_password_work(verify_password, password, user.hashed_password):
         return False
     return user
 
@@ -42,9 +58,14 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             return None
     except jwt.PyJWTError:
         return None
-    db = next(get_db())
-    user = get_user(db, username=username)
-    db.close()
+    # The token already names the user; the database is only asked on a cache miss
+    cache = get_user_cache()
+    user = cache.get(username)
     if user is None:
-        return None
+        with span("auth", "user_lookup"):
+            async with async_session() as db:
+                user = await get_user(db, username=username)
+        if user is None:
+            return None
+        cache.put(username, user)
     return user
\ No newline at end of file
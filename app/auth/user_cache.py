@@ -0,0 +1,64 @@
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from sqlalchemy import event
+from app.core.config import get_settings
+from app.core.metrics import record_cache
+from app.db.models import User
+
+class UserCache:
+    # Resolved users keyed by token subject (the username). Entries are
+    # detached User rows, so only their column attributes may be read.
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None or entry[1] <= now:
+                self._entries.pop(username, None)
+                self.misses += 1
+                record_cache("user", False)
+                return None
+            self._entries.move_to_end(username)
+            self.hits += 1
+        record_cache("user", True)
+        return entry[0]
+
+    def put(self, username: str, user: User):
+        with self._lock:
+            self._entries[username] = (user, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: str):
+        # Matched by id rather than username, which may itself have changed
+        with self._lock:
+            for username in [username for username, (user, _) in self._entries.items() if user.id == user_id]:
+                del self._entries[username]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+@lru_cache()
+def get_user_cache() -> UserCache:
+    settings = get_settings()
+    return UserCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_USER_CACHE_TTL)
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_changed_user(mapper, connection, target):
+    get_user_cache().invalidate_user(target.id)
@@ -1,8 +1,4 @@
-import os
 from pydantic_settings import BaseSettings
-from llama_index.llms.gemini import Gemini
-from llama_index.embeddings.gemini import GeminiEmbedding
-from llama_index.core import Settings
 from functools import lru_cache
 
 class AppSettings(BaseSettings):
@@ -10,24 +6,69 @@ class AppSettings(BaseSettings):
     PROJECT_VERSION: str = "1.0.0"
     GOOGLE_API_KEY: str
     SQLALCHEMY_DATABASE_URL: str
+    # Names registered in app.core.providers; clients are created on first use
+    LLM_PROVIDER: str = "gemini"
+    EMBEDDING_PROVIDER: str = "gemini"
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
     FILE_SIZE_MB: int = 3
     CONTEXT_LENGTH: int = 5
+    INDEX_CACHE_MB: int = 512
+    # Local directory where PDF vectors are published once and memory-mapped by every worker ("" to disable)
+    INDEX_DIR: str = ""
+    # Precision of stored PDF embeddings: "float32", "float16" or "int8". float16
+    # trades latency for memory: numpy converts it to float32 slowly, so scoring
+    # takes about 10x as long as float32; int8 is smaller and nearly as fast
+    EMBEDDING_STORAGE: str = "float32"
+    SIMILARITY_TOP_K: int = 5
+    # "dense", "lexical" (BM25 only, no query embedding) or "hybrid"
+    RETRIEVAL_MODE: str = "hybrid"
+    # Tokens of retrieved chunks allowed into one prompt (0 for no limit)
+    CONTEXT_TOKEN_BUDGET: int = 3000
+    # Chunks sharing this fraction of word shingles with one already in the prompt are dropped (0 to disable)
+    CONTEXT_DEDUP_SIMILARITY: float = 0.8
+    INGESTION_WORKERS: int = 2
+    INGESTION_QUEUE_SIZE: int = 32
+    # Seconds an upload job's status stays queryable from any worker
+    INGESTION_JOB_TTL: float = 86400.0
+    BULK_UPLOAD_MAX_FILES: int = 50
+    # Bulk upload files parsed and embedded at once across all requests, and how many may wait or run before bulk uploads get 429
+    BULK_INGEST_CONCURRENCY: int = 8
+    BULK_INGEST_QUEUE_SIZE: int = 100
+    # Pages indexed and committed before the rest of an upload, each later batch doubling (0 to index PDFs in one go)
+    INGEST_FIRST_BATCH_PAGES: int = 8
+    # Seconds without a stored batch after which a partially indexed PDF is resumed by a re-upload of its file
+    INGEST_RESUME_AFTER: float = 600.0
+    EMBED_BATCH_SIZE: int = 100
+    # Embedding requests in flight across all ingestions of a process
+    EMBED_CONCURRENCY: int = 4
+    EMBED_RATE_LIMIT: float = 10.0
+    EMBED_MAX_RETRIES: int = 5
+    PDF_EXTRACT_WORKERS: int = 4
+    # Seconds before a page's extraction is abandoned; off the main thread only extraction processes can enforce it
+    PDF_PAGE_TIMEOUT: float = 30.0
+    # Warm per-chat sessions (retriever and recent messages) kept between turns
+    CHAT_SESSION_POOL_SIZE: int = 1000
+    CHAT_SESSION_TTL: float = 600.0
+    ANSWER_CACHE_SIZE: int = 1000
+    ANSWER_CACHE_TTL: float = 3600.0
+    ANSWER_CACHE_SIMILARITY: float = 0.0
+    LLM_MAX_CONCURRENCY: int = 8
+    LLM_QUEUE_SIZE: int = 32
+    LLM_QUEUE_TIMEOUT: float = 30.0
+    LLM_REQUEST_TIMEOUT: float = 120.0
     SECRET_KEY: str = "top-secret-key"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    AUTH_USER_CACHE_TTL: float = 60.0
+    AUTH_USER_CACHE_SIZE: int = 10000
+    AUTH_HASH_WORKERS: int = 2
 
     class Config:
         env_file = ".env"
 
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self._setup_llm_settings()
-
-    def _setup_llm_settings(self):
-        os.environ["GOOGLE_API_KEY"] = self.GOOGLE_API_KEY
-        Settings.llm = Gemini()
-        Settings.embed_model = GeminiEmbedding()
-
 _settings = None
 
 @lru_cache()
@@ -41,5 +82,3 @@ def override_settings(new_settings: AppSettings):
     global _settings
     _settings = new_settings
     get_settings.cache_clear()
-
-settings = get_settings()
\ No newline at end of file
@@ -0,0 +1,219 @@
+import math
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Sequence
+
+# Counters and histograms rendered in the Prometheus text format on /metrics.
+# Per-request stage timings are also collected in a context variable, which the
+# metrics middleware turns into a Server-Timing header.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 16000, 32000)
+BYTES_BUCKETS = tuple(2 ** power for power in range(10, 31, 2))
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = None) -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        key = tuple(str(value) for value in values)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+        return child
+
+    def clear(self):
+        with self._lock:
+            self._children.clear()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items())
+        for key, child in children:
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+class CounterValue:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def render(self, name: str, labelnames, labelvalues) -> List[str]:
+        return [f"{name}_total{format_labels(labelnames, labelvalues)} {format_value(self.value)}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return CounterValue()
+
+    def inc(self, amount: float = 1.0):
+        # For counters without labels
+        self.labels().inc(amount)
+
+class HistogramValue:
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.count += 1
+            self.sum += value
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def render(self, name: str, labelnames, labelvalues) -> List[str]:
+        with self._lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            le = f'le="{format_value(bound)}"'
+            lines.append(f"{name}_bucket{format_labels(labelnames, labelvalues, le)} {cumulative}")
+        inf = 'le="+Inf"'
+        lines.append(f"{name}_bucket{format_labels(labelnames, labelvalues, inf)} {count}")
+        lines.append(f"{name}_sum{format_labels(labelnames, labelvalues)} {format_value(total)}")
+        lines.append(f"{name}_count{format_labels(labelnames, labelvalues)} {count}")
+        return lines
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        # For histograms without labels
+        self.labels().observe(value)
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def clear(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            metric.clear()
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+    def _register(self, metric: Metric) -> Metric:
+        with self._lock:
+            # Registering the same name twice returns the existing metric
+            return self._metrics.setdefault(metric.name, metric)
+
+registry = MetricsRegistry()
+
+REQUEST_LATENCY = registry.histogram(
+    "pdfchat_request_duration_seconds", "HTTP request latency, until the last byte of the body", ["method", "route", "status"]
+)
+STAGE_LATENCY = registry.histogram(
+    "pdfchat_stage_duration_seconds", "Time spent in each stage of a chat turn or PDF ingestion", ["operation", "stage"]
+)
+QUEUE_WAIT = registry.histogram(
+    "pdfchat_queue_wait_seconds", "Time spent waiting for an LLM slot or an ingestion worker", ["queue"]
+)
+CACHE_REQUESTS = registry.counter(
+    "pdfchat_cache_requests", "Cache lookups by cache and result", ["cache", "result"]
+)
+EMBEDDING_BATCH_LATENCY = registry.histogram(
+    "pdfchat_embedding_batch_duration_seconds", "Latency of embedding API batches, including retries"
+)
+EMBEDDING_BATCH_SIZE = registry.histogram(
+    "pdfchat_embedding_batch_size", "Texts per embedding API batch", buckets=SIZE_BUCKETS
+)
+PROMPT_TOKENS = registry.histogram(
+    "pdfchat_prompt_tokens", "Estimated prompt tokens per chat turn", ["part"], buckets=TOKEN_BUCKETS
+)
+CONTEXT_CHUNKS_DROPPED = registry.counter(
+    "pdfchat_context_chunks_dropped", "Retrieved chunks left out of the prompt", ["reason"]
+)
+INDEX_BYTES_LOADED = registry.histogram(
+    "pdfchat_index_loaded_bytes", "Size of each PDF index loaded from the database", buckets=BYTES_BUCKETS
+)
+
+# Stage timings of the request being handled, or None outside a request
+_request_timings: ContextVar = ContextVar("request_timings", default=None)
+
+def start_request_timings() -> dict:
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+def record_stage(operation: str, stage: str, seconds: float):
+    STAGE_LATENCY.labels(operation, stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        # Stages run once per file in bulk uploads, so durations add up
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+@contextmanager
+def span(operation: str, stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(operation, stage, time.perf_counter() - start)
+
+def record_cache(cache: str, hit: bool, count: int = 1):
+    if count:
+        CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc(count)
+
+def server_timing(timings: dict, total: float = None) -> str:
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
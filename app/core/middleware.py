@@ -0,0 +1,60 @@
+import time
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from app.core.config import get_settings
+from app.core.metrics import REQUEST_LATENCY, start_request_timings, server_timing
+
+# Room for multipart boundaries and the other form fields around the file
+MULTIPART_OVERHEAD = 64 * 1024
+
+class UploadSizeLimitMiddleware:
+    # Rejects oversized uploads from their Content-Length before any of the
+    # body is read. Uploads without one are still capped while being spooled.
+    def __init__(self, app, paths):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "POST" and scope["path"] in self.paths:
+            max_size = get_settings().FILE_SIZE_MB * 1024 * 1024
+            content_length = Headers(scope=scope).get("content-length")
+            if content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+                response = JSONResponse(
+                    status_code=413,
+                    content={"detail": f"File size exceeds the limit of {max_size / (1024 * 1024):.2f} MB"},
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+class MetricsMiddleware:
+    # Records request latency by route template and adds a Server-Timing header
+    # with the stages timed before the response started. Streamed responses
+    # are timed until their last chunk, so stages after the headers (token
+    # generation, saving the answer) only show up on /metrics.
+    def __init__(self, app, exclude_paths=()):
+        self.app = app
+        self.exclude_paths = set(exclude_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.exclude_paths:
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        timings = start_request_timings()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing(timings, time.perf_counter() - start))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            # The route template keeps the label set small, unlike the raw path
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_LATENCY.labels(scope["method"], route, status).observe(time.perf_counter() - start)
@@ -0,0 +1,59 @@
+import threading
+from app.core.config import get_settings
+
+# Model clients by provider name. A factory takes the app settings and is only
+# called when a model is first needed, so importing the app loads no provider
+# SDK and opens no connection.
+LLM_PROVIDERS = {}
+EMBEDDING_PROVIDERS = {}
+
+_lock = threading.Lock()
+
+def register_llm_provider(name: str, factory):
+    LLM_PROVIDERS[name] = factory
+
+def register_embedding_provider(name: str, factory):
+    EMBEDDING_PROVIDERS[name] = factory
+
+def gemini_llm(settings):
+    from llama_index.llms.gemini import Gemini
+    return Gemini(api_key=settings.GOOGLE_API_KEY)
+
+def gemini_embedding(settings):
+    from llama_index.embeddings.gemini import GeminiEmbedding
+    # One API request per pipeline batch
+    return GeminiEmbedding(api_key=settings.GOOGLE_API_KEY, embed_batch_size=settings.EMBED_BATCH_SIZE)
+
+register_llm_provider("gemini", gemini_llm)
+register_embedding_provider("gemini", gemini_embedding)
+
+def create_model(providers: dict, name: str, kind: str):
+    factory = providers.get(name)
+    if factory is None:
+        raise ValueError(f"Unknown {kind} provider {name!r}, expected one of {sorted(providers)}")
+    return factory(get_settings())
+
+# The clients live in llama_index's Settings, so its components and anything
+# that sets Settings.llm or Settings.embed_model directly see the same ones.
+# Settings would otherwise fall back to OpenAI when they are unset.
+
+def get_llm():
+    from llama_index.core import Settings
+    with _lock:
+        if Settings._llm is None:
+            Settings.llm = create_model(LLM_PROVIDERS, get_settings().LLM_PROVIDER, "LLM")
+    return Settings.llm
+
+def get_embed_model():
+    from llama_index.core import Settings
+    with _lock:
+        if Settings._embed_model is None:
+            Settings.embed_model = create_model(EMBEDDING_PROVIDERS, get_settings().EMBEDDING_PROVIDER, "embedding")
+    return Settings.embed_model
+
+def reset_models():
+    # Drops the clients, so the next use creates them from the current settings
+    from llama_index.core import Settings
+    with _lock:
+        Settings._llm = None
+        Settings._embed_model = None
@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import Future, InvalidStateError
+
+class SingleFlight:
+    # Coalesces concurrent calls for the same key: the first caller (the
+    # leader) does the work and everyone joining before it finishes gets the
+    # same result or exception. The future is thread-safe, so followers can
+    # block on it, await it through asyncio.wrap_future or add a callback.
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def join(self, key):
+        # Returns the key's future and whether the caller leads it; a leader
+        # must always call finish
+        with self._lock:
+            future = self._flights.get(key)
+            if future is not None:
+                return future, False
+            future = self._flights[key] = Future()
+            # A running future cannot be cancelled, so a follower that gives up
+            # does not cancel it for the others
+            future.set_running_or_notify_cancel()
+            return future, True
+
+    def finish(self, key, future: Future, result=None, error: BaseException = None):
+        # Safe to call more than once; only the first outcome counts
+        with self._lock:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+        # Outside the lock: done callbacks run right here
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+    def lead(self, key, future: Future, fn, *args):
+        # Runs fn for the leader of key and shares its outcome
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self.finish(key, future, error=e)
+            raise
+        self.finish(key, future, result)
+        return result
+
+    def __len__(self):
+        with self._lock:
+            return len(self._flights)
@@ -1,16 +1,45 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from app.core.config import get_settings
 from functools import lru_cache
 
 Base = declarative_base()
 
+# asyncio drivers used for SQLALCHEMY_DATABASE_URL when it names a plain backend
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+def async_database_url(url: str) -> str:
+    scheme, separator, rest = url.partition("://")
+    return f"{ASYNC_DRIVERS.get(scheme, scheme)}{separator}{rest}"
+
+def pool_options(url: str) -> dict:
+    # In-memory SQLite lives inside a single connection, so it cannot be pooled
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite" and parsed.database in (None, "", ":memory:"):
+        return {}
+    settings = get_settings()
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
 @lru_cache()
 def get_engine():
+    # Synchronous engine for ingestion worker threads, migrations and create_all
     url = get_settings().SQLALCHEMY_DATABASE_URL
     print(f"Creating engine with URL: {url}")
-    return create_engine(url)
+    return create_engine(url, **pool_options(url))
 
 @lru_cache()
 def get_session_local():
@@ -25,7 +54,29 @@ def get_db():
     finally:
         db.close()
 
+@lru_cache()
+def get_async_engine():
+    # Used by everything that runs on the event loop, so queries never block it
+    url = get_settings().SQLALCHEMY_DATABASE_URL
+    options = pool_options(url)
+    if options:
+        # aiosqlite would otherwise default to NullPool and reconnect per session
+        options["poolclass"] = AsyncAdaptedQueuePool
+    return create_async_engine(async_database_url(url), **options)
+
+@lru_cache()
+def get_async_session_local():
+    # Objects stay usable after commit; async sessions cannot lazy-load expired attributes
+    return async_sessionmaker(bind=get_async_engine(), class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+def async_session() -> AsyncSession:
+    return get_async_session_local()()
+
+async def get_async_db():
+    async with async_session() as db:
+        yield db
+
 def init_db():
     engine = get_engine()
     print(f"Initializing database with URL: {engine.url}")
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
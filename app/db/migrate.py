@@ -0,0 +1,105 @@
+import json
+import pickle
+import numpy as np
+from app.db.database import get_engine, get_db
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import undefer, selectinload
+from app.db.models import Base, PDF, PDFChunk
+from app.core.config import get_settings
+from app.services.vector_store import is_embedding_store, serialize_embeddings, deserialize_embeddings, embedding_storage, normalize_rows, chunk_metadata
+from app.services.lexical_index import LexicalIndex, serialize_lexical_index
+
+# Converts PDF.vector_store rows written as pickled VectorStoreIndex objects
+# into the embedding store format. Legacy rows were written by this service, so
+# unpickling them here (and only here) is acceptable.
+def convert_legacy_index(blob: bytes):
+    index = pickle.loads(blob)
+    embedding_dict = index.vector_store.data.embedding_dict
+    embeddings, chunks = [], []
+    for vector_id, node_id in index.index_struct.nodes_dict.items():
+        node = index.docstore.get_node(node_id)
+        embeddings.append(embedding_dict[vector_id])
+        chunks.append((node.get_content(), chunk_metadata(node.metadata)))
+    matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(chunks), -1)
+    return normalize_rows(matrix), chunks
+
+def migrate_vector_stores(db) -> int:
+    migrated = 0
+    for (pdf_id,) in db.query(PDF.id).all():
+        pdf = db.query(PDF).options(undefer(PDF.vector_store)).filter(PDF.id == pdf_id).first()
+        if pdf.vector_store is None or is_embedding_store(pdf.vector_store):
+            continue
+        embeddings, chunks = convert_legacy_index(pdf.vector_store)
+        pdf.vector_store = serialize_embeddings(embeddings, get_settings().EMBEDDING_STORAGE)
+        pdf.chunks = [
+            PDFChunk(position=position, text=text, metadata_json=json.dumps(metadata))
+            for position, (text, metadata) in enumerate(chunks)
+        ]
+        db.commit()
+        db.expunge(pdf)
+        migrated += 1
+        print(f"Migrated PDF {pdf_id}: {len(chunks)} chunks")
+    return migrated
+
+def quantize_vector_stores(db, storage: str) -> int:
+    # Re-encodes float32 stores in a quantized EMBEDDING_STORAGE. Quantized
+    # stores are left alone: converting them back cannot restore the precision.
+    if storage == "float32":
+        return 0
+    converted = 0
+    for (pdf_id,) in db.query(PDF.id).all():
+        pdf = db.query(PDF).options(undefer(PDF.vector_store)).filter(PDF.id == pdf_id).first()
+        if not is_embedding_store(pdf.vector_store) or embedding_storage(pdf.vector_store) != "float32":
+            continue
+        pdf.vector_store = serialize_embeddings(deserialize_embeddings(pdf.vector_store), storage)
+        db.commit()
+        db.expunge(pdf)
+        converted += 1
+    return converted
+
+def build_lexical_indexes(db) -> int:
+    # Runs after migrate_vector_stores so converted PDFs already have their chunks
+    built = 0
+    for (pdf_id,) in db.query(PDF.id).filter(PDF.lexical_index.is_(None)).all():
+        pdf = db.query(PDF).options(selectinload(PDF.chunks)).filter(PDF.id == pdf_id).first()
+        pdf.lexical_index = serialize_lexical_index(LexicalIndex.build([chunk.text for chunk in pdf.chunks]))
+        db.commit()
+        db.expunge(pdf)
+        built += 1
+    return built
+
+def create_missing_columns(engine):
+    # create_all skips tables that already exist, so nullable columns added to
+    # existing tables later (e.g. pdfs.lexical_index) are added here
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                with engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"))
+                print(f"Added column {table.name}.{column.name}")
+
+def create_missing_indexes(engine):
+    # create_all skips tables that already exist, so indexes added to existing
+    # tables later (e.g. ix_messages_chat_id_timestamp) are created here
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+if __name__ == "__main__":
+    Base.metadata.create_all(bind=get_engine())
+    create_missing_columns(get_engine())
+    create_missing_indexes(get_engine())
+    db = next(get_db())
+    try:
+        count = migrate_vector_stores(db)
+        quantized = quantize_vector_stores(db, get_settings().EMBEDDING_STORAGE)
+        built = build_lexical_indexes(db)
+    finally:
+        db.close()
+    print(f"Migrated {count} PDF vector store(s)")
+    print(f"Converted {quantized} PDF vector store(s) to {get_settings().EMBEDDING_STORAGE}")
+    print(f"Built {built} lexical index(es)")
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, String, LargeBinary, ForeignKey, DateTime, Text, Boolean, Table
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, String, LargeBinary, ForeignKey, DateTime, Text, Boolean, Table, Integer, Index
+from sqlalchemy.orm import relationship, deferred
 from app.db.database import Base
 from datetime import datetime, timezone
 import uuid
@@ -31,9 +31,39 @@ class PDF(Base):
 
     id = Column(String, primary_key=True, index=True)
     filename = Column(String)
-    vector_store = Column(LargeBinary)
+    # Only loaded when asked for, so listing or attaching PDFs never pulls the embedding BLOB
+    vector_store = deferred(Column(LargeBinary))
+    # BM25 postings over the same chunks, see app.services.lexical_index
+    lexical_index = deferred(Column(LargeBinary))
     chats = relationship("Chat", secondary=chat_pdf_association, back_populates="pdfs")
     file_hash = Column(String, unique=True, index=True)
+    # Pages are indexed in batches; the PDF is searchable from the first one.
+    # Both are NULL for PDFs stored before, which are complete.
+    page_count = Column(Integer)
+    pages_indexed = Column(Integer)
+    # When the last batch was stored, and why indexing stopped if it failed;
+    # a partial PDF that failed or stopped progressing is resumed on re-upload
+    indexed_at = Column(DateTime)
+    index_error = Column(Text)
+    chunks = relationship("PDFChunk", back_populates="pdf", order_by="PDFChunk.position", cascade="all, delete-orphan")
+
+    @property
+    def partial(self) -> bool:
+        return self.page_count is not None and self.pages_indexed < self.page_count
+
+    @property
+    def indexing(self) -> bool:
+        return self.partial and self.index_error is None
+
+class PDFChunk(Base):
+    __tablename__ = "pdf_chunks"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    pdf_id = Column(String, ForeignKey('pdfs.id'), index=True)
+    pdf = relationship("PDF", back_populates="chunks")
+    position = Column(Integer)
+    text = Column(Text)
+    metadata_json = Column(Text)
 
 class Message(Base):
     __tablename__ = "messages"
@@ -42,5 +72,31 @@ class Message(Base):
     chat_id = Column(String, ForeignKey('chats.id'))
     chat = relationship("Chat", back_populates="messages")
     content = Column(Text)
-    timestamp = Column(DateTime, default=datetime.now(timezone.utc))
-    is_user = Column(Boolean, default=True)
\ No newline at end of file
+    timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    is_user = Column(Boolean, default=True)
+
+    # Serves newest-first history reads and keyset pagination; id breaks timestamp ties
+    __table_args__ = (Index("ix_messages_chat_id_timestamp", "chat_id", "timestamp", "id"),)
+
+class EmbeddingCacheEntry(Base):
+    __tablename__ = "embedding_cache"
+
+    key = Column(String, primary_key=True)
+    embedding = Column(LargeBinary)
+
+class IngestionJobRecord(Base):
+    # The status of upload jobs, so any worker process can report on a job
+    # that another one is running
+    __tablename__ = "ingestion_jobs"
+
+    id = Column(String, primary_key=True)
+    filename = Column(String)
+    chat_id = Column(String)
+    user_id = Column(String)
+    status = Column(String)
+    pdf_id = Column(String)
+    error = Column(Text)
+    # Per-stage timings and stats as JSON objects
+    timings_json = Column(Text)
+    stats_json = Column(Text)
+    created_at = Column(DateTime, index=True)
@@ -1,24 +1,36 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 from app.api.endpoints import pdf, chat, auth
 from app.core.config import get_settings
 from app.core.logging import setup_logging
+from app.core.middleware import UploadSizeLimitMiddleware, MetricsMiddleware
+from app.core.metrics import registry
 from app.db.database import get_engine
 from app.db.models import Base
 import os
 
-app = FastAPI(title=get_settings().PROJECT_NAME, version=get_settings().PROJECT_VERSION)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create database tables at startup rather than import, so tools and tests
+    # importing the app do not touch the database
+    Base.metadata.create_all(bind=get_engine())
+    yield
 
-setup_logging()
+app = FastAPI(title=get_settings().PROJECT_NAME, version=get_settings().PROJECT_VERSION, lifespan=lifespan)
 
-# Create database tables
-Base.metadata.create_all(bind=get_engine())
+setup_logging()
 
 # Mount static files
 static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
+# Reject oversized uploads before reading their body
+app.add_middleware(UploadSizeLimitMiddleware, paths=["/v1/pdf"])
+# Outermost, so rejected uploads are timed too
+app.add_middleware(MetricsMiddleware, exclude_paths=["/metrics"])
+
 # API routes
 app.include_router(pdf.router, prefix="/v1", tags=["pdf"])
 app.include_router(chat.router, prefix="/v1", tags=["chat"])
@@ -32,6 +44,10 @@ async def read_root():
 async def favicon():
     return FileResponse(os.path.join(static_dir, "favicon.ico"))
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
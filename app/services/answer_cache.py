@@ -0,0 +1,105 @@
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List, Optional
+import numpy as np
+from app.core.config import get_settings
+from app.core.metrics import record_cache
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!.").strip().lower()
+
+def hash_parts(parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class AnswerCacheEntry:
+    def __init__(self, answer: str, context: tuple, query_embedding, expires_at: float):
+        self.answer = answer
+        self.context = context
+        self.query_embedding = query_embedding
+        self.expires_at = expires_at
+
+class AnswerCache:
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def context_key(chat_id: str, pdf_ids: List[str], history: List[str]) -> tuple:
+        # Everything except the question itself: the chat, its PDF set and the recent history
+        return (chat_id, hash_parts(sorted(pdf_ids)), hash_parts(history))
+
+    def get(self, context: tuple, question: str, query_embedding=None) -> Optional[str]:
+        key = context + (normalize_question(question),)
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._entries and query_embedding is not None and self.similarity_threshold > 0:
+                key = self._most_similar(context, query_embedding)
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at <= now:
+                self.misses += 1
+                record_cache("answer", False)
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        record_cache("answer", True)
+        return entry.answer
+
+    def put(self, context: tuple, question: str, answer: str, query_embedding=None):
+        key = context + (normalize_question(question),)
+        if query_embedding is not None:
+            query_embedding = np.asarray(query_embedding, dtype=np.float32)
+            query_embedding = query_embedding / (np.linalg.norm(query_embedding) or 1.0)
+        with self._lock:
+            self._entries[key] = AnswerCacheEntry(answer, context, query_embedding, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def invalidate_chat(self, chat_id: str):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == chat_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def _most_similar(self, context: tuple, query_embedding):
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        best, best_score = None, self.similarity_threshold
+        for key, entry in self._entries.items():
+            if entry.context != context or entry.query_embedding is None:
+                continue
+            score = float(entry.query_embedding @ query)
+            if score >= best_score:
+                best, best_score = key, score
+        return best
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry.expires_at <= now]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+@lru_cache()
+def get_answer_cache() -> AnswerCache:
+    settings = get_settings()
+    return AnswerCache(settings.ANSWER_CACHE_SIZE, settings.ANSWER_CACHE_TTL, settings.ANSWER_CACHE_SIMILARITY)
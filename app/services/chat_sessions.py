@@ -0,0 +1,93 @@
+import time
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from app.core.config import get_settings
+from app.core.metrics import record_cache
+
+class ChatSession:
+    # What a chat turn reuses from the previous one: the chat's PDF ids, the
+    # retriever over their indexes and the latest messages, oldest first, as
+    # message id -> (is_user, content)
+    def __init__(self, chat_id: str, pdf_ids: list, retriever):
+        self.chat_id = chat_id
+        self.pdf_ids = pdf_ids
+        self.retriever = retriever
+        self.messages = OrderedDict()
+        self.last_used = time.monotonic()
+
+class ChatSessionPool:
+    # Idle sessions by chat, least recently used first. A turn checks its
+    # chat's session out and back in once the answer has streamed, so no two
+    # turns use one retriever at a time; a concurrent turn on the same chat
+    # builds its own session.
+    def __init__(self, max_sessions: int, ttl_seconds: float, history_length: int):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.history_length = history_length
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def checkout(self, chat_id: str):
+        with self._lock:
+            session = self._sessions.pop(chat_id, None)
+            if session is not None and self._expired(session, time.monotonic()):
+                session = None
+            if session is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        record_cache("chat_session", session is not None)
+        return session
+
+    def checkin(self, session: ChatSession):
+        now = time.monotonic()
+        session.last_used = now
+        with self._lock:
+            self._sessions[session.chat_id] = session
+            self._sessions.move_to_end(session.chat_id)
+            # Least recently used first, so expired sessions are at the front
+            while self._sessions:
+                oldest = next(iter(self._sessions.values()))
+                if len(self._sessions) <= self.max_sessions and not self._expired(oldest, now):
+                    break
+                del self._sessions[oldest.chat_id]
+                self.evictions += 1
+
+    def remember(self, chat_id: str, message_id: str, is_user: bool, content: str):
+        # Appends a message just stored for the chat to its idle session
+        with self._lock:
+            session = self._sessions.get(chat_id)
+            if session is not None:
+                session.messages[message_id] = (is_user, content)
+                while len(session.messages) > self.history_length:
+                    session.messages.popitem(last=False)
+
+    def invalidate(self, chat_id: str):
+        with self._lock:
+            self._sessions.pop(chat_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _expired(self, session: ChatSession, now: float) -> bool:
+        return now - session.last_used > self.ttl_seconds
+
+@lru_cache()
+def get_chat_session_pool() -> ChatSessionPool:
+    settings = get_settings()
+    return ChatSessionPool(settings.CHAT_SESSION_POOL_SIZE, settings.CHAT_SESSION_TTL, settings.CONTEXT_LENGTH)
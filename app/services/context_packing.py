@@ -0,0 +1,62 @@
+import re
+import hashlib
+from typing import List
+from app.services.lexical_index import tokenize
+
+# Reasons a retrieved chunk is left out of the prompt
+DUPLICATE = "duplicate"
+NEAR_DUPLICATE = "near_duplicate"
+BUDGET = "budget"
+
+# Near-duplicates are compared on overlapping runs of this many words, which
+# tells re-chunked copies of a passage from sentences that merely look alike
+SHINGLE_SIZE = 3
+
+def content_hash(text: str) -> str:
+    # Whitespace and case differences from PDF extraction do not make a chunk new
+    normalized = re.sub(r"\s+", " ", text).strip().lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+def count_tokens(text: str) -> int:
+    from llama_index.core import Settings
+    return len(Settings.tokenizer(text))
+
+def shingles(text: str) -> frozenset:
+    words = tokenize(text)
+    if len(words) < SHINGLE_SIZE:
+        return frozenset([tuple(words)])
+    return frozenset(tuple(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1))
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def pack_context(texts: List[str], token_counts: List[int], max_chunks: int,
+                 token_budget: int = None, similarity_threshold: float = None):
+    # Candidates come best first. Keeps each one unless it repeats a kept chunk,
+    # word for word or nearly (shingle Jaccard similarity), or would overflow
+    # the token budget; a smaller chunk further down may still fit after one
+    # is skipped. Returns the positions kept and what was dropped.
+    kept, hashes, kept_shingles = [], set(), []
+    stats = {"candidates": len(texts), "tokens": 0, DUPLICATE: 0, NEAR_DUPLICATE: 0, BUDGET: 0}
+    for position, text in enumerate(texts):
+        if len(kept) >= max_chunks:
+            break
+        digest = content_hash(text)
+        if digest in hashes:
+            stats[DUPLICATE] += 1
+            continue
+        if similarity_threshold:
+            candidate = shingles(text)
+            if any(jaccard(candidate, other) >= similarity_threshold for other in kept_shingles):
+                stats[NEAR_DUPLICATE] += 1
+                continue
+        # The best chunk always goes in, so an oversized one cannot leave the prompt empty
+        if token_budget and kept and stats["tokens"] + token_counts[position] > token_budget:
+            stats[BUDGET] += 1
+            continue
+        kept.append(position)
+        hashes.add(digest)
+        if similarity_threshold:
+            kept_shingles.append(candidate)
+        stats["tokens"] += token_counts[position]
+    return kept, stats
@@ -0,0 +1,119 @@
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List
+import numpy as np
+from app.core.config import get_settings
+from app.core.providers import get_embed_model
+from app.core.logging import logger
+from app.core.metrics import EMBEDDING_BATCH_LATENCY, EMBEDDING_BATCH_SIZE
+
+RETRYABLE_STATUS_CODES = {429, 500, 503}
+
+def is_retryable(exc: Exception) -> bool:
+    # google.api_core errors carry the HTTP status in `code`, httpx-style errors in `status_code`
+    status = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+    try:
+        return int(status) in RETRYABLE_STATUS_CODES
+    except (TypeError, ValueError):
+        return False
+
+class TokenBucket:
+    # Thread-safe so one bucket can throttle every embedding thread
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        wait = self.reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+
+class EmbeddingPipeline:
+    # Batches are sent with the model's public sync batch call on a thread
+    # pool. The async client of google-generativeai is bound to the first
+    # event loop that uses it, so a loop per call fails from the second on.
+    def __init__(self, embed_model=None, batch_size: int = 100, concurrency: int = 4,
+                 rate_limiter: TokenBucket = None, max_retries: int = 5, backoff_seconds: float = 0.5,
+                 executor: ThreadPoolExecutor = None):
+        self.embed_model = embed_model
+        self.batch_size = batch_size
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.executor = executor or ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed")
+
+    def embed(self, texts: List[str]):
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32), {"chunks": 0, "batches": 0, "retries": 0}
+        embed_model = self.embed_model or get_embed_model()
+        stats = {"chunks": len(texts), "batches": 0, "retries": 0}
+        stats_lock = threading.Lock()
+
+        def embed_batch(batch):
+            batch_start = time.perf_counter()
+            for attempt in range(self.max_retries + 1):
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
+                try:
+                    result = embed_model.get_text_embedding_batch(batch)
+                    with stats_lock:
+                        stats["batches"] += 1
+                    EMBEDDING_BATCH_LATENCY.observe(time.perf_counter() - batch_start)
+                    EMBEDDING_BATCH_SIZE.observe(len(batch))
+                    return result
+                except Exception as e:
+                    if attempt == self.max_retries or not is_retryable(e):
+                        raise
+                    with stats_lock:
+                        stats["retries"] += 1
+                    delay = self.backoff_seconds * 2 ** attempt * (1 + random.random())
+                    logger.warning(f"Embedding batch failed ({str(e)}), retrying in {delay:.2f}s")
+                    time.sleep(delay)
+
+        start = time.perf_counter()
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        futures = [self.executor.submit(embed_batch, batch) for batch in batches]
+        try:
+            results = [future.result() for future in futures]
+        finally:
+            # A failed batch fails the call; batches not started yet are dropped
+            for future in futures:
+                future.cancel()
+        stats["seconds"] = round(time.perf_counter() - start, 4)
+        stats["chunks_per_second"] = round(len(texts) / stats["seconds"], 2) if stats["seconds"] else None
+        embeddings = np.asarray([vector for batch in results for vector in batch], dtype=np.float32)
+        return embeddings.reshape(len(texts), -1), stats
+
+@lru_cache()
+def get_rate_limiter():
+    rate = get_settings().EMBED_RATE_LIMIT
+    return TokenBucket(rate) if rate > 0 else None
+
+@lru_cache()
+def get_embedding_executor() -> ThreadPoolExecutor:
+    # Shared by every ingestion, so EMBED_CONCURRENCY bounds the process
+    return ThreadPoolExecutor(max_workers=get_settings().EMBED_CONCURRENCY, thread_name_prefix="embed")
+
+def get_embedding_pipeline(embed_model=None) -> EmbeddingPipeline:
+    settings = get_settings()
+    return EmbeddingPipeline(
+        embed_model=embed_model,
+        batch_size=settings.EMBED_BATCH_SIZE,
+        rate_limiter=get_rate_limiter(),
+        max_retries=settings.EMBED_MAX_RETRIES,
+        executor=get_embedding_executor(),
+    )
@@ -0,0 +1,66 @@
+import hashlib
+from typing import List
+import numpy as np
+from sqlalchemy.exc import IntegrityError
+from app.db.database import get_db
+from app.db.models import EmbeddingCacheEntry
+from app.services.embedding import get_embedding_pipeline
+from app.core.metrics import record_cache
+from app.core.providers import get_embed_model
+
+# Keep IN (...) lists below SQLite's bound-parameter limit
+LOOKUP_BATCH_SIZE = 500
+
+def embedding_model_id(embed_model) -> str:
+    return f"{embed_model.class_name()}:{embed_model.model_name}"
+
+def cache_key(model_id: str, text: str) -> str:
+    return hashlib.sha256(f"{model_id}\n{text}".encode("utf-8")).hexdigest()
+
+def lookup_embeddings(db, keys: List[str]) -> dict:
+    found = {}
+    for i in range(0, len(keys), LOOKUP_BATCH_SIZE):
+        batch = keys[i:i + LOOKUP_BATCH_SIZE]
+        for entry in db.query(EmbeddingCacheEntry).filter(EmbeddingCacheEntry.key.in_(batch)):
+            found[entry.key] = np.frombuffer(entry.embedding, dtype=np.float32)
+    return found
+
+def store_embeddings(db, entries: dict):
+    db.add_all(EmbeddingCacheEntry(key=key, embedding=vector.tobytes()) for key, vector in entries.items())
+    try:
+        db.commit()
+    except IntegrityError:
+        # Another ingestion cached some of the same chunks first
+        db.rollback()
+        existing = set(lookup_embeddings(db, list(entries)))
+        db.add_all(EmbeddingCacheEntry(key=key, embedding=vector.tobytes()) for key, vector in entries.items() if key not in existing)
+        db.commit()
+
+def embed_with_cache(texts: List[str], embed_model=None):
+    embed_model = embed_model or get_embed_model()
+    model_id = embedding_model_id(embed_model)
+    keys = [cache_key(model_id, text) for text in texts]
+    db = next(get_db())
+    try:
+        cached = lookup_embeddings(db, list(set(keys)))
+        # Embed each distinct uncached text once
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        new_embeddings, stats = get_embedding_pipeline(embed_model).embed(list(missing.values()))
+        fresh = {key: np.ascontiguousarray(vector) for key, vector in zip(missing, new_embeddings)}
+        if fresh:
+            store_embeddings(db, fresh)
+    finally:
+        db.close()
+    hits = sum(1 for key in keys if key in cached)
+    record_cache("embedding", True, hits)
+    record_cache("embedding", False, len(texts) - hits)
+    stats.update(
+        chunks=len(texts),
+        embedded=len(fresh),
+        cache_hits=hits,
+        cache_hit_rate=round(hits / len(texts), 4) if texts else None,
+    )
+    if not texts:
+        return np.zeros((0, 0), dtype=np.float32), stats
+    vectors = {**cached, **fresh}
+    return np.asarray([vectors[key] for key in keys], dtype=np.float32), stats
@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from sqlalchemy import event, inspect
+from app.core.config import get_settings
+from app.core.metrics import record_cache
+from app.db.models import PDF
+from app.services.vector_store import EmbeddingStore
+from app.services.index_files import get_index_directory
+
+class IndexCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pdf_id: str):
+        with self._lock:
+            store = self._entries.get(pdf_id)
+            if store is not None:
+                self._entries.move_to_end(pdf_id)
+                self.hits += 1
+            else:
+                self.misses += 1
+        record_cache("index", store is not None)
+        return store
+
+    def put(self, pdf_id: str, store: EmbeddingStore):
+        size = store.nbytes
+        with self._lock:
+            self._discard(pdf_id)
+            # An index larger than the whole budget would only evict everything else
+            if size > self.max_bytes:
+                return
+            self._entries[pdf_id] = store
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                evicted_id = next(iter(self._entries))
+                self._discard(evicted_id)
+                self.evictions += 1
+
+    def invalidate(self, pdf_id: str):
+        with self._lock:
+            self._discard(pdf_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _discard(self, pdf_id: str):
+        store = self._entries.pop(pdf_id, None)
+        if store is not None:
+            self.current_bytes -= store.nbytes
+
+@lru_cache()
+def get_index_cache() -> IndexCache:
+    return IndexCache(get_settings().INDEX_CACHE_MB * 1024 * 1024)
+
+def remove_index_file(pdf_id: str):
+    directory = get_index_directory()
+    if directory is not None:
+        directory.remove(pdf_id)
+
+@event.listens_for(PDF, "after_update")
+def _invalidate_replaced_pdf(mapper, connection, target):
+    attrs = inspect(target).attrs
+    if attrs.vector_store.history.has_changes():
+        remove_index_file(target.id)
+    if attrs.vector_store.history.has_changes() or attrs.lexical_index.history.has_changes():
+        get_index_cache().invalidate(target.id)
+
+@event.listens_for(PDF, "after_delete")
+def _invalidate_deleted_pdf(mapper, connection, target):
+    remove_index_file(target.id)
+    get_index_cache().invalidate(target.id)
@@ -0,0 +1,57 @@
+import os
+import mmap
+import tempfile
+from functools import lru_cache
+from app.core.config import get_settings
+
+# PDF embedding matrices shared by the worker processes of one host. The
+# vector_store bytes of each PDF are written once to INDEX_DIR and
+# memory-mapped read-only, so every worker reads the same pages of the OS page
+# cache instead of keeping its own copy. Files are published by renaming a
+# complete temporary file into place, so readers never see a partial one, and
+# mappings already open stay valid when a file is replaced or removed.
+
+INDEX_FILE_SUFFIX = ".vec"
+
+class IndexDirectory:
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def file_path(self, pdf_id: str) -> str:
+        return os.path.join(self.path, pdf_id + INDEX_FILE_SUFFIX)
+
+    def open(self, pdf_id: str):
+        # A read-only mmap of the PDF's vectors, or None if not published yet
+        try:
+            with open(self.file_path(pdf_id), "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+    def publish(self, pdf_id: str, data: bytes):
+        # Workers racing to publish the same PDF write identical bytes, so the last rename winning is fine
+        fd, temp_path = tempfile.mkstemp(dir=self.path, prefix=f".{pdf_id}.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.file_path(pdf_id))
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return self.open(pdf_id)
+
+    def remove(self, pdf_id: str):
+        try:
+            os.remove(self.file_path(pdf_id))
+        except FileNotFoundError:
+            pass
+
+@lru_cache()
+def get_index_directory():
+    # None when INDEX_DIR is unset, in which case every worker loads its own copy from the database
+    path = get_settings().INDEX_DIR
+    return IndexDirectory(path) if path else None
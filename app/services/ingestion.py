@@ -0,0 +1,221 @@
+import time
+import uuid
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from sqlalchemy import delete, update
+from app.core.config import get_settings
+from app.core.logging import logger
+from app.core.metrics import QUEUE_WAIT, record_stage
+from app.db.database import get_db, async_session
+from app.db.models import IngestionJobRecord
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Finished jobs kept around for status polling
+MAX_FINISHED_JOBS = 1000
+
+class IngestionQueueFullError(Exception):
+    pass
+
+class IngestionJob:
+    def __init__(self, filename: str, chat_id: str, user_id: str = None):
+        self.id = str(uuid.uuid4())
+        self.filename = filename
+        self.chat_id = chat_id
+        self.user_id = user_id
+        self.status = QUEUED
+        self.pdf_id = None
+        self.error = None
+        self.timings = {}
+        self.stats = {}
+        self.created_at = time.time()
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            # Stages run once per page batch, so durations add up
+            self.timings[name] = round(self.timings.get(name, 0.0) + seconds, 4)
+            record_stage("ingest", name, seconds)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "filename": self.filename,
+            "chat_id": self.chat_id,
+            "pdf_id": self.pdf_id,
+            "error": self.error,
+            "timings": dict(self.timings),
+            "stats": dict(self.stats),
+        }
+
+class IngestionQueue:
+    def __init__(self, workers: int, max_depth: int, name: str = "ingestion"):
+        self.max_depth = max_depth
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._jobs = OrderedDict()
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def depth(self) -> int:
+        return self._pending
+
+    def submit(self, job: IngestionJob, fn, *args):
+        with self._lock:
+            if self._pending >= self.max_depth:
+                raise IngestionQueueFullError("Ingestion queue is full")
+            self._pending += 1
+            self._remember(job)
+        self._executor.submit(self._run, job, fn, args)
+
+    def submit_batch(self, calls: list) -> list:
+        # Runs fn(job, *args) for each (job, fn, args) and returns futures, for
+        # callers that wait for the results themselves. The batch is accepted
+        # whole, or rejected whole if it does not fit in the queue.
+        with self._lock:
+            if self._pending + len(calls) > self.max_depth:
+                raise IngestionQueueFullError("Ingestion queue is full")
+            self._pending += len(calls)
+        futures = [self._executor.submit(self._call, job, fn, args) for job, fn, args in calls]
+        for future in futures:
+            # Also runs for futures cancelled before they started
+            future.add_done_callback(self._finished)
+        return futures
+
+    def track(self, job: IngestionJob):
+        with self._lock:
+            self._remember(job)
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _call(self, job: IngestionJob, fn, args):
+        job.timings["queue_wait"] = round(time.time() - job.created_at, 4)
+        QUEUE_WAIT.labels(self.name).observe(job.timings["queue_wait"])
+        return fn(job, *args)
+
+    def _finished(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _run(self, job: IngestionJob, fn, args):
+        job.timings["queue_wait"] = round(time.time() - job.created_at, 4)
+        QUEUE_WAIT.labels(self.name).observe(job.timings["queue_wait"])
+        job.status = RUNNING
+        save_job(job)
+        try:
+            job.pdf_id = fn(job, *args)
+            job.status = DONE
+        except Exception as e:
+            logger.error(f"Ingestion job {job.id} failed: {str(e)}", exc_info=True)
+            job.error = str(e)
+            job.status = FAILED
+        finally:
+            save_job(job)
+            with self._lock:
+                self._pending -= 1
+
+    def _remember(self, job: IngestionJob):
+        self._jobs[job.id] = job
+        finished = [job_id for job_id, known in self._jobs.items() if known.finished]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+def job_record(job: IngestionJob) -> IngestionJobRecord:
+    return IngestionJobRecord(
+        id=job.id,
+        filename=job.filename,
+        chat_id=job.chat_id,
+        user_id=job.user_id,
+        status=job.status,
+        pdf_id=job.pdf_id,
+        error=job.error,
+        timings_json=json.dumps(job.timings),
+        stats_json=json.dumps(job.stats),
+        created_at=datetime.fromtimestamp(job.created_at, timezone.utc),
+    )
+
+def job_from_record(record: IngestionJobRecord) -> IngestionJob:
+    job = IngestionJob(record.filename, record.chat_id, record.user_id)
+    job.id = record.id
+    job.status = record.status
+    job.pdf_id = record.pdf_id
+    job.error = record.error
+    job.timings = json.loads(record.timings_json or "{}")
+    job.stats = json.loads(record.stats_json or "{}")
+    return job
+
+def job_update(job: IngestionJob):
+    # Jobs are stored before anything works on them; afterwards their row is
+    # only updated, so threads never race to create it
+    return (
+        update(IngestionJobRecord)
+        .where(IngestionJobRecord.id == job.id)
+        .values(
+            status=job.status,
+            pdf_id=job.pdf_id,
+            error=job.error,
+            timings_json=json.dumps(job.timings),
+            stats_json=json.dumps(job.stats),
+        )
+    )
+
+def save_job(job: IngestionJob):
+    # Called from ingestion threads as the job progresses. A status that
+    # cannot be saved must not fail the ingestion itself.
+    db = next(get_db())
+    try:
+        db.execute(job_update(job))
+        db.commit()
+    except Exception as e:
+        logger.error(f"Could not save the status of ingestion job {job.id}: {str(e)}")
+    finally:
+        db.close()
+
+async def record_job(job: IngestionJob):
+    # Stores a new job, before it is queued, and drops expired ones
+    expired = datetime.now(timezone.utc) - timedelta(seconds=get_settings().INGESTION_JOB_TTL)
+    async with async_session() as db:
+        await db.execute(delete(IngestionJobRecord).where(IngestionJobRecord.created_at < expired))
+        db.add(job_record(job))
+        await db.commit()
+
+async def update_job(job: IngestionJob):
+    async with async_session() as db:
+        await db.execute(job_update(job))
+        await db.commit()
+
+async def load_job(job_id: str):
+    async with async_session() as db:
+        record = await db.get(IngestionJobRecord, job_id)
+        return job_from_record(record) if record is not None else None
+
+@lru_cache()
+def get_ingestion_queue() -> IngestionQueue:
+    settings = get_settings()
+    return IngestionQueue(settings.INGESTION_WORKERS, settings.INGESTION_QUEUE_SIZE)
+
+@lru_cache()
+def get_bulk_ingestion_queue() -> IngestionQueue:
+    # Files of bulk uploads, which wait for their results, across all requests
+    settings = get_settings()
+    return IngestionQueue(settings.BULK_INGEST_CONCURRENCY, settings.BULK_INGEST_QUEUE_SIZE, "bulk_ingestion")
@@ -0,0 +1,99 @@
+import io
+import re
+from collections import Counter
+from typing import List
+import numpy as np
+
+# BM25 over the chunks of one PDF. Postings are stored CSR-style: the documents
+# containing term i are doc_ids[term_offsets[i]:term_offsets[i + 1]], with their
+# term frequencies at the same positions in term_freqs.
+
+TOKEN_PATTERN = re.compile(r"\w+")
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+class LexicalIndex:
+    def __init__(self, vocabulary: np.ndarray, term_offsets: np.ndarray, doc_ids: np.ndarray, term_freqs: np.ndarray, doc_lengths: np.ndarray):
+        self.vocabulary = vocabulary
+        self.term_offsets = term_offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.term_ids = {term: i for i, term in enumerate(vocabulary.tolist())}
+
+    @classmethod
+    def build(cls, texts: List[str]) -> "LexicalIndex":
+        postings = {}
+        doc_lengths = []
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths.append(sum(counts.values()))
+            for term, count in counts.items():
+                postings.setdefault(term, []).append((doc_id, count))
+        vocabulary = sorted(postings)
+        lengths = [len(postings[term]) for term in vocabulary]
+        flat = [posting for term in vocabulary for posting in postings[term]]
+        return cls(
+            np.array(vocabulary, dtype=np.str_),
+            np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            np.array([doc_id for doc_id, _ in flat], dtype=np.int32),
+            np.array([count for _, count in flat], dtype=np.float32),
+            np.array(doc_lengths, dtype=np.float32),
+        )
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.vocabulary, self.term_offsets, self.doc_ids, self.term_freqs, self.doc_lengths))
+
+    def document_frequency(self, term: str) -> int:
+        term_id = self.term_ids.get(term)
+        if term_id is None:
+            return 0
+        return int(self.term_offsets[term_id + 1] - self.term_offsets[term_id])
+
+    def score(self, terms: List[str], idf: dict, avg_length: float) -> np.ndarray:
+        # idf and avg_length are passed in so several PDFs can be scored
+        # against the statistics of the whole chat
+        scores = np.zeros(len(self), dtype=np.float32)
+        norms = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths / (avg_length or 1.0))
+        for term in terms:
+            term_id = self.term_ids.get(term)
+            if term_id is None:
+                continue
+            start, stop = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.doc_ids[start:stop]
+            freqs = self.term_freqs[start:stop]
+            scores[docs] += idf[term] * freqs * (BM25_K1 + 1) / (freqs + norms[docs])
+        return scores
+
+def corpus_statistics(indexes: List[LexicalIndex], terms: List[str]):
+    # BM25 idf per query term and the average chunk length over several indexes
+    total_docs = sum(len(index) for index in indexes)
+    total_length = sum(float(index.doc_lengths.sum()) for index in indexes)
+    idf = {}
+    for term in set(terms):
+        df = sum(index.document_frequency(term) for index in indexes)
+        idf[term] = float(np.log(1 + (total_docs - df + 0.5) / (df + 0.5)))
+    return idf, total_length / total_docs if total_docs else 0.0
+
+def serialize_lexical_index(index: LexicalIndex) -> bytes:
+    buffer = io.BytesIO()
+    np.savez(
+        buffer,
+        vocabulary=index.vocabulary,
+        term_offsets=index.term_offsets,
+        doc_ids=index.doc_ids,
+        term_freqs=index.term_freqs,
+        doc_lengths=index.doc_lengths,
+    )
+    return buffer.getvalue()
+
+def deserialize_lexical_index(blob: bytes) -> LexicalIndex:
+    arrays = np.load(io.BytesIO(blob), allow_pickle=False)
+    return LexicalIndex(arrays["vocabulary"], arrays["term_offsets"], arrays["doc_ids"], arrays["term_freqs"], arrays["doc_lengths"])
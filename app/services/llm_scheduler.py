@@ -0,0 +1,136 @@
+import time
+import anyio
+import asyncio
+import threading
+from collections import deque
+from functools import lru_cache
+from app.core.config import get_settings
+from app.core.metrics import QUEUE_WAIT
+
+class LLMQueueFullError(Exception):
+    pass
+
+class LLMQueueTimeoutError(Exception):
+    pass
+
+class LLMDeadlineExceededError(Exception):
+    pass
+
+class LLMLease:
+    # One of the scheduler's slots. release() may be called more than once, so
+    # the answer stream and the response's background task can both call it.
+    def __init__(self, scheduler, deadline: float = None):
+        self.scheduler = scheduler
+        self.deadline = deadline
+        self._released = False
+        self._lock = threading.Lock()
+
+    def check_deadline(self):
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise LLMDeadlineExceededError("LLM request exceeded its deadline")
+
+    def remaining(self):
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    async def run(self, fn, *args):
+        # Runs a blocking LLM call on a worker thread until the deadline. A call
+        # still running then is abandoned rather than waited for, so a hung
+        # request cannot hold its slot.
+        try:
+            return await asyncio.wait_for(anyio.to_thread.run_sync(fn, *args, abandon_on_cancel=True), self.remaining())
+        except asyncio.TimeoutError:
+            raise LLMDeadlineExceededError("LLM request exceeded its deadline") from None
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.scheduler.release()
+
+def _wake(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+class LLMScheduler:
+    # Caps the number of LLM generations in flight across the process. Callers
+    # beyond the cap wait in a bounded FIFO queue; a full queue fails fast so
+    # latency cannot grow without limit. Waiters are plain futures woken with
+    # call_soon_threadsafe, so the scheduler is not tied to one event loop.
+    def __init__(self, max_concurrency: int, max_queue: int, queue_timeout: float = None, request_timeout: float = None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.request_timeout = request_timeout
+        self.active = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    async def acquire(self) -> LLMLease:
+        start = time.monotonic()
+        with self._lock:
+            if self.active < self.max_concurrency and not self._waiters:
+                self.active += 1
+                QUEUE_WAIT.labels("llm").observe(0.0)
+                return self._lease(start)
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise LLMQueueFullError("Too many chat requests are waiting for the LLM")
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            with self._lock:
+                queued = waiter in self._waiters
+                if queued:
+                    self._waiters.remove(waiter)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.timed_out += 1
+            if not queued:
+                # A slot was handed to us just as we gave up; pass it on
+                self.release()
+            if isinstance(e, asyncio.TimeoutError):
+                raise LLMQueueTimeoutError("Timed out waiting for the LLM") from None
+            raise
+        QUEUE_WAIT.labels("llm").observe(time.monotonic() - start)
+        return self._lease(start)
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                # Hand the slot straight to the oldest waiter
+                waiter = self._waiters.popleft()
+                try:
+                    waiter.get_loop().call_soon_threadsafe(_wake, waiter)
+                    return
+                except RuntimeError:
+                    # The waiter's event loop is closed
+                    continue
+            self.active -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "active": self.active,
+                "queued": len(self._waiters),
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
+
+    def _lease(self, start: float) -> LLMLease:
+        return LLMLease(self, start + self.request_timeout if self.request_timeout else None)
+
+@lru_cache()
+def get_llm_scheduler() -> LLMScheduler:
+    settings = get_settings()
+    return LLMScheduler(
+        settings.LLM_MAX_CONCURRENCY,
+        settings.LLM_QUEUE_SIZE,
+        queue_timeout=settings.LLM_QUEUE_TIMEOUT,
+        request_timeout=settings.LLM_REQUEST_TIMEOUT,
+    )
@@ -1,61 +1,365 @@
-from app.services.pdf_processor import get_chat_indices
-from llama_index.core.retrievers import VectorIndexRetriever
+import asyncio
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from collections import OrderedDict
+from sqlalchemy import select
+from app.services.pdf_processor import get_chat_pdf_ids, load_indices
+from app.services.index_cache import get_index_cache
+from app.services.chat_sessions import ChatSession, get_chat_session_pool
+from app.db.models import Message
+from app.services.vector_store import EmbeddingStore
+from app.services.lexical_index import tokenize, corpus_statistics
+from app.services.context_packing import pack_context, count_tokens, DUPLICATE, NEAR_DUPLICATE, BUDGET
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
 from llama_index.core.chat_engine import ContextChatEngine
+from llama_index.core.chat_engine.types import StreamingAgentChatResponse
+from starlette.concurrency import run_in_threadpool
 from llama_index.core.memory import ChatMemoryBuffer
 from llama_index.core.llms import ChatMessage, MessageRole
-from app.db.database import get_db
-from app.db.models import Message
+from app.db.database import async_session
+from app.services.message_history import recent_message_ids_query
 from app.core.config import get_settings
-from typing import List
-
-class CombinedRetriever:
-    def __init__(self, retrievers):
-        self.retrievers = retrievers
-    def retrieve(self, query):
-        results = []
-        for retriever in self.retrievers:
-            results.extend(retriever.retrieve(query))
-        return results
-
-def get_chat_history(chat_id: str) -> List[ChatMessage]:
-    db = next(get_db())
-    chat_history = db.query(Message).filter(Message.chat_id == chat_id).order_by(Message.timestamp).limit(get_settings().CONTEXT_LENGTH).all()
-    chat_history.reverse()
-    db.close()
-    return [
-        ChatMessage(
-            role=MessageRole.USER if msg.is_user else MessageRole.ASSISTANT,
-            content=msg.content
+from app.core.providers import get_llm, get_embed_model
+from app.core.metrics import span, record_stage, record_cache, PROMPT_TOKENS, CONTEXT_CHUNKS_DROPPED
+from app.core.logging import logger
+from app.services.answer_cache import get_answer_cache, normalize_question
+from app.core.single_flight import SingleFlight
+from app.services.llm_scheduler import LLMLease, get_llm_scheduler
+from typing import Callable, List, NamedTuple
+import time
+
+DENSE = "dense"
+LEXICAL = "lexical"
+HYBRID = "hybrid"
+
+# Reciprocal rank fusion constant; 60 is the value from the original RRF paper
+RRF_K = 60
+# Candidates each search contributes to fusion and context packing, per result returned
+FUSION_CANDIDATES = 4
+
+SYSTEM_PROMPT = """You are an AI assistant helping users with questions about uploaded PDF documents. 
+            Use the context from the documents to answer questions. If you don't have enough information, say so."""
+
+def top_scores(scores: np.ndarray, k: int):
+    k = min(k, len(scores))
+    if k <= 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return [(int(i), float(scores[i])) for i in top]
+
+def reciprocal_rank_fusion(rankings, k: int):
+    fused = {}
+    for ranking in rankings:
+        for rank, (i, _) in enumerate(ranking, 1):
+            fused[i] = fused.get(i, 0.0) + 1.0 / (RRF_K + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])[:k]
+
+@lru_cache()
+def get_retrieval_pool() -> ThreadPoolExecutor:
+    # Retrievals only happen under an LLM slot, so this many threads is enough
+    return ThreadPoolExecutor(max_workers=get_settings().LLM_MAX_CONCURRENCY, thread_name_prefix="retrieve")
+
+@lru_cache()
+def get_chat_flights() -> SingleFlight:
+    # Answers being generated, by chat, PDF set and normalized question
+    return SingleFlight()
+
+class ChatRetriever(BaseRetriever):
+    # Scores every chunk of every PDF in the chat at once and returns the
+    # global top-k. Dense search is one matrix product over the stacked
+    # embeddings, lexical search is BM25 with chat-wide statistics, and hybrid
+    # mode fuses both rankings with reciprocal rank fusion. The ranked
+    # candidates are then packed into the prompt: repeated chunks, e.g. from
+    # overlapping PDFs, are dropped and the rest are kept up to a token budget.
+    def __init__(self, stores: List[EmbeddingStore], similarity_top_k: int, query_embeddings: dict = None,
+                 mode: str = DENSE, embed_model=None, token_budget: int = None, dedup_similarity: float = None):
+        super().__init__()
+        self.stores = stores
+        self.similarity_top_k = similarity_top_k
+        self.mode = mode
+        self.embed_model = embed_model
+        self.token_budget = token_budget
+        self.dedup_similarity = dedup_similarity
+        # Tokens of the chunks returned by the last retrieval
+        self.context_tokens = 0
+        # Embeddings already computed for a query string, e.g. by the answer cache
+        self.query_embeddings = query_embeddings or {}
+        self.offsets = np.cumsum([0] + [len(store) for store in stores])
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        with span("chat", "retrieve"):
+            return self._search(query_bundle)
+
+    def _search(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        if not self.offsets[-1]:
+            return []
+        candidates = self.similarity_top_k * FUSION_CANDIDATES
+        if self.mode == LEXICAL:
+            # No query embedding at all, so no embedding round trip
+            ranked = self._lexical_ranking(query_bundle.query_str, candidates)
+        elif self.mode == HYBRID:
+            # The lexical search runs while the query embedding request is in flight
+            pending = get_retrieval_pool().submit(self._embed_query, query_bundle)
+            lexical = self._lexical_ranking(query_bundle.query_str, candidates)
+            pending.result()
+            dense = self._dense_ranking(query_bundle, candidates)
+            ranked = reciprocal_rank_fusion([dense, lexical], candidates)
+        else:
+            self._embed_query(query_bundle)
+            ranked = self._dense_ranking(query_bundle, candidates)
+        return self._pack(ranked)
+
+    def _pack(self, ranked) -> List[NodeWithScore]:
+        located = [self._locate(i) for i, _ in ranked]
+        kept, stats = pack_context(
+            [store.chunks[position][0] for store, position in located],
+            [store.token_count(position) for store, position in located],
+            self.similarity_top_k,
+            self.token_budget,
+            self.dedup_similarity,
         )
-        for msg in chat_history
-    ]
-
-async def chat_with_llm(chat_id: str, user_message: str) -> str:
-    indices = get_chat_indices(chat_id)
-    retrievers = [VectorIndexRetriever(index=index) for index in indices]
-    combined_retriever = CombinedRetriever(retrievers)
-    # Create a ChatMemoryBuffer and populate it with chat history
-    chat_history = get_chat_history(chat_id)
-    memory = ChatMemoryBuffer.from_defaults(chat_history=chat_history)
-    # Create a ContextChatEngine
-    chat_engine = ContextChatEngine.from_defaults(
-        retriever=combined_retriever,
-        memory=memory,
-        system_prompt="""You are an AI assistant helping users with questions about uploaded PDF documents. 
-        Use the context from the documents to answer questions. If you don't have enough information, say so."""
+        for reason in (DUPLICATE, NEAR_DUPLICATE, BUDGET):
+            if stats[reason]:
+                CONTEXT_CHUNKS_DROPPED.labels(reason).inc(stats[reason])
+        self.context_tokens = stats["tokens"]
+        return [self._node(*ranked[k]) for k in kept]
+
+    def _embed_query(self, query_bundle: QueryBundle):
+        if query_bundle.embedding is None:
+            query_bundle.embedding = self.query_embeddings.get(query_bundle.query_str)
+        if query_bundle.embedding is None:
+            embed_model = self.embed_model or get_embed_model()
+            query_bundle.embedding = embed_model.get_agg_embedding_from_queries(query_bundle.embedding_strs)
+
+    def _dense_ranking(self, query_bundle: QueryBundle, k: int):
+        query = np.asarray(query_bundle.embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        # Scored store by store, so the chat's vectors are never copied into one matrix
+        return top_scores(np.concatenate([store.scores(query) for store in self.stores]), k)
+
+    def _lexical_ranking(self, query: str, k: int):
+        terms = tokenize(query)
+        indexes = [store.lexical for store in self.stores]
+        idf, avg_length = corpus_statistics(indexes, terms)
+        scores = np.concatenate([index.score(terms, idf, avg_length) for index in indexes])
+        return [(i, score) for i, score in top_scores(scores, k) if score > 0]
+
+    def _locate(self, i: int):
+        s = int(np.searchsorted(self.offsets, i, side="right") - 1)
+        return self.stores[s], int(i - self.offsets[s])
+
+    def _node(self, i: int, score: float) -> NodeWithScore:
+        store, position = self._locate(i)
+        return NodeWithScore(node=store.get_node(position), score=score)
+
+def to_chat_message(is_user: bool, content: str) -> ChatMessage:
+    return ChatMessage(role=MessageRole.USER if is_user else MessageRole.ASSISTANT, content=content)
+
+def build_retriever(stores: List[EmbeddingStore]) -> ChatRetriever:
+    settings = get_settings()
+    return ChatRetriever(
+        stores,
+        similarity_top_k=settings.SIMILARITY_TOP_K,
+        mode=settings.RETRIEVAL_MODE,
+        token_budget=settings.CONTEXT_TOKEN_BUDGET,
+        dedup_similarity=settings.CONTEXT_DEDUP_SIMILARITY,
     )
 
-    # Generate response
-    response = chat_engine.chat(user_message)
+async def open_chat_session(chat_id: str, message_id: str = None) -> ChatSession:
+    # Checks out the chat's warm session, or builds one. Other workers may have
+    # changed the chat, so one round trip reads its PDF ids and latest message
+    # ids; indexes are only reloaded when those PDFs changed or are still being
+    # indexed, and only messages the session has not seen are read. The
+    # question being answered (message_id) is not part of the history. The
+    # caller returns the session to the pool, or drops it if the turn fails.
+    pool = get_chat_session_pool()
+    session = pool.checkout(chat_id)
+    async with async_session() as db:
+        pdf_ids = await get_chat_pdf_ids(db, chat_id)
+        with span("chat", "history"):
+            result = await db.execute(recent_message_ids_query(chat_id, get_settings().CONTEXT_LENGTH, exclude_id=message_id))
+            message_ids = list(result.scalars())[::-1]
+            known = session.messages if session is not None else {}
+            missing = [message_id for message_id in message_ids if message_id not in known]
+            fetched = {}
+            if missing:
+                result = await db.execute(select(Message.id, Message.is_user, Message.content).where(Message.id.in_(missing)))
+                fetched = {row.id: (row.is_user, row.content) for row in result}
+        cache = get_index_cache()
+        if session is None or session.pdf_ids != pdf_ids or any(cache.get(store.pdf_id) is not store for store in session.retriever.stores):
+            session = ChatSession(chat_id, pdf_ids, build_retriever(await load_indices(db, pdf_ids)))
+    # A message deleted since its id was read is left out
+    session.messages = OrderedDict(
+        (message_id, known.get(message_id) or fetched[message_id]) for message_id in message_ids if message_id in known or message_id in fetched
+    )
+    return session
+
+class ChatAnswer(NamedTuple):
+    stream: object
+    cache_hit: bool
+    # Frees the LLM slot held by the stream; safe to call more than once
+    release: Callable[[], None]
+
+def no_release():
+    pass
+
+async def chat_with_llm(chat_id: str, user_message: str, message_id: str = None) -> ChatAnswer:
+    # message_id is the id the question was stored under, if it was
+    session = await open_chat_session(chat_id, message_id)
+    pool = get_chat_session_pool()
+    chat_history = [to_chat_message(*message) for message in session.messages.values()]
+    if message_id is not None:
+        # Kept for the next turn's history, after this turn's history was taken
+        session.messages[message_id] = (True, user_message)
+    answer_cache = get_answer_cache()
+    cache_context = answer_cache.context_key(
+        chat_id,
+        session.pdf_ids,
+        [f"{msg.role.value}: {msg.content}" for msg in chat_history],
+    )
+    query_embedding = None
+    if answer_cache.similarity_threshold > 0:
+        with span("chat", "query_embed"):
+            query_embedding = await run_in_threadpool(get_embed_model().get_query_embedding, user_message)
+    # Answers over a PDF still being indexed would go stale as its pages are added
+    cacheable = all(store.complete for store in session.retriever.stores)
+    cached_answer = answer_cache.get(cache_context, user_message, query_embedding) if cacheable else None
+    if cached_answer is not None:
+        pool.checkin(session)
+        return ChatAnswer(replay_answer(cached_answer), True, no_release)
+
+    # The same question on the same PDFs already being answered is waited
+    # for instead of generated again
+    flights = get_chat_flights()
+    flight_key = (chat_id, tuple(sorted(session.pdf_ids)), normalize_question(user_message))
+    flight, leader = flights.join(flight_key)
+    record_cache("chat_flight", not leader)
+    if not leader:
+        with span("chat", "shared_answer"):
+            try:
+                shared_answer = await asyncio.wait_for(asyncio.wrap_future(flight), get_settings().LLM_REQUEST_TIMEOUT)
+            except (RuntimeError, asyncio.TimeoutError):
+                # That answer failed or was abandoned, so this turn generates its own
+                shared_answer = None
+        if shared_answer is not None:
+            pool.checkin(session)
+            return ChatAnswer(replay_answer(shared_answer), True, no_release)
+
+    def abandon():
+        if leader:
+            flights.finish(flight_key, flight, error=RuntimeError("The shared answer was not completed"))
+
+    # Raises LLMQueueFullError / LLMQueueTimeoutError when the LLM is saturated
+    try:
+        with span("chat", "llm_queue"):
+            lease = await get_llm_scheduler().acquire()
+    except BaseException:
+        abandon()
+        raise
+
+    def release():
+        lease.release()
+        abandon()
+
+    try:
+        retriever = session.retriever
+        retriever.query_embeddings = {user_message: query_embedding} if query_embedding is not None else {}
+        # Create a ChatMemoryBuffer and populate it with chat history
+        memory = ChatMemoryBuffer.from_defaults(chat_history=chat_history)
+        # Create a ContextChatEngine
+        chat_engine = ContextChatEngine.from_defaults(
+            retriever=retriever,
+            memory=memory,
+            llm=get_llm(),
+            system_prompt=SYSTEM_PROMPT
+        )
+
+        # Start generating; retrieval and the first LLM request happen here, so
+        # errors surface before the HTTP response has started
+        with span("chat", "llm_start"):
+            response = await lease.run(chat_engine.stream_chat, user_message)
+        record_prompt_tokens(chat_id, chat_history, user_message, retriever.context_tokens)
+    except BaseException:
+        release()
+        raise
+    stream = return_session(stream_chat_response(response, lease), session)
+    if cacheable:
+        stream = cache_answer(stream, cache_context, user_message, query_embedding)
+    if leader:
+        stream = share_answer(stream, flight_key, flight)
+    return ChatAnswer(stream, False, release)
+
+def record_prompt_tokens(chat_id: str, chat_history: List[ChatMessage], user_message: str, context_tokens: int):
+    # An estimate with the local tokenizer; the prompt template's own few
+    # words are left out
+    parts = {
+        "system": count_tokens(SYSTEM_PROMPT),
+        "history": sum(count_tokens(msg.content or "") for msg in chat_history),
+        "context": context_tokens,
+        "question": count_tokens(user_message),
+    }
+    parts["total"] = sum(parts.values())
+    for part, tokens in parts.items():
+        PROMPT_TOKENS.labels(part).observe(tokens)
+    logger.info(f"Prompt for chat {chat_id}: {parts['total']} tokens ({parts['context']} of context)")
+
+async def return_session(stream, session: ChatSession):
+    # The session is free for the chat's next turn once generation has finished
+    async for chunk in stream:
+        yield chunk
+    get_chat_session_pool().checkin(session)
+
+async def share_answer(stream, flight_key: tuple, flight):
+    # Hands the complete answer to the identical questions waiting for it
+    chunks = []
+    try:
+        async for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+    except BaseException:
+        get_chat_flights().finish(flight_key, flight, error=RuntimeError("The shared answer was not completed"))
+        raise
+    get_chat_flights().finish(flight_key, flight, "".join(chunks))
+
+async def replay_answer(answer: str):
+    yield answer
 
-    # Prepare the full response
-    full_response = f"Answer: {response.response}\n\nSources:\n"
-    for i, node in enumerate(response.source_nodes, 1):
-        full_response += f"{i}. {node.node.get_content()[:100]}...\n"
+async def cache_answer(stream, cache_context: tuple, question: str, query_embedding=None):
+    chunks = []
+    async for chunk in stream:
+        chunks.append(chunk)
+        yield chunk
+    # Only answers that were streamed to the end get here
+    get_answer_cache().put(cache_context, question, "".join(chunks), query_embedding)
 
-    return full_response
+def format_sources(source_nodes) -> str:
+    sources = "\n\nSources:\n"
+    for i, node in enumerate(source_nodes, 1):
+        sources += f"{i}. {node.node.get_content()[:100]}...\n"
+    return sources
 
-async def stream_long_response(full_response: str):
-    chunk_size = 100000
-    for i in range(0, len(full_response), chunk_size):
-        yield full_response[i:i+chunk_size]
\ No newline at end of file
+async def stream_chat_response(response: StreamingAgentChatResponse, lease: LLMLease = None):
+    # Tokens are pulled from the LLM one at a time on a worker thread, so
+    # generation stops as soon as the client disconnects or the deadline
+    # passes, even while the LLM is stuck on a token
+    tokens = response.response_gen
+    pull = lease.run if lease else run_in_threadpool
+    start = time.perf_counter()
+    try:
+        yield "Answer: "
+        while (token := await pull(next, tokens, None)) is not None:
+            yield token
+        yield format_sources(response.source_nodes)
+    finally:
+        try:
+            tokens.close()
+        except ValueError:
+            # Still running in the worker thread that timed out
+            pass
+        # Runs after the headers were sent, so only /metrics sees it
+        record_stage("chat", "generate", time.perf_counter() - start)
+        if lease:
+            lease.release()
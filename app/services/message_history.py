@@ -0,0 +1,43 @@
+import base64
+import binascii
+from datetime import datetime
+from sqlalchemy import select, tuple_
+from app.db.models import Message
+
+# Messages are read newest first along the (chat_id, timestamp, id) index, so
+# fetching a page or the last N messages costs O(N) however long the chat is.
+# The id breaks ties between messages stored in the same instant.
+
+def encode_cursor(message: Message) -> str:
+    raw = f"{message.timestamp.isoformat()}|{message.id}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, message_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 1)
+        return datetime.fromisoformat(timestamp), message_id
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+def recent_messages_query(chat_id: str, limit: int, before: str = None):
+    query = select(Message).where(Message.chat_id == chat_id)
+    if before:
+        query = query.where(tuple_(Message.timestamp, Message.id) < tuple_(*decode_cursor(before)))
+    return query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit)
+
+def recent_message_ids_query(chat_id: str, limit: int, exclude_id: str = None):
+    # exclude_id leaves out the question being answered, which the chat engine adds itself
+    query = select(Message.id).where(Message.chat_id == chat_id)
+    if exclude_id:
+        query = query.where(Message.id != exclude_id)
+    return query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit)
+
+async def fetch_recent_messages(db, chat_id: str, limit: int, before: str = None):
+    # Returns up to `limit` messages older than the cursor, oldest first, and
+    # the cursor for the page before them (None when there is none)
+    result = await db.execute(recent_messages_query(chat_id, limit + 1, before))
+    messages = list(result.scalars())
+    next_cursor = encode_cursor(messages[limit - 1]) if len(messages) > limit else None
+    messages = messages[:limit]
+    messages.reverse()
+    return messages, next_cursor
@@ -0,0 +1,153 @@
+import os
+import math
+import signal
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from typing import List, Tuple
+import PyPDF2
+
+# This module is imported by spawned worker processes, so it must stay free of
+# app settings, database and llama_index imports.
+
+MAX_PAGES_PER_TASK = 32
+# Below this many pages the process round trip costs more than it saves
+INLINE_MAX_PAGES = 8
+# Grace period past a range's page timeouts before its worker is given up on
+BACKSTOP_SECONDS = 5
+
+class PageTimeoutError(Exception):
+    pass
+
+def can_interrupt() -> bool:
+    # SIGALRM only exists on Unix and only works in a process's main thread,
+    # which is where ProcessPoolExecutor runs tasks
+    return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+@contextmanager
+def page_deadline(seconds: float):
+    if not seconds or not can_interrupt():
+        yield
+        return
+
+    def on_timeout(signum, frame):
+        raise PageTimeoutError()
+
+    previous = signal.signal(signal.SIGALRM, on_timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def read_pdf(file_path: str) -> PyPDF2.PdfReader:
+    try:
+        return PyPDF2.PdfReader(file_path)
+    except PyPDF2.errors.PdfReadError:
+        raise ValueError("Invalid PDF file")
+
+# Each worker keeps the last reader it opened: consecutive ranges of the same
+# upload usually land on the same process, and re-parsing the xref is costly
+_last_reader = (None, None)
+
+def open_reader(file_path: str) -> PyPDF2.PdfReader:
+    global _last_reader
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_mtime_ns, stat.st_size)
+    cached_key, reader = _last_reader
+    if cached_key != key:
+        reader = PyPDF2.PdfReader(file_path)
+        _last_reader = (key, reader)
+    return reader
+
+def extract_page_range(file_path: str, start: int, stop: int, page_timeout: float = None, reader: PyPDF2.PdfReader = None) -> List[Tuple[str, bool]]:
+    if reader is None:
+        reader = open_reader(file_path) if multiprocessing.parent_process() else PyPDF2.PdfReader(file_path)
+    pages = []
+    for page_index in range(start, stop):
+        try:
+            with page_deadline(page_timeout):
+                pages.append((reader.pages[page_index].extract_text(), False))
+        except PageTimeoutError:
+            pages.append(("", True))
+    return pages
+
+def page_ranges(num_pages: int, workers: int):
+    pages_per_task = max(1, min(MAX_PAGES_PER_TASK, math.ceil(num_pages / workers)))
+    return [(start, min(start + pages_per_task, num_pages)) for start in range(0, num_pages, pages_per_task)]
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+def get_extraction_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        # A pool whose worker died can take no more tasks
+        if _pool is None or _pool_workers != workers or _pool._broken:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            # spawn rather than fork: ingestion runs in threads, and forking a
+            # threaded process can deadlock the child
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+def replace_extraction_pool(pool: ProcessPoolExecutor):
+    # A worker whose alarm could not fire (e.g. stuck in C code) stays busy
+    # for good, so its pool is dropped and its processes killed; shutdown()
+    # alone would wait for them. The next extraction starts a new pool.
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    # No public way to stop the workers before Python 3.14
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def extract_pages(file_path: str, workers: int, page_timeout: float = None, start: int = 0, stop: int = None, reader: PyPDF2.PdfReader = None):
+    # Returns the text of every page from start to stop (all pages by default)
+    # in order, and the indexes of pages that were skipped because they
+    # exceeded page_timeout. Callers extracting one file range by range pass
+    # the reader they opened, so it is parsed once in this process.
+    reader = reader or read_pdf(file_path)
+    num_pages = len(reader.pages)
+    stop = num_pages if stop is None else min(stop, num_pages)
+    inline = workers <= 1 or stop - start <= INLINE_MAX_PAGES
+    if inline and page_timeout and not can_interrupt():
+        # Ingestion runs on worker threads, where a slow page could not be
+        # interrupted; the pool's processes enforce page_timeout instead
+        inline = False
+    if inline:
+        results = extract_page_range(file_path, start, stop, page_timeout, reader)
+    else:
+        pool = get_extraction_pool(max(workers, 1))
+        ranges = [(start + first, start + last) for first, last in page_ranges(stop - start, workers)]
+        futures = [pool.submit(extract_page_range, file_path, first, last, page_timeout) for first, last in ranges]
+        results = []
+        stuck = False
+        for (first, last), future in zip(ranges, futures):
+            # Backstop in case the in-worker alarm could not fire
+            timeout = page_timeout * (last - first) + BACKSTOP_SECONDS if page_timeout else None
+            for attempt in range(2):
+                try:
+                    results.extend(future.result(timeout=timeout))
+                except FutureTimeoutError:
+                    results.extend(("", True) for _ in range(first, last))
+                    stuck = True
+                except BrokenProcessPool:
+                    if attempt:
+                        raise
+                    # Another extraction replaced the pool under this range; run it on the new one
+                    future = get_extraction_pool(max(workers, 1)).submit(extract_page_range, file_path, first, last, page_timeout)
+                    continue
+                break
+        if stuck:
+            replace_extraction_pool(pool)
+    texts = [text for text, _ in results]
+    timed_out = [index for index, (_, skipped) in enumerate(results, start) if skipped]
+    return texts, timed_out
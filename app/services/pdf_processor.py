@@ -1,111 +1,583 @@
+import time
 import uuid
-import pickle
+import json
+import asyncio
 import hashlib
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from fastapi import UploadFile, HTTPException
-from llama_index.core import SimpleDirectoryReader, VectorStoreIndex
-from llama_index.core.vector_stores import SimpleVectorStore
-from llama_index.core.storage.storage_context import StorageContext
-from app.db.database import get_db
-from app.db.models import PDF, Chat
+from sqlalchemy import select, update, or_
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from app.db.database import get_db, async_session
+from app.db.models import PDF, PDFChunk, Chat, chat_pdf_association
+from sqlalchemy.orm import selectinload, undefer
+from app.services.index_cache import get_index_cache
+from app.services.index_files import get_index_directory
+from app.services.answer_cache import get_answer_cache
+from app.services.chat_sessions import get_chat_session_pool
+from app.services.vector_store import embed_documents, serialize_embeddings, deserialize_embeddings, load_embedding_store
+from app.services.lexical_index import LexicalIndex, serialize_lexical_index
+from app.core.logging import logger
+from app.services.ingestion import IngestionJob, RUNNING, DONE, FAILED, get_ingestion_queue, get_bulk_ingestion_queue, save_job, record_job, update_job, job_update
+from app.core.single_flight import SingleFlight
+from app.core.config import get_settings
+from app.core.metrics import span, record_stage, record_cache, INDEX_BYTES_LOADED
+from app.services.pdf_extraction import extract_pages, read_pdf
+from typing import List, TYPE_CHECKING
 import PyPDF2
 import os
+import tempfile
 
-async def process_pdf(file: UploadFile, chat_id: str = None, current_user=None):
-    content = await file.read()
-    file_hash = hashlib.md5(content).hexdigest()
+if TYPE_CHECKING:
+    from llama_index.core import Document
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Per-file outcomes of a bulk upload, besides FAILED
+CREATED = "created"
+EXISTING = "existing"
+DUPLICATE = "duplicate"
+
+@lru_cache()
+def get_ingestion_flights() -> SingleFlight:
+    # In-flight ingestions by file hash
+    return SingleFlight()
+
+def get_or_create_chat(db, chat_id: str, user_id: str = None) -> Chat:
+    chat = db.query(Chat).filter(Chat.id == chat_id).first()
+    if not chat:
+        chat = Chat(id=chat_id, user_id=user_id)
+        db.add(chat)
+    return chat
+
+def add_pdf_to_chat(db, pdf, chat_id: str, user_id: str = None):
+    chat = get_or_create_chat(db, chat_id, user_id)
+    if pdf in chat.pdfs:
+        raise HTTPException(status_code=400, detail="This PDF has already been added to this chat")
+    chat.pdfs.append(pdf)
+    get_answer_cache().invalidate_chat(chat_id)
+    get_chat_session_pool().invalidate(chat_id)
+
+def max_upload_size() -> int:
+    return get_settings().FILE_SIZE_MB * 1024 * 1024
+
+async def spool_upload(file: UploadFile):
+    # Copy the upload to a private temp file chunk by chunk, hashing as we go,
+    # so memory use does not depend on the file size
+    max_size = max_upload_size()
+    file_hash = hashlib.md5()
+    size = 0
+    fd, temp_file_path = tempfile.mkstemp(prefix="upload-", suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_size:
+                    raise HTTPException(status_code=413, detail=f"File size exceeds the limit of {max_size / (1024 * 1024):.2f} MB")
+                file_hash.update(chunk)
+                temp_file.write(chunk)
+    except BaseException:
+        os.remove(temp_file_path)
+        raise
+    return temp_file_path, file_hash.hexdigest()
+
+async def process_pdf(file: UploadFile, chat_id: str = None, current_user=None) -> IngestionJob:
+    with span("upload", "spool"):
+        temp_file_path, file_hash = await spool_upload(file)
+    user_id = current_user.id if current_user else None
+    # If no chat_id provided, the PDF goes into a new chat
+    job = IngestionJob(file.filename, chat_id or str(uuid.uuid4()), user_id)
+    # Stored before it is queued, so every worker process can report on it
+    await record_job(job)
+    submitted = False
+    try:
+        async with async_session() as db:
+            # Check if this file has already been uploaded
+            with span("upload", "dedup"):
+                result = await db.execute(select(PDF).where(PDF.file_hash == file_hash))
+                existing_pdf = result.scalars().first()
+            if existing_pdf:
+                # Read before any rollback expires the row
+                pdf_id, partial, pages_indexed = existing_pdf.id, existing_pdf.partial, existing_pdf.pages_indexed
+                job.pdf_id = pdf_id
+                duplicate = None
+                try:
+                    # add_pdf_to_chat is shared with the ingestion workers, which use sync sessions
+                    await db.run_sync(lambda session: add_pdf_to_chat(session, existing_pdf, job.chat_id, user_id))
+                except HTTPException as e:
+                    # Uploading a partial PDF to a chat that has it may still resume it
+                    if not partial:
+                        raise
+                    await db.rollback()
+                    duplicate = e
+                if partial:
+                    claimed = await db.execute(claim_partial_pdf(pdf_id, pages_indexed))
+                    if claimed.rowcount == 1:
+                        logger.info(f"Resuming PDF {pdf_id} from page {pages_indexed}")
+                        get_ingestion_queue().submit(job, ingest_pdf, temp_file_path, file_hash, None, pdf_id)
+                        submitted = True
+                        await db.commit()
+                        return job
+                if duplicate is not None:
+                    raise duplicate
+                job.status = DONE
+                await db.execute(job_update(job))
+                await db.commit()
+                get_ingestion_queue().track(job)
+                return job
+
+        flights = get_ingestion_flights()
+        flight, leader = flights.join(file_hash)
+        if not leader:
+            # The same file is being ingested for another upload right now; share its PDF
+            record_cache("ingestion_flight", True)
+            get_ingestion_queue().track(job)
+            flight.add_done_callback(lambda done: attach_shared_pdf(job, done))
+            return job
+        record_cache("ingestion_flight", False)
+        # If the file doesn't exist, process it in the background; the worker owns the temp file from here
+        try:
+            get_ingestion_queue().submit(job, ingest_shared, temp_file_path, file_hash, flight)
+        except Exception as e:
+            flights.finish(file_hash, flight, error=e)
+            raise
+        submitted = True
+        return job
+    except Exception as e:
+        # Rejected uploads leave a failed job rather than one queued for good
+        job.error = e.detail if isinstance(e, HTTPException) else str(e)
+        job.status = FAILED
+        await update_job(job)
+        raise
+    finally:
+        if not submitted:
+            os.remove(temp_file_path)
+
+def attach_shared_pdf(job: IngestionJob, flight):
+    # Completes a job whose file was ingested by a concurrent upload. Runs in
+    # the thread that finished that ingestion, or right away if it already has.
+    job.status = RUNNING
+    job.timings["wait"] = round(time.time() - job.created_at, 4)
     db = next(get_db())
-    # Check if this file has already been uploaded
-    existing_pdf = db.query(PDF).filter(PDF.file_hash == file_hash).first()
-    if existing_pdf:
-        if chat_id:
-            chat = db.query(Chat).filter(Chat.id == chat_id).first()
-            if not chat:
-                chat = Chat(id=chat_id, user_id=current_user.id if current_user else None)
-                db.add(chat)
-            if existing_pdf not in chat.pdfs:
-                chat.pdfs.append(existing_pdf)
-            else:
-                raise HTTPException(status_code=400, detail="This PDF has already been added to this chat")
-            db.commit()
-        else:
-            # If no chat_id provided, we'll create a new chat for this existing PDF
-            new_chat = Chat(id=str(uuid.uuid4()), user_id=current_user.id if current_user else None)
-            db.add(new_chat)
-            new_chat.pdfs.append(existing_pdf)
-            db.commit()
-            chat_id = new_chat.id
-        pdf_id = existing_pdf.id
+    try:
+        pdf = db.get(PDF, flight.result())
+        add_pdf_to_chat(db, pdf, job.chat_id, job.user_id)
+        db.commit()
+        job.pdf_id = pdf.id
+        job.status = DONE
+    except Exception as e:
+        job.error = e.detail if isinstance(e, HTTPException) else str(e)
+        job.status = FAILED
+    finally:
         db.close()
-        return pdf_id, chat_id
+    save_job(job)
 
-    # If the file doesn't exist, process it
-    temp_file_path = f"/tmp/{file.filename}"
+def extract_documents(file_path: str, filename: str, pages: tuple = None, reader: PyPDF2.PdfReader = None) -> List["Document"]:
+    # pages is a (start, stop) range of page indexes, all pages by default
+    from llama_index.core import Document
+    settings = get_settings()
+    start, stop = pages or (0, None)
     try:
-        with open(temp_file_path, "wb") as temp_file:
-            temp_file.write(content)
-        
-        # Validate PDF
-        with open(temp_file_path, "rb") as pdf_file:
-            try:
-                PyPDF2.PdfReader(pdf_file)
-            except PyPDF2.errors.PdfReadError:
-                raise ValueError("Invalid PDF file")
-
-        # Use LlamaIndex to load and process the PDF
-        documents = SimpleDirectoryReader(input_files=[temp_file_path]).load_data()
-        
-        # Create a SimpleVectorStore
-        vector_store = SimpleVectorStore()
-        storage_context = StorageContext.from_defaults(vector_store=vector_store)
-        
-        # Create an index from the documents
-        index = VectorStoreIndex.from_documents(
-            documents,
-            storage_context=storage_context,
+        texts, timed_out = extract_pages(file_path, settings.PDF_EXTRACT_WORKERS, settings.PDF_PAGE_TIMEOUT, start, stop, reader)
+    except PyPDF2.errors.PdfReadError:
+        raise ValueError("Invalid PDF file")
+    if timed_out:
+        logger.warning(f"Skipped pages {[index + 1 for index in timed_out]} of {filename}: extraction timed out")
+    return [
+        Document(text=text, metadata={"page_label": str(page_number), "file_name": filename})
+        for page_number, text in enumerate(texts, start + 1)
+    ]
+
+def add_embedding_stats(total: dict, stats: dict):
+    # Counts add up over the page batches of one PDF; rates are recomputed from them
+    for key in ("chunks", "embedded", "cache_hits", "batches", "retries", "seconds"):
+        total[key] = round(total.get(key, 0) + stats.get(key, 0), 4)
+    total["cache_hit_rate"] = round(total["cache_hits"] / total["chunks"], 4) if total["chunks"] else None
+    total["chunks_per_second"] = round(total["chunks"] / total["seconds"], 2) if total["seconds"] else None
+
+def embed_pages(job: IngestionJob, temp_file_path: str, pages: tuple = None, reader: PyPDF2.PdfReader = None):
+    with job.stage("parse"):
+        # Validates and extracts the PDF in a single pass
+        documents = extract_documents(temp_file_path, job.filename, pages=pages, reader=reader)
+
+    with job.stage("embed"):
+        # Chunk and embed the documents
+        embeddings, chunks, stats = embed_documents(documents)
+        add_embedding_stats(job.stats, stats)
+        logger.info(
+            f"Embedded {stats['embedded']} of {stats['chunks']} chunks of {job.filename} "
+            f"at {stats.get('chunks_per_second')} chunks/s, cache hit rate {stats['cache_hit_rate']}"
         )
-        
-        # Generate a unique ID for this PDF
-        pdf_id = str(uuid.uuid4())
-        
-        # Serialize the entire index
-        serialized_index = pickle.dumps(index)
-        
-        # Create a new PDF instance
-        new_pdf = PDF(id=pdf_id, filename=file.filename, vector_store=serialized_index, file_hash=file_hash)
-        db.add(new_pdf)
-
-        if chat_id:
-            chat = db.query(Chat).filter(Chat.id == chat_id).first()
-            if not chat:
-                chat = Chat(id=chat_id)
-                db.add(chat)
-            chat.pdfs.append(new_pdf)
-        else:
-            new_chat = Chat(id=str(uuid.uuid4()))
-            db.add(new_chat)
-            new_chat.pdfs.append(new_pdf)
-            chat_id = new_chat.id
+    return embeddings, chunks, len(documents)
 
-        db.commit()
-        return pdf_id, chat_id
-    except ValueError as ve:
-        raise HTTPException(status_code=400, detail=str(ve))
+def prepare_pdf(job: IngestionJob, temp_file_path: str):
+    # The whole PDF at once, for bulk uploads
+    embeddings, chunks, page_count = embed_pages(job, temp_file_path)
+    with job.stage("index"):
+        lexical = LexicalIndex.build([text for text, _ in chunks])
+    return embeddings, chunks, lexical, page_count
+
+def chunk_rows(chunks, offset: int = 0, pdf_id: str = None) -> List[PDFChunk]:
+    return [
+        PDFChunk(pdf_id=pdf_id, position=position, text=text, metadata_json=json.dumps(metadata))
+        for position, (text, metadata) in enumerate(chunks, offset)
+    ]
+
+def build_pdf(filename: str, file_hash: str, embeddings, chunks, lexical: LexicalIndex, page_count: int = None, pages_indexed: int = None) -> PDF:
+    # The embedding matrix and BM25 index go on the PDF and the chunk texts alongside them
+    pdf = PDF(
+        id=str(uuid.uuid4()),
+        filename=filename,
+        vector_store=serialize_embeddings(embeddings, get_settings().EMBEDDING_STORAGE),
+        lexical_index=serialize_lexical_index(lexical),
+        file_hash=file_hash,
+        page_count=page_count,
+        pages_indexed=page_count if pages_indexed is None else pages_indexed,
+    )
+    pdf.chunks = chunk_rows(chunks)
+    return pdf
+
+def page_batches(page_count: int, first_batch: int, start: int = 0):
+    # The first batch is stored quickly whatever the PDF's length. Each later
+    # one is as large as everything before it, so the PDF row, rewritten per
+    # batch, is written about twice over in total. Resumed PDFs continue from
+    # the pages already indexed.
+    if start == 0 and (first_batch <= 0 or page_count <= first_batch):
+        return [(0, page_count)]
+    batches = []
+    while start < page_count:
+        stop = min(page_count, start + max(first_batch, start, 1))
+        batches.append((start, stop))
+        start = stop
+    return batches
+
+def append_rows(matrix: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    # Batches without text embed to an empty (0, 0) matrix
+    if not len(rows):
+        return matrix
+    return np.concatenate([matrix, rows]) if len(matrix) else rows
+
+def ingest_pdf(job: IngestionJob, temp_file_path: str, file_hash: str, on_stored=None, resume_id: str = None) -> str:
+    # Pages are indexed in batches. The PDF is stored and attached to the
+    # chat with the first one, so it can be chatted with while the rest is
+    # appended; on_stored is then called with its id. With resume_id the
+    # pages that PDF is missing are appended to it instead.
+    db = next(get_db())
+    settings = get_settings()
+    pdf_id = resume_id
+    try:
+        with job.stage("parse"):
+            # Parsed once; every batch extracts its pages from this reader
+            reader = read_pdf(temp_file_path)
+            page_count = len(reader.pages)
+        job.stats["pages"] = page_count
+        embeddings, chunks, indexed = np.zeros((0, 0), dtype=np.float32), [], 0
+        if resume_id is not None:
+            with job.stage("load"):
+                embeddings, chunks, indexed = load_indexed_pages(db, resume_id)
+        for start, stop in page_batches(page_count, settings.INGEST_FIRST_BATCH_PAGES, indexed):
+            batch_embeddings, batch_chunks, _ = embed_pages(job, temp_file_path, (start, stop), reader)
+            embeddings = append_rows(embeddings, batch_embeddings)
+            offset = len(chunks)
+            chunks.extend(batch_chunks)
+            with job.stage("index"):
+                lexical = LexicalIndex.build([text for text, _ in chunks])
+
+            first = pdf_id is None
+            with job.stage("store"):
+                if first:
+                    new_pdf = build_pdf(job.filename, file_hash, embeddings, chunks, lexical, page_count, stop)
+                    new_pdf.indexed_at = datetime.now(timezone.utc)
+                    db.add(new_pdf)
+                    # The chat only sees the PDF once this commit succeeds
+                    add_pdf_to_chat(db, new_pdf, job.chat_id, job.user_id)
+                    try:
+                        db.commit()
+                    except IntegrityError:
+                        # Stored meanwhile by another worker process; attach that copy instead
+                        db.rollback()
+                        existing_pdf = db.query(PDF).filter(PDF.file_hash == file_hash).first()
+                        if existing_pdf is None:
+                            raise
+                        add_pdf_to_chat(db, existing_pdf, job.chat_id, job.user_id)
+                        db.commit()
+                        return existing_pdf.id
+                    pdf_id = job.pdf_id = new_pdf.id
+                elif not append_pages(db, pdf_id, start, stop, embeddings, lexical, batch_chunks, offset):
+                    logger.warning(f"Stopped indexing PDF {pdf_id} at page {start}: another upload is indexing it")
+                    return pdf_id
+            job.stats["pages_indexed"] = stop
+            if stop < page_count:
+                # Other workers see the pdf_id and progress while it runs
+                save_job(job)
+            if first and on_stored is not None:
+                on_stored(pdf_id)
+        return pdf_id
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
+        if pdf_id is not None:
+            mark_indexing_failed(db, pdf_id, e)
+        if isinstance(e, ValueError):
+            raise
+        raise RuntimeError(f"Error processing PDF: {str(e)}") from e
     finally:
         db.close()
         # Clean up the temporary file
-        if os.path.exists(temp_file_path):
+        os.remove(temp_file_path)
+
+def load_indexed_pages(db, pdf_id: str):
+    # The vectors and chunks of a partially indexed PDF, to append to
+    pdf = db.query(PDF).options(undefer(PDF.vector_store), selectinload(PDF.chunks)).filter(PDF.id == pdf_id).one()
+    chunks = [(chunk.text, json.loads(chunk.metadata_json or "{}")) for chunk in pdf.chunks]
+    embeddings = deserialize_embeddings(pdf.vector_store) if chunks else np.zeros((0, 0), dtype=np.float32)
+    return embeddings, chunks, pdf.pages_indexed
+
+def append_pages(db, pdf_id: str, start: int, stop: int, embeddings, lexical: LexicalIndex, batch_chunks, offset: int) -> bool:
+    # Only applies while the PDF still ends at `start`, so two uploads that
+    # resumed the same PDF never both append to it. Partial PDFs are never
+    # cached or published, so the row is updated without the ORM.
+    result = db.execute(
+        update(PDF)
+        .where(PDF.id == pdf_id, PDF.pages_indexed == start)
+        .values(
+            vector_store=serialize_embeddings(embeddings, get_settings().EMBEDDING_STORAGE),
+            lexical_index=serialize_lexical_index(lexical),
+            pages_indexed=stop,
+            indexed_at=datetime.now(timezone.utc),
+            index_error=None,
+        )
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        return False
+    db.add_all(chunk_rows(batch_chunks, offset, pdf_id))
+    db.commit()
+    return True
+
+def mark_indexing_failed(db, pdf_id: str, error: Exception):
+    # The pages stored so far stay searchable for every chat the PDF is in;
+    # uploading the file again resumes indexing from there
+    try:
+        db.rollback()
+        db.execute(update(PDF).where(PDF.id == pdf_id).values(index_error=str(error) or type(error).__name__))
+        db.commit()
+    except Exception as e:
+        logger.error(f"Could not mark PDF {pdf_id} as failed: {str(e)}")
+
+def claim_partial_pdf(pdf_id: str, pages_indexed: int):
+    # Matches only while the PDF is partial, its indexing failed or stalled,
+    # and nobody has appended or claimed it since it was read
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=get_settings().INGEST_RESUME_AFTER)
+    return (
+        update(PDF)
+        .where(
+            PDF.id == pdf_id,
+            PDF.pages_indexed == pages_indexed,
+            PDF.pages_indexed < PDF.page_count,
+            or_(PDF.index_error.isnot(None), PDF.indexed_at.is_(None), PDF.indexed_at < stale),
+        )
+        .values(indexed_at=now, index_error=None)
+        # Evaluated by the database only; SQLite hands back naive timestamps
+        .execution_options(synchronize_session=False)
+    )
+
+def ingest_shared(job: IngestionJob, temp_file_path: str, file_hash: str, flight) -> str:
+    # Uploads of the same file that arrive meanwhile wait for this one and get
+    # its PDF as soon as its first pages are stored
+    flights = get_ingestion_flights()
+    def stored(pdf_id):
+        flights.finish(file_hash, flight, pdf_id)
+    return flights.lead(file_hash, flight, ingest_pdf, job, temp_file_path, file_hash, stored)
+
+async def process_pdf_batch(files: List[UploadFile], chat_id: str = None, current_user=None) -> dict:
+    # Ingests many files at once: duplicates within the batch and PDFs already
+    # stored are only attached, new files are parsed and embedded in parallel,
+    # and everything is attached to the chat in a single transaction. Files
+    # that other uploads are ingesting right now are waited for and attached
+    # afterwards, so two batches sharing files cannot wait on each other.
+    start = time.perf_counter()
+    user_id = current_user.id if current_user else None
+    chat_id = chat_id or str(uuid.uuid4())
+    results = [{"filename": file.filename, "status": None, "pdf_id": None, "error": None, "timings": {}} for file in files]
+    spooled = {}
+    flights = get_ingestion_flights()
+    led = {}
+    try:
+        for index, file in enumerate(files):
+            if not file.filename.lower().endswith(".pdf"):
+                results[index].update(status=FAILED, error="Only PDF files are allowed")
+                continue
+            try:
+                spooled[index] = await spool_upload(file)
+            except HTTPException as he:
+                results[index].update(status=FAILED, error=he.detail)
+
+        async with async_session() as db:
+            hashes = list({file_hash for _, file_hash in spooled.values()})
+            rows = await db.execute(select(PDF.file_hash, PDF.id).where(PDF.file_hash.in_(hashes)))
+            existing = dict(rows.all())
+
+        first_by_hash = {}
+        for index, (_, file_hash) in spooled.items():
+            if file_hash in existing:
+                results[index].update(status=EXISTING, pdf_id=existing[file_hash])
+            elif file_hash in first_by_hash:
+                results[index]["status"] = DUPLICATE
+            else:
+                first_by_hash[file_hash] = index
+
+        shared = {}
+        for file_hash in first_by_hash:
+            flight, leader = flights.join(file_hash)
+            record_cache("ingestion_flight", not leader)
+            if leader:
+                led[file_hash] = flight
+            else:
+                shared[file_hash] = flight
+
+        new_indexes = [first_by_hash[file_hash] for file_hash in led]
+        jobs = {index: IngestionJob(files[index].filename, chat_id, user_id) for index in new_indexes}
+        # Raises IngestionQueueFullError when bulk uploads already fill their workers' queue
+        futures = get_bulk_ingestion_queue().submit_batch([(jobs[index], prepare_pdf, (spooled[index][0],)) for index in new_indexes])
+
+        async def prepare(index, future):
+            job = jobs[index]
+            try:
+                return await asyncio.wrap_future(future)
+            except Exception as e:
+                logger.error(f"Error processing {job.filename} in bulk upload: {str(e)}", exc_info=True)
+                results[index].update(status=FAILED, error=str(e))
+                return None
+            finally:
+                results[index]["timings"] = dict(job.timings)
+
+        prepared = dict(zip(new_indexes, await asyncio.gather(*(prepare(index, future) for index, future in zip(new_indexes, futures)))))
+        prepared = {index: data for index, data in prepared.items() if data is not None}
+
+        store_start = time.perf_counter()
+        async with async_session() as db:
+            for attempt in range(2):
+                try:
+                    created = await db.run_sync(lambda session: store_pdf_batch(session, files, spooled, prepared, existing, chat_id, user_id))
+                    await db.commit()
+                    break
+                except IntegrityError:
+                    # Another upload stored some of these files first; attach its copies instead
+                    await db.rollback()
+                    if attempt:
+                        raise
+                    rows = await db.execute(select(PDF.file_hash, PDF.id).where(PDF.file_hash.in_(hashes)))
+                    existing = dict(rows.all())
+                    prepared = {index: data for index, data in prepared.items() if spooled[index][1] not in existing}
+        for file_hash, flight in led.items():
+            index = first_by_hash[file_hash]
+            if index in created or file_hash in existing:
+                flights.finish(file_hash, flight, created.get(index) or existing[file_hash])
+            else:
+                flights.finish(file_hash, flight, error=RuntimeError(results[index]["error"]))
+
+        if shared:
+            for file_hash, flight in shared.items():
+                try:
+                    existing[file_hash] = await asyncio.wrap_future(flight)
+                except Exception as e:
+                    results[first_by_hash[file_hash]].update(status=FAILED, error=str(e))
+            attach = {file_hash: existing[file_hash] for file_hash in shared if file_hash in existing}
+            if attach:
+                async with async_session() as db:
+                    await db.run_sync(lambda session: store_pdf_batch(session, files, spooled, {}, attach, chat_id, user_id))
+                    await db.commit()
+
+        for index, (_, file_hash) in spooled.items():
+            result = results[index]
+            if index in created:
+                result.update(status=CREATED, pdf_id=created[index])
+            elif result["status"] is None:
+                # Stored by a concurrent upload while this batch was embedding
+                result.update(status=EXISTING, pdf_id=existing[file_hash])
+            elif result["status"] == DUPLICATE:
+                first = results[first_by_hash[file_hash]]
+                if first["status"] == FAILED:
+                    result.update(status=FAILED, error=first["error"])
+                else:
+                    result["pdf_id"] = first["pdf_id"]
+        store_seconds = time.perf_counter() - store_start
+        record_stage("bulk_upload", "store", store_seconds)
+        timings = {"store": round(store_seconds, 4), "total": round(time.perf_counter() - start, 4)}
+        return {"chat_id": chat_id, "results": results, "timings": timings}
+    finally:
+        # Uploads waiting on files this batch failed to store get the failure
+        for file_hash, flight in led.items():
+            flights.finish(file_hash, flight, error=RuntimeError("Bulk upload failed"))
+        for temp_file_path, _ in spooled.values():
             os.remove(temp_file_path)
 
-def get_chat_indices(chat_id: str):
-    db = next(get_db())
-    chat = db.query(Chat).filter(Chat.id == chat_id).first()
-    if not chat or not chat.pdfs:
+def store_pdf_batch(db, files, spooled: dict, prepared: dict, existing: dict, chat_id: str, user_id: str = None) -> dict:
+    chat = get_or_create_chat(db, chat_id, user_id)
+    created = {}
+    new_pdfs = []
+    for index, data in prepared.items():
+        pdf = build_pdf(files[index].filename, spooled[index][1], *data)
+        db.add(pdf)
+        created[index] = pdf.id
+        new_pdfs.append(pdf)
+    attached = {pdf.id for pdf in chat.pdfs}
+    for pdf in new_pdfs + [db.get(PDF, pdf_id) for pdf_id in set(existing.values())]:
+        if pdf.id not in attached:
+            chat.pdfs.append(pdf)
+            attached.add(pdf.id)
+    get_answer_cache().invalidate_chat(chat_id)
+    get_chat_session_pool().invalidate(chat_id)
+    return created
+
+async def get_chat_indices(chat_id: str):
+    async with async_session() as db:
+        return await load_indices(db, await get_chat_pdf_ids(db, chat_id))
+
+async def get_chat_pdf_ids(db, chat_id: str) -> List[str]:
+    with span("chat", "index_query"):
+        result = await db.execute(select(chat_pdf_association.c.pdf_id).where(chat_pdf_association.c.chat_id == chat_id))
+        pdf_ids = list(dict.fromkeys(result.scalars()))
+    if not pdf_ids:
         raise KeyError("No PDFs found for this chat")
-    indices = []
-    for pdf in chat.pdfs:
-        index = pickle.loads(pdf.vector_store)
-        indices.append(index)
-    db.close()
-    return indices
\ No newline at end of file
+    return pdf_ids
+
+async def load_indices(db, pdf_ids: List[str]):
+    # From the index cache, or else from index files or the database
+    cache = get_index_cache()
+    indices = {pdf_id: cache.get(pdf_id) for pdf_id in pdf_ids}
+    missing = [pdf_id for pdf_id, index in indices.items() if index is None]
+    if missing:
+        directory = get_index_directory()
+        with span("chat", "index_fetch"):
+            result = await db.execute(
+                select(PDF).options(undefer(PDF.lexical_index), selectinload(PDF.chunks)).where(PDF.id.in_(missing))
+            )
+            pdfs = result.scalars().all()
+            # Vectors already published by any worker are mapped, the rest read from the database
+            vectors = {}
+            if directory is not None:
+                vectors = {pdf.id: directory.open(pdf.id) for pdf in pdfs}
+                vectors = {pdf_id: buffer for pdf_id, buffer in vectors.items() if buffer is not None}
+                record_cache("index_file", True, len(vectors))
+                record_cache("index_file", False, len(pdfs) - len(vectors))
+            unmapped = [pdf.id for pdf in pdfs if pdf.id not in vectors]
+            if unmapped:
+                rows = await db.execute(select(PDF.id, PDF.vector_store).where(PDF.id.in_(unmapped)))
+                vectors.update(rows.all())
+        # PDFs still being indexed are read from the database on every load,
+        # so each turn searches the pages committed so far
+        publish = [pdf.id for pdf in pdfs if pdf.id in unmapped and not pdf.partial]
+        if directory is not None and publish:
+            with span("chat", "index_publish"):
+                for pdf_id in publish:
+                    vectors[pdf_id] = await run_in_threadpool(directory.publish, pdf_id, vectors[pdf_id])
+        with span("chat", "index_deserialize"):
+            for pdf in pdfs:
+                indices[pdf.id] = load_embedding_store(pdf, vectors[pdf.id])
+                if indices[pdf.id].complete:
+                    cache.put(pdf.id, indices[pdf.id])
+                INDEX_BYTES_LOADED.observe(indices[pdf.id].nbytes)
+    return [indices[pdf_id] for pdf_id in pdf_ids]
\ No newline at end of file
@@ -0,0 +1,173 @@
+import json
+import struct
+import numpy as np
+from typing import TYPE_CHECKING
+from app.services.embedding_cache import embed_with_cache
+from app.services.lexical_index import LexicalIndex, deserialize_lexical_index
+from app.services.context_packing import count_tokens
+
+if TYPE_CHECKING:
+    from llama_index.core.schema import TextNode
+
+# On-disk layout of PDF.vector_store: a fixed 16-byte header followed by a
+# C-contiguous row-major matrix of unit-normalised embeddings. The header keeps
+# the matrix aligned so the same bytes can be np.frombuffer'ed or np.memmap'ed.
+# int8 stores put one float32 scale per row between the header and the codes.
+MAGIC = b"PDFV"
+HEADER = struct.Struct("<4sIII")
+DTYPE_FLOAT32 = 0
+DTYPE_FLOAT16 = 1
+DTYPE_INT8 = 2
+DTYPES = {DTYPE_FLOAT32: np.float32, DTYPE_FLOAT16: np.float16, DTYPE_INT8: np.int8}
+# Values of the EMBEDDING_STORAGE setting
+STORAGE_FORMATS = {"float32": DTYPE_FLOAT32, "float16": DTYPE_FLOAT16, "int8": DTYPE_INT8}
+INT8_MAX = 127
+# Quantized rows are converted to float32 this many at a time while scoring,
+# so a query never holds a full-precision copy of the matrix
+SCORE_BLOCK_ROWS = 4096
+
+# Only the metadata the chat engine actually shows is kept per chunk
+CHUNK_METADATA_KEYS = ("page_label", "file_name")
+
+def quantize_int8(matrix: np.ndarray):
+    # Symmetric scalar quantization with one scale per row
+    scales = np.abs(matrix).max(axis=1) / INT8_MAX if len(matrix) else np.zeros(0)
+    scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(matrix / scales[:, None]), -INT8_MAX, INT8_MAX).astype(np.int8)
+    return codes, scales
+
+class EmbeddingStore:
+    # Holds the vectors in their stored precision. float16 and int8 stores are
+    # scored block by block against the float32 query, so only the stored
+    # vectors lose precision and memory stays at the quantized size. The
+    # conversion dominates float16 scoring whatever the block size, so those
+    # stores stay about 10x slower to score than float32 ones.
+    def __init__(self, pdf_id: str, embeddings: np.ndarray, chunks: list, lexical: LexicalIndex = None, scales: np.ndarray = None, complete: bool = True):
+        self.pdf_id = pdf_id
+        # False while the PDF's later pages are still being indexed
+        self.complete = complete
+        self.embeddings = embeddings
+        # Per-row dequantization scales of int8 stores
+        self.scales = scales
+        self.chunks = chunks
+        self.lexical = lexical if lexical is not None else LexicalIndex.build([text for text, _ in chunks])
+        # Filled in as chunks are first packed into a prompt
+        self._token_counts = {}
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @property
+    def nbytes(self) -> int:
+        scales = self.scales.nbytes if self.scales is not None else 0
+        return self.embeddings.nbytes + scales + self.lexical.nbytes + sum(len(text) for text, _ in self.chunks)
+
+    @property
+    def quantized(self) -> bool:
+        return self.embeddings.dtype != np.float32
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        if not self.quantized:
+            return self.embeddings @ query
+        scores = np.empty(len(self.embeddings), dtype=np.float32)
+        for start in range(0, len(self.embeddings), SCORE_BLOCK_ROWS):
+            block = self.embeddings[start:start + SCORE_BLOCK_ROWS]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def token_count(self, position: int) -> int:
+        count = self._token_counts.get(position)
+        if count is None:
+            count = self._token_counts[position] = count_tokens(self.chunks[position][0])
+        return count
+
+    def get_node(self, position: int) -> "TextNode":
+        from llama_index.core.schema import TextNode
+        text, metadata = self.chunks[position]
+        return TextNode(
+            id_=f"{self.pdf_id}:{position}",
+            text=text,
+            metadata=metadata,
+            excluded_embed_metadata_keys=["file_name"],
+            excluded_llm_metadata_keys=["file_name"],
+        )
+
+def is_embedding_store(blob) -> bool:
+    return blob is not None and bytes(blob[:len(MAGIC)]) == MAGIC
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def serialize_embeddings(embeddings: np.ndarray, storage: str = "float32") -> bytes:
+    if storage not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown embedding storage {storage!r}, expected one of {sorted(STORAGE_FORMATS)}")
+    dtype_code = STORAGE_FORMATS[storage]
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    rows, dim = embeddings.shape
+    header = HEADER.pack(MAGIC, rows, dim, dtype_code)
+    if dtype_code == DTYPE_INT8:
+        codes, scales = quantize_int8(embeddings)
+        return header + scales.tobytes() + codes.tobytes()
+    return header + embeddings.astype(DTYPES[dtype_code]).tobytes()
+
+def embedding_storage(buffer) -> str:
+    _, _, _, dtype_code = HEADER.unpack_from(buffer, 0)
+    return {code: name for name, code in STORAGE_FORMATS.items()}.get(dtype_code)
+
+def deserialize_vectors(buffer):
+    # Zero-copy: the returned arrays are read-only views over `buffer`, which
+    # may be bytes, a memoryview or an mmap object. Returns the stored matrix
+    # and, for int8 stores, the per-row scales (otherwise None).
+    magic, rows, dim, dtype_code = HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not an embedding store; run `python -m app.db.migrate` to convert legacy rows")
+    if dtype_code not in DTYPES:
+        raise ValueError(f"Unsupported embedding dtype code: {dtype_code}")
+    offset, scales = HEADER.size, None
+    if dtype_code == DTYPE_INT8:
+        scales = np.frombuffer(buffer, dtype=np.float32, count=rows, offset=offset)
+        offset += scales.nbytes
+    matrix = np.frombuffer(buffer, dtype=DTYPES[dtype_code], count=rows * dim, offset=offset).reshape(rows, dim)
+    return matrix, scales
+
+def deserialize_embeddings(buffer) -> np.ndarray:
+    # The vectors as float32, dequantized if they were stored quantized
+    matrix, scales = deserialize_vectors(buffer)
+    if matrix.dtype == np.float32:
+        return matrix
+    matrix = matrix.astype(np.float32)
+    return matrix * scales[:, None] if scales is not None else matrix
+
+def chunk_metadata(metadata: dict) -> dict:
+    return {key: metadata[key] for key in CHUNK_METADATA_KEYS if key in metadata}
+
+def embed_documents(documents):
+    from llama_index.core import Settings
+    nodes = Settings.node_parser.get_nodes_from_documents(documents)
+    # Embed the bare chunk text so identical chunks share cached embeddings
+    # regardless of the file or page they came from
+    texts = [node.get_content() for node in nodes]
+    embeddings, stats = embed_with_cache(texts)
+    chunks = [(text, chunk_metadata(node.metadata)) for text, node in zip(texts, nodes)]
+    return normalize_rows(embeddings), chunks, stats
+
+def load_embedding_store(pdf, vector_store=None) -> EmbeddingStore:
+    # vector_store may be given separately, e.g. as a memory-mapped index file
+    embeddings, scales = deserialize_vectors(vector_store if vector_store is not None else pdf.vector_store)
+    chunks = [(chunk.text, json.loads(chunk.metadata_json or "{}")) for chunk in pdf.chunks]
+    # PDFs stored before lexical indexes existed get one built from their chunks
+    lexical = deserialize_lexical_index(pdf.lexical_index) if pdf.lexical_index is not None else None
+    if pdf.partial and lexical is not None:
+        # Chunks and vectors are only appended while a PDF is indexed, but may
+        # have grown since its row was read: everything is cut to the chunks
+        # that row's lexical index covers
+        rows = len(lexical)
+        embeddings, chunks = embeddings[:rows], chunks[:rows]
+        scales = scales[:rows] if scales is not None else None
+    if len(chunks) != embeddings.shape[0]:
+        raise ValueError(f"Embedding store for PDF {pdf.id} has {embeddings.shape[0]} vectors but {len(chunks)} chunks")
+    return EmbeddingStore(pdf.id, embeddings, chunks, lexical, scales, complete=not pdf.partial)
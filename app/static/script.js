@@ -1,6 +1,14 @@
 let currentChatId = null;
 let authToken = null;
 
+// Uploads are processed in the background; their job is polled until it finishes
+const JOB_POLL_INTERVAL_MS = 1000;
+const MAX_UPLOAD_ATTEMPTS = 5;
+
+function sleep(ms) {
+    return new Promise(resolve => setTimeout(resolve, ms));
+}
+
 window.onload = function() {
     checkSession();
     document.getElementById('login-button').addEventListener('click', login);
@@ -169,23 +177,29 @@ async function uploadPDFs() {
     }
 
     let successfulUploads = 0;
+    let chatId = null;
     for (let i = 0; i < files.length; i++) {
+        uploadButton.textContent = `Processing ${i + 1}/${files.length}...`;
         try {
-            await uploadSinglePDF(files[i]);
+            // Later files go into the chat the first one created
+            const job = await uploadSinglePDF(files[i], chatId);
+            chatId = job.chat_id;
             successfulUploads++;
         } catch (error) {
             console.error('Error uploading file:', error);
             alert(`Error uploading ${files[i].name}: ${error.message}`);
         }
     }
+    uploadButton.textContent = 'Upload';
 
     if (successfulUploads > 0) {
+        currentChatId = chatId;
         //document.getElementById('pdf-upload').style.display = 'none';
         document.getElementById('chat-interface').style.display = 'block';
         document.getElementById('chat-messages').innerHTML = '';
         document.getElementById('current-chat-id').textContent = currentChatId;
         fileInput.value = null
-        loadChatPDFs(currentChatId);
+        await loadChatPDFs(currentChatId);
         addMessage('System', `${successfulUploads} PDF(s) uploaded successfully. You can now ask questions about them.`);
     } else {
         alert('No PDFs were successfully uploaded.');
@@ -194,6 +208,7 @@ async function uploadPDFs() {
     uploadButton.disabled = false;
 }
 
+// Resolves with the finished ingestion job once the PDF can be chatted with
 async function uploadSinglePDF(file, existingChatId = null) {
     const formData = new FormData();
     formData.append('file', file);
@@ -206,20 +221,44 @@ async function uploadSinglePDF(file, existingChatId = null) {
         headers['Authorization'] = `Bearer ${authToken}`;
     }
 
-    const response = await fetch('/v1/pdf', {
-        method: 'POST',
-        headers: headers,
-        body: formData
-    });
+    let response;
+    for (let attempt = 1; ; attempt++) {
+        response = await fetch('/v1/pdf', {
+            method: 'POST',
+            headers: headers,
+            body: formData
+        });
+        // 429: the server is busy with other PDFs; retry after the delay it asks for
+        if (response.status !== 429 || attempt === MAX_UPLOAD_ATTEMPTS) break;
+        const retryAfter = parseInt(response.headers.get('Retry-After'), 10) || 5;
+        await sleep(retryAfter * 1000);
+    }
 
     if (!response.ok) {
         const errorData = await response.json();
         throw new Error(errorData.detail || 'PDF upload failed');
     }
 
-    const data = await response.json();
-    currentChatId = data.chat_id;
-    return data;
+    const job = await waitForJob((await response.json()).job_id);
+    if (job.status === 'failed') {
+        throw new Error(job.error || 'PDF processing failed');
+    }
+    return job;
+}
+
+async function waitForJob(jobId) {
+    const headers = authToken ? { 'Authorization': `Bearer ${authToken}` } : {};
+    while (true) {
+        const response = await fetch(`/v1/pdf/jobs/${jobId}`, { headers });
+        if (!response.ok) {
+            throw new Error('Could not check the status of the upload');
+        }
+        const job = await response.json();
+        if (job.status === 'done' || job.status === 'failed') {
+            return job;
+        }
+        await sleep(JOB_POLL_INTERVAL_MS);
+    }
 }
 
 async function loadChat(chatId) {
@@ -233,16 +272,42 @@ async function loadChat(chatId) {
     addMessage('System', 'Chat loaded. You can now ask questions about the PDFs in this chat.');
 }
 
-async function loadChatHistory(chatId) {
+// Messages come newest page first; older pages are fetched on demand by
+// passing the X-Next-Cursor header back as `before`
+async function loadChatHistory(chatId, before = null) {
     try {
         const headers = authToken ? { 'Authorization': `Bearer ${authToken}` } : {};
-        const response = await fetch(`/v1/chat/${chatId}/messages`, { headers });
+        const query = before ? `?before=${encodeURIComponent(before)}` : '';
+        const response = await fetch(`/v1/chat/${chatId}/messages${query}`, { headers });
+        if (!response.ok) {
+            throw new Error('Could not load the chat history');
+        }
         const messages = await response.json();
         const chatMessages = document.getElementById('chat-messages');
-        chatMessages.innerHTML = '';
+        if (before) {
+            document.getElementById('load-older-messages').remove();
+        } else {
+            chatMessages.innerHTML = '';
+        }
+        const scrollFromBottom = chatMessages.scrollHeight - chatMessages.scrollTop;
+        // Each page is oldest first, and goes above what is already shown
+        const firstShown = chatMessages.firstChild;
         messages.forEach(msg => {
-            addMessage(msg.is_user ? 'User' : 'Bot', msg.content);
+            chatMessages.insertBefore(createMessageElement(msg.is_user ? 'User' : 'Bot', msg.content), firstShown);
         });
+        const nextCursor = response.headers.get('X-Next-Cursor');
+        if (nextCursor) {
+            const loadOlder = document.createElement('button');
+            loadOlder.id = 'load-older-messages';
+            loadOlder.textContent = 'Load older messages';
+            loadOlder.onclick = () => {
+                loadOlder.disabled = true;
+                loadChatHistory(chatId, nextCursor);
+            };
+            chatMessages.insertBefore(loadOlder, chatMessages.firstChild);
+        }
+        // The newest page scrolls to the bottom; older pages keep the current view
+        chatMessages.scrollTop = before ? chatMessages.scrollHeight - scrollFromBottom : chatMessages.scrollHeight;
     } catch (error) {
         console.error('Error loading chat history:', error);
     }
@@ -277,6 +342,10 @@ async function addPDFToChat() {
         return;
     }
 
+    // Questions wait until the PDF has been processed
+    const sendButton = document.getElementById('send-button');
+    sendButton.disabled = true;
+    addMessage('System', `Processing ${file.name}...`);
     try {
         await uploadSinglePDF(file, currentChatId);
         await loadChatPDFs(currentChatId);
@@ -287,6 +356,7 @@ async function addPDFToChat() {
         alert('An error occurred while uploading the additional PDF: ' + error.message);
     }
 
+    sendButton.disabled = false;
     addButton.disabled = false;
 }
 
@@ -347,12 +417,15 @@ function addMessage(sender, message, isUpdate = false) {
         }
     }
     
+    chatMessages.appendChild(createMessageElement(sender, message));
+    chatMessages.scrollTop = chatMessages.scrollHeight;
+}
+
+function createMessageElement(sender, message) {
     const messageElement = document.createElement('div');
     messageElement.classList.add('message', sender.toLowerCase() + '-message');
     messageElement.innerHTML = formatMessage(message);
-    
-    chatMessages.appendChild(messageElement);
-    chatMessages.scrollTop = chatMessages.scrollHeight;
+    return messageElement;
 }
 
 function formatMessage(message) {
@@ -0,0 +1,85 @@
+import os
+import time
+import zlib
+import asyncio
+from typing import List
+import numpy as np
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.llms import CustomLLM, CompletionResponse, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+
+# Deterministic stand-ins for the Gemini models, so benchmarks run offline and
+# measure this code rather than the network. Latencies are simulated with sleeps.
+
+class FakeEmbedding(BaseEmbedding):
+    # Hashed bag of words: texts sharing words get similar vectors, so
+    # retrieval still returns sensible chunks
+    model_name: str = "fake-embedding"
+    dim: int = 256
+    latency: float = 0.0
+    # The pipeline's batches go out as single requests, as with Gemini
+    embed_batch_size: int = 100
+
+    def _vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in text.lower().split():
+            vector[zlib.crc32(word.encode("utf-8")) % self.dim] += 1.0
+        return (vector / (np.linalg.norm(vector) or 1.0)).tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._vector(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._vector(text)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        await asyncio.sleep(self.latency)
+        return self._vector(query)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        # One simulated round trip per batch, like the real API
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+class FakeLLM(CustomLLM):
+    first_token_latency: float = 0.0
+    token_latency: float = 0.0
+    tokens: int = 50
+    # Gemini Pro's window; the 3900-token default would make the chat engine
+    # split the context and refine over several LLM calls
+    context_window: int = 30720
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name="fake-llm", context_window=self.context_window)
+
+    def _words(self, prompt: str) -> List[str]:
+        return [f"word{(len(prompt) + i) % 97} " for i in range(self.tokens)]
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs) -> CompletionResponse:
+        time.sleep(self.first_token_latency + self.token_latency * self.tokens)
+        return CompletionResponse(text="".join(self._words(prompt)))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs):
+        words = self._words(prompt)
+        def gen():
+            time.sleep(self.first_token_latency)
+            text = ""
+            for word in words:
+                time.sleep(self.token_latency)
+                text += word
+                yield CompletionResponse(text=text, delta=word)
+        return gen()
+
+def install_fakes(llm: FakeLLM, embed_model: FakeEmbedding, database_url: str):
+    # Registers the fakes as the "fake" providers and selects them; must run
+    # before the app settings are first read
+    from app.core.providers import register_llm_provider, register_embedding_provider
+    os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+    os.environ["SQLALCHEMY_DATABASE_URL"] = database_url
+    os.environ["LLM_PROVIDER"] = os.environ["EMBEDDING_PROVIDER"] = "fake"
+    register_llm_provider("fake", lambda settings: llm)
+    register_embedding_provider("fake", lambda settings: embed_model)
@@ -0,0 +1,93 @@
+import os
+import json
+import time
+import uuid
+import argparse
+import tempfile
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import create_engine, insert, select, text
+from sqlalchemy.orm import Session
+from app.db.models import Base, Chat, Message
+from app.services.message_history import recent_messages_query, encode_cursor
+
+# Usage: python -m benchmarks.message_history --messages 100000
+
+def populate(engine, chat_ids, messages_per_chat: int, batch_size: int = 10000):
+    start = datetime.now(timezone.utc) - timedelta(seconds=messages_per_chat)
+    with engine.begin() as connection:
+        connection.execute(insert(Chat), [{"id": chat_id} for chat_id in chat_ids])
+        for offset in range(0, messages_per_chat, batch_size):
+            rows = [
+                {
+                    "id": str(uuid.uuid4()),
+                    "chat_id": chat_id,
+                    "content": f"Message {i} of chat {chat_id}",
+                    "timestamp": start + timedelta(seconds=i),
+                    "is_user": i % 2 == 0,
+                }
+                for i in range(offset, min(offset + batch_size, messages_per_chat))
+                for chat_id in chat_ids
+            ]
+            connection.execute(insert(Message), rows)
+
+def time_it(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return round(best, 6)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare message history queries on long chats")
+    parser.add_argument("--messages", type=int, default=100000, help="messages per chat")
+    parser.add_argument("--chats", type=int, default=3)
+    parser.add_argument("--last", type=int, default=5, help="history length, as CONTEXT_LENGTH")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        engine = create_engine(f"sqlite:///{os.path.join(temp_dir, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        chat_ids = [str(uuid.uuid4()) for _ in range(args.chats)]
+        populate(engine, chat_ids, args.messages)
+        chat_id = chat_ids[0]
+
+        with Session(engine) as db:
+            middle = db.execute(recent_messages_query(chat_id, 1).offset(args.messages // 2)).scalar_one()
+            deep_cursor = encode_cursor(middle)
+
+            def load_all():
+                # What /messages did before: every message of the chat
+                return db.execute(select(Message).where(Message.chat_id == chat_id).order_by(Message.timestamp)).scalars().all()
+
+            def last_n():
+                return db.execute(recent_messages_query(chat_id, args.last)).scalars().all()
+
+            def first_page():
+                return db.execute(recent_messages_query(chat_id, args.page_size + 1)).scalars().all()
+
+            def deep_page():
+                return db.execute(recent_messages_query(chat_id, args.page_size + 1, before=deep_cursor)).scalars().all()
+
+            results = {
+                "messages_per_chat": args.messages,
+                "chats": args.chats,
+                "load_all_seconds": time_it(load_all, min(args.repeat, 2)),
+                "last_n_seconds": time_it(last_n, args.repeat),
+                "first_page_seconds": time_it(first_page, args.repeat),
+                "deep_page_seconds": time_it(deep_page, args.repeat),
+            }
+            compiled = recent_messages_query(chat_id, args.last).compile(engine, compile_kwargs={"literal_binds": True})
+            plan = db.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+            results["last_n_query_plan"] = [row[-1] for row in plan]
+
+            # Same query without the composite index, for comparison
+            db.execute(text("DROP INDEX ix_messages_chat_id_timestamp"))
+            results["last_n_without_index_seconds"] = time_it(last_n, min(args.repeat, 2))
+
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from app.services.pdf_extraction import extract_pages
+
+# Usage: python -m benchmarks.pdf_extraction --pages 300 --workers 4
+
+def make_pdf(path: str, pages: int, lines_per_page: int = 45):
+    c = canvas.Canvas(path, pagesize=letter)
+    c.setFont("Helvetica", 9)
+    for page in range(pages):
+        for line in range(lines_per_page):
+            c.drawString(40, 750 - line * 15, f"Page {page + 1} line {line + 1}: the quick brown fox jumps over the lazy dog " * 2)
+        c.showPage()
+    c.save()
+
+def time_it(fn, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare PDF text extraction throughput")
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "bench.pdf")
+        make_pdf(path, args.pages)
+
+        from llama_index.core import SimpleDirectoryReader
+        results = {
+            "pages": args.pages,
+            "workers": args.workers,
+            "simple_directory_reader": time_it(lambda: SimpleDirectoryReader(input_files=[path]).load_data(), args.repeat),
+            "sequential": time_it(lambda: extract_pages(path, workers=1), args.repeat),
+        }
+        # Warm the pool so process start-up is not billed to the first run
+        extract_pages(path, workers=args.workers)
+        results["process_pool"] = time_it(lambda: extract_pages(path, workers=args.workers), args.repeat)
+
+    for key in ("simple_directory_reader", "sequential", "process_pool"):
+        results[f"{key}_pages_per_second"] = round(args.pages / results[key], 1)
+        results[key] = round(results[key], 4)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+import numpy as np
+from benchmarks.fakes import FakeLLM, FakeEmbedding, install_fakes
+from benchmarks.suite import make_pdf
+
+# Usage: python -m benchmarks.progressive --pages 20,100,400 --first-batch 8,0
+#
+# Time until an uploaded PDF can be chatted with, against the time until it is
+# fully indexed, for several lengths. A --first-batch of 0 indexes the whole
+# PDF before storing it, as before progressive ingestion. The fake embedding
+# model sleeps --embed-latency per request, so embedding dominates as with the
+# real API.
+
+def ingest(pages: int, first_batch: int, temp_dir: str, rng, vocabulary) -> dict:
+    from app.services.ingestion import IngestionJob
+    from app.services.pdf_processor import ingest_pdf
+    from app.core.config import get_settings
+
+    get_settings().INGEST_FIRST_BATCH_PAGES = first_batch
+    path = os.path.join(temp_dir, f"corpus-{pages}-{first_batch}.pdf")
+    make_pdf(path, pages, rng, vocabulary)
+    with open(path, "rb") as f:
+        file_hash = hashlib.md5(f.read()).hexdigest()
+    # ingest_pdf deletes the file it is given
+    upload = shutil.copy(path, os.path.join(temp_dir, "upload.pdf"))
+    job = IngestionJob(os.path.basename(path), f"bench-{pages}-{first_batch}")
+    stored = threading.Event()
+    first_seconds = None
+    start = time.perf_counter()
+    worker = threading.Thread(target=ingest_pdf, args=(job, upload, file_hash, lambda pdf_id: stored.set()))
+    worker.start()
+    if stored.wait(timeout=600):
+        first_seconds = time.perf_counter() - start
+    worker.join()
+    total_seconds = time.perf_counter() - start
+    return {
+        "pages": pages,
+        "first_batch_pages": first_batch,
+        "queryable_seconds": round(first_seconds, 3) if first_seconds is not None else None,
+        "indexed_seconds": round(total_seconds, 3),
+        "chunks": job.stats.get("chunks"),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Time until a new PDF is queryable and fully indexed")
+    parser.add_argument("--pages", type=lambda value: [int(p) for p in value.split(",")], default=[20, 100, 400])
+    parser.add_argument("--first-batch", type=lambda value: [int(p) for p in value.split(",")], default=[8, 0], help="INGEST_FIRST_BATCH_PAGES values to compare")
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per embedding request")
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        install_fakes(FakeLLM(), FakeEmbedding(latency=args.embed_latency), f"sqlite:///{os.path.join(temp_dir, 'bench.db')}")
+        from app.db.database import get_engine
+        from app.db.models import Base
+        from app.core.config import get_settings
+        from app.services.pdf_extraction import extract_pages, INLINE_MAX_PAGES
+        Base.metadata.create_all(bind=get_engine())
+        rng = np.random.default_rng(args.seed)
+        vocabulary = np.array([f"term{i}" for i in range(args.vocabulary)])
+        # Start the extraction processes up front so the first PDF is not billed for them
+        warmup = os.path.join(temp_dir, "warmup.pdf")
+        make_pdf(warmup, 2 * INLINE_MAX_PAGES, rng, vocabulary)
+        extract_pages(warmup, get_settings().PDF_EXTRACT_WORKERS)
+        results = [
+            ingest(pages, first_batch, temp_dir, rng, vocabulary)
+            for first_batch in args.first_batch
+            for pages in args.pages
+        ]
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
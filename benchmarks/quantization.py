@@ -0,0 +1,66 @@
+import json
+import time
+import argparse
+import numpy as np
+from llama_index.core.schema import QueryBundle
+from app.services.vector_store import EmbeddingStore, serialize_embeddings, deserialize_vectors, normalize_rows
+from app.services.llm_service import ChatRetriever, top_scores
+
+# Usage: python -m benchmarks.quantization --chunks 20000 --dim 768
+#
+# Storage size, index memory, recall@k against the float32 path and query
+# latency for each EMBEDDING_STORAGE format.
+# Vectors are clustered around topics so neighbours are close, as with real
+# document embeddings.
+
+def make_embeddings(rng, chunks: int, dim: int, topics: int):
+    centroids = normalize_rows(rng.normal(size=(topics, dim)))
+    assignments = rng.integers(0, topics, size=chunks)
+    return normalize_rows(centroids[assignments] + 0.6 * normalize_rows(rng.normal(size=(chunks, dim)))).astype(np.float32)
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare float32, float16 and int8 embedding storage")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--topics", type=int, default=500)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=20, help="candidates asked of the dense search")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    embeddings = make_embeddings(rng, args.chunks, args.dim, args.topics)
+    targets = rng.choice(args.chunks, size=args.queries, replace=False)
+    queries = normalize_rows(embeddings[targets] + 0.5 * normalize_rows(rng.normal(size=(args.queries, args.dim)))).astype(np.float32)
+    chunks = [("", {}) for _ in range(args.chunks)]
+    truth = [{i for i, _ in top_scores(embeddings @ query, args.top_k)} for query in queries]
+
+    results = {"chunks": args.chunks, "dim": args.dim, "queries": args.queries, "top_k": args.top_k}
+    for storage in ("float32", "float16", "int8"):
+        blob = serialize_embeddings(embeddings, storage)
+        matrix, scales = deserialize_vectors(blob)
+        store = EmbeddingStore("bench", matrix, chunks, scales=scales)
+        retriever = ChatRetriever([store], similarity_top_k=args.top_k)
+        vector_bytes = matrix.nbytes + (scales.nbytes if scales is not None else 0)
+
+        hits, latencies = 0, []
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            ranked = retriever._dense_ranking(QueryBundle(query_str="", embedding=query.tolist()), args.top_k)
+            latencies.append(time.perf_counter() - start)
+            hits += len(expected & {i for i, _ in ranked})
+
+        total = args.queries * args.top_k
+        results[storage] = {
+            "stored_bytes": len(blob),
+            "vector_memory_bytes": vector_bytes,
+            "recall": round(hits / total, 4),
+            "mean_latency_ms": round(1000 * float(np.mean(latencies)), 3),
+            "p95_latency_ms": round(1000 * float(np.percentile(latencies, 95)), 3),
+        }
+    for storage in ("float16", "int8"):
+        results[storage]["size_vs_float32"] = round(results[storage]["stored_bytes"] / results["float32"]["stored_bytes"], 3)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
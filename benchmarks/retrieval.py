@@ -0,0 +1,110 @@
+import json
+import time
+import argparse
+import numpy as np
+from app.services.vector_store import EmbeddingStore, normalize_rows
+from app.services.llm_service import ChatRetriever, DENSE, LEXICAL, HYBRID
+
+# Usage: python -m benchmarks.retrieval --chunks 20000 --pdfs 4 --embed-latency 0.05
+#
+# Synthetic corpus: every chunk belongs to a topic and carries a few rare
+# identifiers of its own. Dense vectors know the topic and a little about the
+# chunk; BM25 knows the exact words. Half the queries quote a chunk's
+# identifiers, the other half only paraphrase its topic, so neither search
+# wins everywhere on its own.
+
+class SimulatedEmbedding:
+    # Stands in for the remote embedding API: a fixed round trip per query
+    def __init__(self, vectors: dict, latency: float):
+        self.vectors = vectors
+        self.latency = latency
+
+    def get_agg_embedding_from_queries(self, queries):
+        time.sleep(self.latency)
+        return self.vectors[queries[0]]
+
+def make_corpus(rng, chunks: int, topics: int, dim: int):
+    topic_words = [[f"topic{t}word{w}" for w in range(40)] for t in range(topics)]
+    common_words = [f"common{w}" for w in range(2000)]
+    centroids = normalize_rows(rng.normal(size=(topics, dim)))
+    texts, chunk_topics = [], rng.integers(0, topics, size=chunks)
+    for i, topic in enumerate(chunk_topics):
+        words = list(rng.choice(topic_words[topic], 18)) + list(rng.choice(common_words, 10)) + [f"id{i}x{j}" for j in range(3)]
+        rng.shuffle(words)
+        texts.append(" ".join(words))
+    own = normalize_rows(rng.normal(size=(chunks, dim)))
+    embeddings = normalize_rows(centroids[chunk_topics] + 0.6 * own)
+    return texts, chunk_topics, topic_words, centroids, own, embeddings
+
+def make_queries(rng, count: int, texts, chunk_topics, topic_words, centroids, own, dim: int):
+    queries = []
+    for n, target in enumerate(rng.choice(len(texts), size=count, replace=False)):
+        topic = chunk_topics[target]
+        if n % 2 == 0:
+            # Quotes the chunk's identifiers, which the embedding barely sees
+            vector = centroids[topic] + 0.2 * own[target] + 0.3 * rng.normal(size=dim)
+            text = f"where is id{target}x0 and id{target}x2 mentioned " + " ".join(rng.choice(topic_words[topic], 2))
+        else:
+            # Paraphrase: only topic words, shared by every chunk of the topic,
+            # but the embedding still captures what the chunk is about
+            vector = centroids[topic] + 0.5 * own[target] + 0.3 * rng.normal(size=dim)
+            text = "tell me about " + " ".join(rng.choice(topic_words[topic], 3))
+        vector = normalize_rows(vector[None])[0]
+        queries.append((f"{n}: {text}", int(target), vector.tolist()))
+    return queries
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and latency of dense, lexical and hybrid retrieval")
+    parser.add_argument("--chunks", type=int, default=20000)
+    parser.add_argument("--pdfs", type=int, default=4)
+    parser.add_argument("--topics", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="simulated query embedding round trip, seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    texts, chunk_topics, topic_words, centroids, own, embeddings = make_corpus(rng, args.chunks, args.topics, args.dim)
+    queries = make_queries(rng, args.queries, texts, chunk_topics, topic_words, centroids, own, args.dim)
+
+    start = time.perf_counter()
+    bounds = np.linspace(0, args.chunks, args.pdfs + 1).astype(int)
+    stores = [
+        EmbeddingStore(f"pdf{p}", embeddings[lo:hi].astype(np.float32), [(text, {}) for text in texts[lo:hi]])
+        for p, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:]))
+    ]
+    results = {
+        "chunks": args.chunks,
+        "pdfs": args.pdfs,
+        "queries": args.queries,
+        "top_k": args.top_k,
+        "embed_latency_ms": args.embed_latency * 1000,
+        "lexical_index_build_seconds": round(time.perf_counter() - start, 3),
+    }
+
+    embed_model = SimulatedEmbedding({text: vector for text, _, vector in queries}, args.embed_latency)
+    for mode in (DENSE, LEXICAL, HYBRID):
+        retriever = ChatRetriever(stores, similarity_top_k=args.top_k, mode=mode, embed_model=embed_model)
+        hits, latencies = {"quoted": 0, "paraphrased": 0}, []
+        for n, (text, target, _) in enumerate(queries):
+            query_start = time.perf_counter()
+            nodes = retriever.retrieve(text)
+            latencies.append(time.perf_counter() - query_start)
+            pdf = int(np.searchsorted(bounds, target, side="right") - 1)
+            expected = f"pdf{pdf}:{target - bounds[pdf]}"
+            if expected in [node.node.node_id for node in nodes]:
+                hits["quoted" if n % 2 == 0 else "paraphrased"] += 1
+        half = args.queries / 2
+        results[mode] = {
+            "recall": round((hits["quoted"] + hits["paraphrased"]) / args.queries, 3),
+            "recall_quoted": round(hits["quoted"] / half, 3),
+            "recall_paraphrased": round(hits["paraphrased"] / half, 3),
+            "mean_latency_ms": round(1000 * float(np.mean(latencies)), 2),
+            "p95_latency_ms": round(1000 * float(np.percentile(latencies, 95)), 2),
+        }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
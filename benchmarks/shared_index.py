@@ -0,0 +1,77 @@
+import os
+import json
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+from app.services.index_files import IndexDirectory
+from app.services.vector_store import serialize_embeddings, deserialize_vectors, normalize_rows
+
+# Usage: python -m benchmarks.shared_index --chunks 50000 --dim 768 --workers 1,2,4
+#
+# Memory of N worker processes that all hold the same PDF vectors and scan them
+# once, loaded either as each worker's own copy of the database bytes or by
+# mapping the file published in INDEX_DIR. Reads /proc/self/smaps_rollup, so
+# Linux only. Private memory is what each worker adds on its own; PSS splits
+# shared pages between the processes mapping them.
+
+PDF_ID = "bench"
+
+def memory_kb() -> dict:
+    values = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if rest.strip().endswith("kB"):
+                values[name] = int(rest.split()[0])
+    return {"rss": values["Rss"], "pss": values["Pss"], "private": values["Private_Clean"] + values["Private_Dirty"]}
+
+def worker(mode: str, path: str, dim: int, barrier, results):
+    before = memory_kb()
+    directory = IndexDirectory(path)
+    if mode == "database":
+        with open(directory.file_path(PDF_ID), "rb") as f:
+            buffer = f.read()
+    else:
+        buffer = directory.open(PDF_ID)
+    matrix, _ = deserialize_vectors(buffer)
+    # Scoring touches every page of the matrix
+    (matrix @ np.ones(dim, dtype=np.float32)).argmax()
+    # Measured while every worker holds its store
+    barrier.wait()
+    after = memory_kb()
+    results.put({key: after[key] - before[key] for key in after})
+    barrier.wait()
+
+def measure(mode: str, workers: int, path: str, dim: int) -> dict:
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, path, dim, barrier, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    samples = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    mb = lambda key: round(sum(sample[key] for sample in samples) / 1024, 1)
+    return {"total_private_mb": mb("private"), "total_pss_mb": mb("pss"), "per_worker_rss_mb": round(mb("rss") / workers, 1)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare worker memory with per-process and memory-mapped PDF vectors")
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--workers", type=lambda value: [int(n) for n in value.split(",")], default=[1, 2, 4])
+    parser.add_argument("--storage", default="float32", help="EMBEDDING_STORAGE of the vectors")
+    args = parser.parse_args()
+
+    embeddings = normalize_rows(np.random.default_rng(0).normal(size=(args.chunks, args.dim))).astype(np.float32)
+    with tempfile.TemporaryDirectory() as path:
+        blob = serialize_embeddings(embeddings, args.storage)
+        IndexDirectory(path).publish(PDF_ID, blob)
+        results = {"chunks": args.chunks, "dim": args.dim, "storage": args.storage, "vector_mb": round(len(blob) / 2 ** 20, 1)}
+        for mode in ("database", "mmap"):
+            results[mode] = {workers: measure(mode, workers, path, args.dim) for workers in args.workers}
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
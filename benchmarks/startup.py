@@ -0,0 +1,74 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+# Usage: python -m benchmarks.startup --runs 10
+#
+# Cold-start time of `import app.main`, as paid by every worker boot, test
+# session and CLI tool. Each run is a fresh interpreter. Also lists the
+# slowest imports (from python -X importtime) and whether any model SDK was
+# loaded, which should only happen on the first chat or upload.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODEL_PACKAGES = ("llama_index", "google.generativeai")
+
+TIMED_IMPORT = f"""
+import sys, json, time
+start = time.perf_counter()
+import app.main
+print(time.perf_counter() - start)
+print(json.dumps([name for name in {MODEL_PACKAGES!r} if name in sys.modules]))
+"""
+
+def run_python(args, env):
+    return subprocess.run([sys.executable, *args], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+def slowest_imports(env, count: int):
+    # Lines look like "import time: self | cumulative | module", indented by depth
+    lines = run_python(["-X", "importtime", "-c", "import app.main"], env).stderr.splitlines()
+    entries = []
+    for line in lines:
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        entries.append((int(parts[1]), parts[2].strip()))
+    entries.sort(reverse=True)
+    return [{"module": module, "cumulative_ms": round(micros / 1000, 1)} for micros, module in entries[:count]]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold-start import time of app.main")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        env = {
+            **os.environ,
+            "PYTHONPATH": ROOT,
+            "GOOGLE_API_KEY": os.environ.get("GOOGLE_API_KEY", "unused"),
+            "SQLALCHEMY_DATABASE_URL": f"sqlite:///{os.path.join(temp_dir, 'startup.db')}",
+        }
+        times = []
+        for _ in range(args.runs):
+            lines = run_python(["-c", TIMED_IMPORT], env).stdout.splitlines()
+            times.append(float(lines[-2]))
+        loaded = json.loads(lines[-1])
+        results = {
+            "runs": args.runs,
+            "import_seconds": {
+                "min": round(min(times), 3),
+                "median": round(statistics.median(times), 3),
+                "max": round(max(times), 3),
+            },
+            "model_packages_loaded": loaded,
+            "slowest_imports": slowest_imports(env, args.top),
+        }
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
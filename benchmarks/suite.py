@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import hashlib
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from benchmarks.fakes import FakeLLM, FakeEmbedding, install_fakes
+
+# Usage: python -m benchmarks.suite --pages 10,50,200 --output results.json
+#
+# End-to-end benchmark with fake models: ingestion throughput, index load time
+# from the database, retrieval latency and chat latency for each corpus size.
+# Settings such as EMBED_RATE_LIMIT or RETRIEVAL_MODE are read from the
+# environment as usual, so runs can be compared between commits and configs.
+
+def make_pdf(path: str, pages: int, rng, vocabulary, lines_per_page: int = 40):
+    c = canvas.Canvas(path, pagesize=letter)
+    c.setFont("Helvetica", 9)
+    for _ in range(pages):
+        for line in range(lines_per_page):
+            c.drawString(40, 750 - line * 17, " ".join(rng.choice(vocabulary, 14)))
+        c.showPage()
+    c.save()
+
+def percentiles(samples) -> dict:
+    if not samples:
+        return {}
+    values = 1000 * np.asarray(samples)
+    return {
+        "mean_ms": round(float(values.mean()), 2),
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def bench_corpus(args, pages: int, temp_dir: str, rng, vocabulary) -> dict:
+    from app.services.ingestion import IngestionJob
+    from app.services.index_cache import get_index_cache
+    from app.services.answer_cache import get_answer_cache
+    from app.services.pdf_processor import ingest_pdf, get_chat_indices
+    from app.services.llm_service import ChatRetriever, chat_with_llm
+    from app.core.config import get_settings
+    from app.core.metrics import PROMPT_TOKENS
+
+    settings = get_settings()
+    path = os.path.join(temp_dir, f"corpus-{pages}.pdf")
+    make_pdf(path, pages, rng, vocabulary)
+    with open(path, "rb") as f:
+        file_hash = hashlib.md5(f.read()).hexdigest()
+    # ingest_pdf deletes the file it is given
+    upload = shutil.copy(path, os.path.join(temp_dir, f"upload-{pages}.pdf"))
+    chat_id = f"bench-{pages}"
+    job = IngestionJob(os.path.basename(path), chat_id)
+    start = time.perf_counter()
+    await asyncio.to_thread(ingest_pdf, job, upload, file_hash)
+    ingest_seconds = time.perf_counter() - start
+    chunks = job.stats.get("chunks", 0)
+    result = {
+        "pages": pages,
+        "chunks": chunks,
+        "ingestion": {
+            "seconds": round(ingest_seconds, 4),
+            "pages_per_second": round(pages / ingest_seconds, 1),
+            "chunks_per_second": round(chunks / ingest_seconds, 1),
+            "stages": dict(job.timings),
+        },
+    }
+
+    load_times = []
+    for _ in range(args.repeat):
+        get_index_cache().clear()
+        start = time.perf_counter()
+        stores = await get_chat_indices(chat_id)
+        load_times.append(time.perf_counter() - start)
+    result["index_load"] = percentiles(load_times)
+
+    questions = [" ".join(rng.choice(vocabulary, 6)) + f" ({i})" for i in range(args.queries)]
+    retriever = ChatRetriever(stores, similarity_top_k=settings.SIMILARITY_TOP_K, mode=settings.RETRIEVAL_MODE)
+    retrieval_times = []
+    for question in questions:
+        start = time.perf_counter()
+        await asyncio.to_thread(retriever.retrieve, question)
+        retrieval_times.append(time.perf_counter() - start)
+    result["retrieval"] = percentiles(retrieval_times)
+
+    # Distinct questions and an empty answer cache, so every chat reaches the LLM
+    get_answer_cache().clear()
+    semaphore = asyncio.Semaphore(args.concurrency)
+    first_token_times, chat_times = [], []
+
+    async def chat(question: str):
+        async with semaphore:
+            start = time.perf_counter()
+            answer = await chat_with_llm(chat_id, question)
+            try:
+                parts = 0
+                async for _ in answer.stream:
+                    parts += 1
+                    if parts == 2:
+                        # The first part is the fixed "Answer: " prefix
+                        first_token_times.append(time.perf_counter() - start)
+            finally:
+                answer.release()
+            chat_times.append(time.perf_counter() - start)
+
+    prompts = {part: PROMPT_TOKENS.labels(part) for part in ("context", "total")}
+    before = {part: (histogram.sum, histogram.count) for part, histogram in prompts.items()}
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(question) for question in questions))
+    elapsed = time.perf_counter() - start
+    result["chat"] = {
+        "concurrency": args.concurrency,
+        "requests_per_second": round(len(questions) / elapsed, 2),
+        "first_token": percentiles(first_token_times),
+        "total": percentiles(chat_times),
+    }
+    for part, histogram in prompts.items():
+        turns = histogram.count - before[part][1]
+        result["chat"][f"mean_{part}_tokens"] = round((histogram.sum - before[part][0]) / turns, 1) if turns else None
+    return result
+
+async def run(args, temp_dir: str) -> dict:
+    from app.db.database import get_engine
+    from app.db.models import Base
+    from app.core.config import get_settings
+    from app.services.pdf_extraction import extract_pages, INLINE_MAX_PAGES
+
+    Base.metadata.create_all(bind=get_engine())
+    settings = get_settings()
+    rng = np.random.default_rng(args.seed)
+    vocabulary = np.array([f"term{i}" for i in range(args.vocabulary)])
+
+    # Start the extraction processes up front so the first corpus is not billed for them
+    start = time.perf_counter()
+    warmup = os.path.join(temp_dir, "warmup.pdf")
+    make_pdf(warmup, 2 * INLINE_MAX_PAGES, rng, vocabulary)
+    extract_pages(warmup, settings.PDF_EXTRACT_WORKERS)
+    warmup_seconds = time.perf_counter() - start
+    results = {
+        "commit": git_commit(),
+        "config": {
+            "embed_latency_ms": args.embed_latency * 1000,
+            "llm_first_token_ms": args.llm_first_token * 1000,
+            "llm_token_ms": args.llm_token * 1000,
+            "llm_tokens": args.llm_tokens,
+            "queries": args.queries,
+            "retrieval_mode": settings.RETRIEVAL_MODE,
+            "similarity_top_k": settings.SIMILARITY_TOP_K,
+            "embed_rate_limit": settings.EMBED_RATE_LIMIT,
+            "llm_max_concurrency": settings.LLM_MAX_CONCURRENCY,
+        },
+        "extraction_warmup_seconds": round(warmup_seconds, 3),
+        "corpora": [],
+    }
+    for pages in args.pages:
+        results["corpora"].append(await bench_corpus(args, pages, temp_dir, rng, vocabulary))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with fake LLM and embedding models")
+    parser.add_argument("--pages", type=lambda value: [int(p) for p in value.split(",")], default=[10, 50, 200], help="comma-separated corpus sizes in pages")
+    parser.add_argument("--queries", type=int, default=100, help="chat and retrieval requests per corpus")
+    parser.add_argument("--concurrency", type=int, default=8, help="chat requests in flight")
+    parser.add_argument("--repeat", type=int, default=5, help="index loads per corpus")
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--embed-latency", type=float, default=0.05, help="seconds per embedding request")
+    parser.add_argument("--llm-first-token", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--llm-token", type=float, default=0.005, help="seconds between tokens")
+    parser.add_argument("--llm-tokens", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        install_fakes(
+            FakeLLM(first_token_latency=args.llm_first_token, token_latency=args.llm_token, tokens=args.llm_tokens),
+            FakeEmbedding(latency=args.embed_latency),
+            f"sqlite:///{os.path.join(temp_dir, 'bench.db')}",
+        )
+        results = asyncio.run(run(args, temp_dir))
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
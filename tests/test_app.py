@@ -5,9 +5,39 @@ from fastapi.testclient import TestClient
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from app.main import app
-from app.db.database import Base, get_db, init_db, get_engine, get_session_local
+from app.db.database import Base, get_db, init_db, get_engine, get_session_local, get_async_engine, get_async_session_local, async_database_url, pool_options
 from app.core.config import AppSettings, override_settings, get_settings
-from unittest.mock import patch
+from app.db.models import PDF, Message, User, Chat
+from app.db.migrate import migrate_vector_stores, build_lexical_indexes, quantize_vector_stores
+from app.services.vector_store import is_embedding_store, load_embedding_store, EmbeddingStore, embedding_storage, serialize_embeddings, deserialize_embeddings
+from app.services.index_cache import IndexCache, get_index_cache
+from app.services.index_files import IndexDirectory
+from app.services.pdf_processor import get_chat_indices, extract_documents, prepare_pdf, embed_pages, page_batches
+from app.services.ingestion import IngestionQueue
+from app.services.embedding_cache import embed_with_cache
+from app.services.answer_cache import AnswerCache, get_answer_cache
+from app.services.llm_scheduler import LLMScheduler
+from app.auth.user_cache import get_user_cache
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.services.llm_service import ChatRetriever
+from app.services.chat_sessions import get_chat_session_pool
+from app.services.message_history import recent_messages_query
+from llama_index.core.schema import QueryBundle
+from llama_index.core import Settings
+from llama_index.core.llms import CustomLLM, CompletionResponse, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from app.api.endpoints.chat import save_streamed_response
+from typing import List
+import numpy as np
+from llama_index.core import Document, VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+import pickle
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from unittest.mock import Mock, patch
+import PyPDF2
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 
@@ -42,6 +72,8 @@ def test_app():
     # Clear caches
     get_engine.cache_clear()
     get_session_local.cache_clear()
+    get_async_engine.cache_clear()
+    get_async_session_local.cache_clear()
     get_settings.cache_clear()
     
     # Set up
@@ -53,8 +85,9 @@ def test_app():
     with patch('app.db.database.get_settings', return_value=test_settings):
         with patch('app.core.config.get_settings', return_value=test_settings):
             init_db()  # Initialize the test database
-            client = TestClient(app)
-            yield client
+            # One event loop for every request, as under uvicorn, so pooled async connections stay usable
+            with TestClient(app) as client:
+                yield client
     
 def create_sample_pdf(content):
     pdf_content = io.BytesIO()
@@ -65,19 +98,30 @@ def create_sample_pdf(content):
     pdf_content.seek(0)
     return pdf_content
 
+def wait_for_job(client, response, headers=None, timeout=30):
+    assert response.status_code == 202
+    deadline = time.time() + timeout
+    while True:
+        job = client.get(f"/v1/pdf/jobs/{response.json()['job_id']}", headers=headers).json()
+        if job["status"] in ("done", "failed") or time.time() > deadline:
+            return job
+        time.sleep(0.05)
+
 @pytest.fixture(scope="module")
 def test_chat_id(test_app):
     pdf_content = create_sample_pdf("This is a test PDF file for testing purposes.")
     response = test_app.post("/v1/pdf", files={"file": ("test.pdf", pdf_content)})
-    assert response.status_code == 200
-    return response.json()["chat_id"]
+    job = wait_for_job(test_app, response)
+    assert job["status"] == "done"
+    return job["chat_id"]
 
 def test_upload_pdf(test_app):
     pdf_content = create_sample_pdf("This is a test PDF file for testing purposes.")
     response = test_app.post("/v1/pdf", files={"file": ("test.pdf", pdf_content)})
-    assert response.status_code == 200
-    assert "pdf_id" in response.json()
-    assert "chat_id" in response.json()
+    job = wait_for_job(test_app, response)
+    assert job["status"] == "done"
+    assert job["pdf_id"]
+    assert job["chat_id"]
 
 def test_upload_non_pdf(test_app):
     non_pdf_content = io.BytesIO(b"This is not a PDF")
@@ -99,8 +143,9 @@ async def test_full_flow(test_app, test_chat_id):
     # Upload another PDF to the same chat
     pdf_content = create_sample_pdf("This is another test PDF file for the same chat.")
     upload_response = test_app.post("/v1/pdf", files={"file": ("test2.pdf", pdf_content)}, data={"chat_id": test_chat_id})
-    assert upload_response.status_code == 200
-    assert upload_response.json()["chat_id"] == test_chat_id
+    job = wait_for_job(test_app, upload_response)
+    assert job["status"] == "done"
+    assert job["chat_id"] == test_chat_id
     
     # Chat with the uploaded PDFs
     chat_response = test_app.post(f"/v1/chat/{test_chat_id}", json={"message": "What are the contents of the PDFs?"})
@@ -110,7 +155,9 @@ async def test_full_flow(test_app, test_chat_id):
 def test_error_handling(test_app):
     with patch("app.services.pdf_processor.process_pdf", side_effect=Exception("Test error")):
         response = test_app.post("/v1/pdf", files={"file": ("test.pdf", io.BytesIO(b"%PDF-1.5"))})
-        assert response.status_code == 400
+        job = wait_for_job(test_app, response)
+        assert job["status"] == "failed"
+        assert "Invalid PDF file" in job["error"]
 
 def test_get_chats(test_app, test_chat_id):
     response = test_app.get("/v1/chats")
@@ -129,7 +176,7 @@ def test_upload_duplicate_pdf(test_app, test_chat_id):
     pdf_content = create_sample_pdf("This is a duplicate PDF.")
     # Upload the PDF for the first time
     response1 = test_app.post("/v1/pdf", files={"file": ("duplicate.pdf", pdf_content)}, data={"chat_id": test_chat_id})
-    assert response1.status_code == 200
+    assert wait_for_job(test_app, response1)["status"] == "done"
     # Try to upload the same PDF again
     pdf_content.seek(0)
     response2 = test_app.post("/v1/pdf", files={"file": ("duplicate.pdf", pdf_content)}, data={"chat_id": test_chat_id})
@@ -139,19 +186,20 @@ def test_upload_duplicate_pdf(test_app, test_chat_id):
 def test_upload_pdf_new_chat(test_app):
     pdf_content = create_sample_pdf("This is a PDF for a new chat.")
     response = test_app.post("/v1/pdf", files={"file": ("new_chat.pdf", pdf_content)})
-    assert response.status_code == 200
-    assert "pdf_id" in response.json()
-    assert "chat_id" in response.json()
+    job = wait_for_job(test_app, response)
+    assert job["status"] == "done"
+    assert job["pdf_id"]
+    assert job["chat_id"]
 
 def test_upload_multiple_pdfs_same_chat(test_app, test_chat_id):
     pdf_content1 = create_sample_pdf("This is the first PDF in a multi-PDF test.")
     pdf_content2 = create_sample_pdf("This is the second PDF in a multi-PDF test.")
     
     response1 = test_app.post("/v1/pdf", files={"file": ("multi1.pdf", pdf_content1)}, data={"chat_id": test_chat_id})
-    assert response1.status_code == 200
+    assert wait_for_job(test_app, response1)["status"] == "done"
     
     response2 = test_app.post("/v1/pdf", files={"file": ("multi2.pdf", pdf_content2)}, data={"chat_id": test_chat_id})
-    assert response2.status_code == 200
+    assert wait_for_job(test_app, response2)["status"] == "done"
     
     pdfs_response = test_app.get(f"/v1/chat/{test_chat_id}/pdfs")
     assert pdfs_response.status_code == 200
@@ -195,9 +243,10 @@ def auth_headers(test_app):
 def test_upload_pdf_authenticated(test_app, auth_headers):
     pdf_content = create_sample_pdf("This is an authenticated PDF upload.")
     response = test_app.post("/v1/pdf", files={"file": ("auth_test.pdf", pdf_content)}, headers=auth_headers)
-    assert response.status_code == 200
-    assert "pdf_id" in response.json()
-    assert "chat_id" in response.json()
+    job = wait_for_job(test_app, response, headers=auth_headers)
+    assert job["status"] == "done"
+    assert job["pdf_id"]
+    assert job["chat_id"]
 
 def test_get_chats_authenticated(test_app, auth_headers):
     response = test_app.get("/v1/chats", headers=auth_headers)
@@ -231,4 +280,765 @@ def test_upload_pdf_invalid_chat_id(test_app):
     pdf_content = create_sample_pdf("This is a test PDF for an invalid chat ID.")
     response = test_app.post("/v1/pdf", files={"file": ("invalid_chat.pdf", pdf_content)}, data={"chat_id": "invalid_id"})
     assert response.status_code == 404
-    assert "Chat not found" in response.json()["detail"]
\ No newline at end of file
+    assert "Chat not found" in response.json()["detail"]
+
+def test_pdf_vector_store_format(test_app, test_chat_id):
+    db = TestingSessionLocal()
+    pdf = db.query(PDF).filter(PDF.chats.any(id=test_chat_id)).first()
+    assert is_embedding_store(pdf.vector_store)
+    store = load_embedding_store(pdf)
+    assert store.embeddings.shape[0] == len(store.chunks) > 0
+    assert "test pdf file" in store.chunks[0][0].lower()
+    db.close()
+
+def test_migrate_legacy_vector_store(test_app):
+    index = VectorStoreIndex.from_documents(
+        [Document(text="Legacy pickled index content.", metadata={"page_label": "1"})],
+        embed_model=MockEmbedding(embed_dim=8),
+    )
+    db = TestingSessionLocal()
+    db.add(PDF(id="legacy-pdf", filename="legacy.pdf", vector_store=pickle.dumps(index), file_hash="legacy-hash"))
+    db.commit()
+    assert migrate_vector_stores(db) >= 1
+    pdf = db.query(PDF).filter(PDF.id == "legacy-pdf").first()
+    assert is_embedding_store(pdf.vector_store)
+    store = load_embedding_store(pdf)
+    assert store.embeddings.shape == (1, 8)
+    assert store.chunks[0] == ("Legacy pickled index content.", {"page_label": "1"})
+    assert pdf.lexical_index is None
+    assert build_lexical_indexes(db) >= 1
+    pdf = db.query(PDF).filter(PDF.id == "legacy-pdf").first()
+    assert load_embedding_store(pdf).lexical.document_frequency("legacy") == 1
+    db.close()
+
+def test_quantize_existing_vector_stores(test_app, test_chat_id):
+    db = TestingSessionLocal()
+    pdf = db.query(PDF).filter(PDF.chats.any(id=test_chat_id)).first()
+    pdf_id, original = pdf.id, load_embedding_store(pdf)
+    assert embedding_storage(pdf.vector_store) == "float32"
+    try:
+        assert quantize_vector_stores(db, "float32") == 0
+        assert quantize_vector_stores(db, "int8") >= 1
+        pdf = db.get(PDF, pdf_id)
+        assert embedding_storage(pdf.vector_store) == "int8"
+        store = load_embedding_store(pdf)
+        assert store.quantized and store.nbytes < original.nbytes
+        # Already quantized stores are not converted again
+        assert quantize_vector_stores(db, "float16") == 0
+    finally:
+        for pdf in db.query(PDF).all():
+            if embedding_storage(pdf.vector_store) == "int8":
+                # Back to float32 for the tests that follow
+                pdf.vector_store = serialize_embeddings(deserialize_embeddings(pdf.vector_store))
+        db.commit()
+        db.close()
+        get_index_cache().clear()
+
+@pytest.mark.asyncio
+async def test_chat_indices_are_cached(test_app, test_chat_id):
+    cache = get_index_cache()
+    cache.clear()
+    first = await get_chat_indices(test_chat_id)
+    misses = cache.stats()["misses"]
+    second = await get_chat_indices(test_chat_id)
+    assert cache.stats()["misses"] == misses
+    assert all(a is b for a, b in zip(first, second))
+
+@pytest.mark.asyncio
+async def test_index_cache_invalidated_on_replace(test_app, test_chat_id):
+    await get_chat_indices(test_chat_id)
+    db = TestingSessionLocal()
+    pdf = db.query(PDF).filter(PDF.chats.any(id=test_chat_id)).first()
+    assert get_index_cache().get(pdf.id) is not None
+    original = pdf.vector_store
+    pdf.vector_store = original + b"\0"
+    db.commit()
+    assert get_index_cache().get(pdf.id) is None
+    pdf.vector_store = original
+    db.commit()
+    db.close()
+
+@pytest.mark.asyncio
+async def test_chat_indices_shared_through_index_files(test_app, test_chat_id, tmp_path):
+    directory = IndexDirectory(str(tmp_path))
+    with patch("app.services.pdf_processor.get_index_directory", return_value=directory), \
+            patch("app.services.index_cache.get_index_directory", return_value=directory):
+        get_index_cache().clear()
+        published = await get_chat_indices(test_chat_id)
+        pdf_id = published[0].pdf_id
+        assert os.path.exists(directory.file_path(pdf_id))
+        # As in a second worker: nothing cached, the published file is mapped
+        get_index_cache().clear()
+        with patch.object(directory, "publish", side_effect=AssertionError("published twice")):
+            mapped = await get_chat_indices(test_chat_id)
+        assert not mapped[0].embeddings.flags.writeable
+        assert np.array_equal(mapped[0].embeddings, published[0].embeddings)
+
+        db = TestingSessionLocal()
+        pdf = db.get(PDF, pdf_id)
+        original = pdf.vector_store
+        pdf.vector_store = original + b"\0"
+        db.commit()
+        assert not os.path.exists(directory.file_path(pdf_id))
+        pdf.vector_store = original
+        db.commit()
+        db.close()
+    get_index_cache().clear()
+
+def test_index_cache_lru_eviction():
+    def make_store(pdf_id):
+        return EmbeddingStore(pdf_id, np.zeros((4, 8), dtype=np.float32), [("x" * 32, {})] * 4)
+    size = make_store("a").nbytes
+    cache = IndexCache(max_bytes=size * 2)
+    cache.put("a", make_store("a"))
+    cache.put("b", make_store("b"))
+    cache.get("a")
+    cache.put("c", make_store("c"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] == size * 2
+
+def test_chat_retriever_global_top_k():
+    def make_store(pdf_id, rows):
+        embeddings = np.asarray(rows, dtype=np.float32)
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return EmbeddingStore(pdf_id, embeddings, [(f"{pdf_id}-{i}", {}) for i in range(len(rows))])
+    stores = [
+        make_store("a", [[1, 0], [0, 1]]),
+        make_store("empty", np.zeros((0, 2))),
+        make_store("b", [[1, 0.1], [-1, 0], [0.9, 0.5]]),
+    ]
+    retriever = ChatRetriever(stores, similarity_top_k=3)
+    results = retriever.retrieve(QueryBundle(query_str="q", embedding=[1.0, 0.0]))
+    assert [r.node.get_content() for r in results] == ["a-0", "b-0", "b-2"]
+    assert results[0].score == pytest.approx(1.0)
+    assert results[0].score >= results[1].score >= results[2].score
+
+def test_chat_retriever_lexical_and_hybrid_modes():
+    chunks = [
+        ("Invoice number 4711 was paid late.", {}),
+        ("The weather was sunny all week.", {}),
+        ("Payment terms are thirty days.", {}),
+    ]
+    # Dense vectors that favour the weather chunk, lexical terms that favour the invoice
+    embeddings = np.asarray([[0.6, 0.8], [1.0, 0.0], [0.8, 0.6]], dtype=np.float32)
+    stores = [EmbeddingStore("a", embeddings, chunks)]
+    no_embedding = Mock(get_agg_embedding_from_queries=Mock(side_effect=AssertionError("query embedded in lexical mode")))
+    lexical = ChatRetriever(stores, similarity_top_k=2, mode="lexical", embed_model=no_embedding).retrieve("invoice 4711")
+    assert [r.node.get_content() for r in lexical] == [chunks[0][0]]
+    embed_model = Mock(get_agg_embedding_from_queries=Mock(return_value=[1.0, 0.0]))
+    hybrid = ChatRetriever(stores, similarity_top_k=2, mode="hybrid", embed_model=embed_model).retrieve("invoice 4711")
+    # Third densely but first lexically, the invoice is fused ahead of the top dense hit
+    assert [r.node.get_content() for r in hybrid] == [chunks[0][0], chunks[1][0]]
+    embed_model.get_agg_embedding_from_queries.assert_called_once()
+
+def test_chat_retriever_packs_context_across_pdfs():
+    passage = "Clause seven: the supplier must deliver all goods within thirty days of the order date"
+    embeddings = np.asarray([[1.0, 0.0], [0.8, 0.6]], dtype=np.float32)
+    stores = [
+        EmbeddingStore("a", embeddings, [(passage, {}), ("Unrelated appendix text.", {})]),
+        # An overlapping copy of the same contract, chunked slightly differently
+        EmbeddingStore("b", embeddings, [("Contract: " + passage, {}), ("Another appendix.", {})]),
+    ]
+    retriever = ChatRetriever(stores, similarity_top_k=3, dedup_similarity=0.8)
+    results = retriever.retrieve(QueryBundle(query_str="q", embedding=[1.0, 0.0]))
+    assert [r.node.node_id for r in results] == ["a:0", "a:1", "b:1"]
+    assert retriever.context_tokens == sum(stores[s].token_count(p) for s, p in [(0, 0), (0, 1), (1, 1)])
+    budgeted = ChatRetriever(stores, similarity_top_k=3, dedup_similarity=0.8, token_budget=stores[0].token_count(0))
+    assert [r.node.node_id for r in budgeted.retrieve(QueryBundle(query_str="q", embedding=[1.0, 0.0]))] == ["a:0"]
+
+class FakeStreamingLLM(CustomLLM):
+    tokens: List[str] = ["Streamed ", "answer ", "from ", "the ", "fake ", "LLM."]
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata()
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs) -> CompletionResponse:
+        return CompletionResponse(text="".join(self.tokens))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs):
+        def gen():
+            text = ""
+            for token in self.tokens:
+                text += token
+                yield CompletionResponse(text=text, delta=token)
+        return gen()
+
+def test_chat_streams_tokens(test_app, test_chat_id):
+    with patch.object(Settings, "_llm", FakeStreamingLLM()):
+        with test_app.stream("POST", f"/v1/chat/{test_chat_id}", json={"message": "Stream please"}) as response:
+            assert response.status_code == 200
+            chunks = list(response.iter_text())
+    body = "".join(chunks)
+    assert len(chunks) > 1
+    assert body.startswith("Answer: Streamed answer from the fake LLM.")
+    assert "Sources:\n1. " in body
+    db = TestingSessionLocal()
+    bot_messages = db.query(Message).filter(Message.chat_id == test_chat_id, Message.is_user == False).all()
+    assert any(msg.content == body for msg in bot_messages)
+    db.close()
+
+@pytest.mark.asyncio
+async def test_partial_response_saved_on_disconnect(test_app, test_chat_id):
+    async def fake_stream():
+        for token in ["Answer: ", "partial ", "never sent"]:
+            yield token
+    stream = save_streamed_response(test_chat_id, fake_stream())
+    assert await stream.__anext__() == "Answer: "
+    assert await stream.__anext__() == "partial "
+    await stream.aclose()
+    db = TestingSessionLocal()
+    assert db.query(Message).filter(Message.chat_id == test_chat_id, Message.content == "Answer: partial ").count() == 1
+    db.close()
+
+class SlowTokenLLM(FakeStreamingLLM):
+    tokens: List[str] = [f"token{i} " for i in range(20)]
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs):
+        def gen():
+            text = ""
+            for token in self.tokens:
+                time.sleep(0.05)
+                text += token
+                yield CompletionResponse(text=text, delta=token)
+        return gen()
+
+def test_partial_response_saved_when_client_disconnects(test_app, test_chat_id):
+    # Drives the ASGI app directly: the client goes away after three body chunks
+    async def request():
+        import anyio
+        sent = []
+        disconnected = anyio.Event()
+        body = json.dumps({"message": "Disconnect midway?"}).encode()
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+            "path": f"/v1/chat/{test_chat_id}", "raw_path": f"/v1/chat/{test_chat_id}".encode(), "root_path": "",
+            "query_string": b"", "headers": [(b"content-type", b"application/json")], "client": ("test", 1), "server": ("test", 80),
+        }
+        requested = False
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+        async def send(message):
+            if message["type"] == "http.response.body" and message.get("body"):
+                sent.append(message["body"].decode())
+                if len(sent) == 3:
+                    disconnected.set()
+        await app(scope, receive, send)
+        return sent
+
+    with patch.object(Settings, "_llm", SlowTokenLLM()):
+        sent = test_app.portal.call(request)
+    assert 3 <= len(sent) < 20
+    db = TestingSessionLocal()
+    answers = [msg.content for msg in db.query(Message).filter(Message.chat_id == test_chat_id, Message.is_user == False) if "token0 " in msg.content]
+    db.close()
+    assert answers and answers[-1].startswith("".join(sent[:3]))
+    assert "token19" not in answers[-1]
+
+def test_ingestion_job_reports_stage_timings(test_app):
+    pdf_content = create_sample_pdf("This PDF reports its ingestion timings.")
+    response = test_app.post("/v1/pdf", files={"file": ("timings.pdf", pdf_content)})
+    assert response.json()["status"] in ("queued", "running", "done")
+    job = wait_for_job(test_app, response)
+    assert job["status"] == "done"
+    assert {"queue_wait", "parse", "embed", "store"} <= set(job["timings"])
+
+def test_ingestion_job_status_served_by_any_worker(test_app):
+    pdf_content = create_sample_pdf("This PDF is polled through another worker process.")
+    response = test_app.post("/v1/pdf", files={"file": ("workers.pdf", pdf_content)})
+    job = wait_for_job(test_app, response)
+    assert job["status"] == "done"
+    # Already stored, so done as soon as it is accepted
+    pdf_content.seek(0)
+    repeat = test_app.post("/v1/pdf", files={"file": ("workers.pdf", pdf_content)}).json()
+    assert repeat["status"] == "done"
+    # Another worker process has none of this one's jobs in memory
+    with patch("app.api.endpoints.pdf.get_ingestion_queue", return_value=IngestionQueue(workers=1, max_depth=1)):
+        elsewhere = test_app.get(f"/v1/pdf/jobs/{job['job_id']}")
+        assert elsewhere.status_code == 200
+        assert elsewhere.json() == job
+        assert test_app.get(f"/v1/pdf/jobs/{repeat['job_id']}").json() == repeat
+
+def test_get_unknown_ingestion_job(test_app):
+    response = test_app.get("/v1/pdf/jobs/unknown")
+    assert response.status_code == 404
+
+def test_upload_rejected_when_queue_full(test_app):
+    pdf_content = create_sample_pdf("This PDF arrives while the queue is full.")
+    with patch("app.services.pdf_processor.get_ingestion_queue", return_value=IngestionQueue(workers=1, max_depth=0)):
+        response = test_app.post("/v1/pdf", files={"file": ("overload.pdf", pdf_content)})
+    assert response.status_code == 429
+
+def test_chat_returns_429_when_llm_queue_is_full(test_app, test_chat_id):
+    get_answer_cache().clear()
+    with patch("app.services.llm_service.get_llm_scheduler", return_value=LLMScheduler(max_concurrency=0, max_queue=0)):
+        response = test_app.post(f"/v1/chat/{test_chat_id}", json={"message": "Is anyone free?"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "5"
+
+def test_chat_releases_llm_slot_after_streaming(test_app, test_chat_id):
+    get_answer_cache().clear()
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=0)
+    with patch.object(Settings, "_llm", FakeStreamingLLM()), patch("app.services.llm_service.get_llm_scheduler", return_value=scheduler):
+        for question in ["First question?", "Second question?"]:
+            response = test_app.post(f"/v1/chat/{test_chat_id}", json={"message": question})
+            assert response.status_code == 200
+    assert scheduler.stats()["active"] == 0
+
+def test_embedding_cache_reuses_chunk_embeddings(test_app):
+    embed_model = MockEmbedding(embed_dim=8)
+    first, stats = embed_with_cache(["cached chunk one", "cached chunk two"], embed_model=embed_model)
+    assert stats["cache_hits"] == 0 and stats["embedded"] == 2
+    second, stats = embed_with_cache(["cached chunk one", "cached chunk two", "new chunk", "new chunk"], embed_model=embed_model)
+    assert stats["cache_hits"] == 2
+    assert stats["embedded"] == 1
+    assert stats["cache_hit_rate"] == 0.5
+    assert second.shape == (4, 8)
+    assert np.array_equal(second[:2], first)
+
+def test_ingestion_reports_cache_hit_rate(test_app):
+    response = test_app.post("/v1/pdf", files={"file": ("revised.pdf", create_sample_pdf("This is a test PDF file for testing purposes."))})
+    job = wait_for_job(test_app, response)
+    # Same text as the first upload, but a different file
+    assert job["status"] == "done"
+    assert job["stats"]["cache_hit_rate"] == 1.0
+    assert job["stats"]["embedded"] == 0
+
+def test_upload_rejected_early_by_content_length(test_app):
+    settings = get_settings()
+    large_pdf_content = b"%PDF-1.5\n" + b"A" * (settings.FILE_SIZE_MB * 1024 * 1024 * 2)
+    response = test_app.post("/v1/pdf", files={"file": ("huge.pdf", io.BytesIO(large_pdf_content), "application/pdf")})
+    assert response.status_code == 413
+    assert "File size exceeds the limit" in response.json()["detail"]
+
+def test_upload_spools_to_private_temp_file(test_app):
+    pdf_content = create_sample_pdf("This PDF has a hostile filename.")
+    with patch("app.services.pdf_processor.extract_documents", wraps=extract_documents) as extract:
+        response = test_app.post("/v1/pdf", files={"file": ("../../etc/evil.pdf", pdf_content)})
+        job = wait_for_job(test_app, response)
+    assert job["status"] == "done"
+    extract.assert_called_once()
+    temp_path, filename = extract.call_args.args
+    assert os.path.basename(temp_path).startswith("upload-")
+    assert filename == "../../etc/evil.pdf"
+    assert not os.path.exists(temp_path)
+
+def test_repeated_question_served_from_answer_cache(test_app, test_chat_id):
+    get_answer_cache().clear()
+    llm = FakeStreamingLLM()
+    # No history, so the first answer does not change the second question's context
+    with patch.object(Settings, "_llm", llm), patch.object(get_settings(), "CONTEXT_LENGTH", 0):
+        first = test_app.post(f"/v1/chat/{test_chat_id}", json={"message": "What is this PDF about?"})
+        with patch.object(FakeStreamingLLM, "stream_complete", side_effect=AssertionError("LLM called on a cache hit")):
+            second = test_app.post(f"/v1/chat/{test_chat_id}", json={"message": "  what is this pdf ABOUT "})
+    assert first.headers["X-Answer-Cache"] == "miss"
+    assert second.headers["X-Answer-Cache"] == "hit"
+    assert second.text == first.text
+
+class PromptCapturingLLM(FakeStreamingLLM):
+    prompts: List[str] = []
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs):
+        self.prompts.append(prompt)
+        return super().stream_complete(prompt, formatted, **kwargs)
+
+def test_question_sent_once_and_left_out_of_the_cache_key(test_app, test_chat_id):
+    get_answer_cache().clear()
+    get_chat_session_pool().clear()
+    llm = PromptCapturingLLM(prompts=[])
+    with patch.object(Settings, "_llm", llm):
+        # Cold session, then warm session
+        for question in ("Which colour is the sky?", "Which colour is the sea?"):
+            assert test_app.post(f"/v1/chat/{test_chat_id}", json={"message": question}).status_code == 200
+            assert llm.prompts[-1].count(question) == 1
+
+        # The cache key is the history before the question, not including it
+        db = TestingSessionLocal()
+        stored = list(db.execute(recent_messages_query(test_chat_id, get_settings().CONTEXT_LENGTH)).scalars())[::-1]
+        pdf_ids = [pdf.id for pdf in db.get(Chat, test_chat_id).pdfs]
+        db.close()
+        history = [f"{'user' if msg.is_user else 'assistant'}: {msg.content}" for msg in stored]
+        get_answer_cache().put(AnswerCache.context_key(test_chat_id, pdf_ids, history), "Which colour is grass?", "Green.")
+        response = test_app.post(f"/v1/chat/{test_chat_id}", json={"message": "Which colour is grass?"})
+    assert response.headers["X-Answer-Cache"] == "hit"
+    assert response.text == "Green."
+
+def test_chat_session_reused_between_turns(test_app, test_chat_id):
+    pool = get_chat_session_pool()
+    pool.clear()
+    with patch.object(Settings, "_llm", FakeStreamingLLM()):
+        assert test_app.post(f"/v1/chat/{test_chat_id}", json={"message": "Warm session one?"}).status_code == 200
+        # Nothing is rebuilt for the next turn
+        with patch("app.services.llm_service.load_indices", side_effect=AssertionError("indexes reloaded")), \
+                patch("app.services.llm_service.ChatRetriever", side_effect=AssertionError("retriever rebuilt")):
+            assert test_app.post(f"/v1/chat/{test_chat_id}", json={"message": "Warm session two?"}).status_code == 200
+    session = pool.checkout(test_chat_id)
+    # The rolling history matches what the database holds
+    db = TestingSessionLocal()
+    stored = list(db.execute(recent_messages_query(test_chat_id, get_settings().CONTEXT_LENGTH)).scalars())[::-1]
+    assert list(session.messages) == [msg.id for msg in stored]
+    assert [content for _, content in session.messages.values()] == [msg.content for msg in stored]
+    assert stored[-1].content.startswith("Answer: ")
+    pool.checkin(session)
+
+    response = test_app.post("/v1/pdf", files={"file": ("session.pdf", create_sample_pdf("A PDF added to a warm chat."))}, data={"chat_id": test_chat_id})
+    pdf_id = wait_for_job(test_app, response)["pdf_id"]
+    assert pool.checkout(test_chat_id) is None
+    with patch.object(Settings, "_llm", FakeStreamingLLM()):
+        assert test_app.post(f"/v1/chat/{test_chat_id}", json={"message": "Warm session three?"}).status_code == 200
+    session = pool.checkout(test_chat_id)
+    assert pdf_id in session.pdf_ids
+    assert pdf_id in [store.pdf_id for store in session.retriever.stores]
+    db.close()
+
+def test_answer_cache_invalidated_when_pdf_added(test_app, test_chat_id):
+    cache = get_answer_cache()
+    context = AnswerCache.context_key(test_chat_id, ["pdf"], [])
+    cache.put(context, "question", "answer")
+    response = test_app.post("/v1/pdf", files={"file": ("extra.pdf", create_sample_pdf("An extra PDF for the cache test."))}, data={"chat_id": test_chat_id})
+    assert wait_for_job(test_app, response)["status"] == "done"
+    assert cache.get(context, "question") is None
+
+def test_answer_cache_ttl_size_and_similarity():
+    cache = AnswerCache(max_entries=2, ttl_seconds=60, similarity_threshold=0.9)
+    context = AnswerCache.context_key("chat", ["a", "b"], ["user: hi"])
+    assert AnswerCache.context_key("chat", ["b", "a"], ["user: hi"]) == context
+    cache.put(context, "Who wrote it?", "Alice", query_embedding=[1.0, 0.0])
+    assert cache.get(context, "who wrote it") == "Alice"
+    assert cache.get(context, "Who is the author?", query_embedding=[0.99, 0.05]) == "Alice"
+    assert cache.get(context, "When was it written?", query_embedding=[0.0, 1.0]) is None
+    assert cache.get(AnswerCache.context_key("chat", ["a"], ["user: hi"]), "Who wrote it?") is None
+    cache.put(context, "second", "2")
+    cache.put(context, "third", "3")
+    assert cache.get(context, "Who wrote it?") is None
+    expired = AnswerCache(max_entries=2, ttl_seconds=0)
+    expired.put(context, "question", "answer")
+    assert expired.get(context, "question") is None
+
+
+def test_async_database_url_and_pool_options(test_app):
+    assert async_database_url("sqlite:///./TEST.db") == "sqlite+aiosqlite:///./TEST.db"
+    assert async_database_url("postgresql://user@db/app") == "postgresql+asyncpg://user@db/app"
+    assert async_database_url("postgresql+psycopg://user@db/app") == "postgresql+psycopg://user@db/app"
+    assert pool_options("sqlite:///:memory:") == {}
+    assert pool_options("sqlite:///./TEST.db")["pool_size"] == test_settings.DB_POOL_SIZE
+    assert get_async_engine().pool.size() == test_settings.DB_POOL_SIZE
+
+
+def test_current_user_resolved_from_cache(test_app, auth_headers):
+    get_user_cache().clear()
+    assert test_app.get("/v1/auth/me", headers=auth_headers).status_code == 200
+    with patch("app.auth.auth.get_user", side_effect=AssertionError("database queried for a cached user")):
+        response = test_app.get("/v1/auth/me", headers=auth_headers)
+    assert response.json() == {"username": "anewuser"}
+
+def test_user_cache_invalidated_when_user_changes(test_app, auth_headers):
+    test_app.get("/v1/auth/me", headers=auth_headers)
+    assert get_user_cache().get("anewuser") is not None
+    db = TestingSessionLocal()
+    user = db.query(User).filter(User.username == "anewuser").first()
+    original = user.hashed_password
+    user.hashed_password = original + "-rotated"
+    db.commit()
+    assert get_user_cache().get("anewuser") is None
+    user.hashed_password = original
+    db.commit()
+    db.close()
+
+def test_password_checks_run_on_the_hash_pool(test_app):
+    threads = []
+    def verify(plain_password, hashed_password):
+        threads.append(threading.current_thread().name)
+        return False
+    with patch("app.auth.auth.verify_password", side_effect=verify):
+        response = test_app.post("/v1/auth/token", data={"username": "anewuser", "password": "testpassword"})
+    assert response.status_code == 401
+    assert threads and threads[0].startswith("bcrypt")
+
+
+@pytest.fixture(scope="module")
+def long_chat_id(test_app):
+    chat_id = "long-chat"
+    db = TestingSessionLocal()
+    db.add(Chat(id=chat_id))
+    for i in range(7):
+        db.add(Message(id=f"long-{i}", chat_id=chat_id, content=f"message {i}", is_user=i % 2 == 0))
+        db.flush()
+    db.commit()
+    db.close()
+    return chat_id
+
+def test_messages_get_their_own_timestamps(long_chat_id):
+    db = TestingSessionLocal()
+    timestamps = [msg.timestamp for msg in db.query(Message).filter(Message.chat_id == long_chat_id)]
+    db.close()
+    assert len(set(timestamps)) == len(timestamps)
+
+def test_chat_messages_keyset_pagination(test_app, long_chat_id):
+    pages = []
+    params = {"limit": 3}
+    while True:
+        response = test_app.get(f"/v1/chat/{long_chat_id}/messages", params=params)
+        assert response.status_code == 200
+        pages.append([msg["content"] for msg in response.json()])
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params = {"limit": 3, "before": response.headers["X-Next-Cursor"]}
+    assert pages == [
+        ["message 4", "message 5", "message 6"],
+        ["message 1", "message 2", "message 3"],
+        ["message 0"],
+    ]
+    response = test_app.get(f"/v1/chat/{long_chat_id}/messages", params={"before": "not-a-cursor"})
+    assert response.status_code == 400
+
+def test_bulk_upload_dedupes_and_attaches_in_one_batch(test_app):
+    stored = create_sample_pdf("A PDF that is already stored before the bulk upload.").getvalue()
+    assert wait_for_job(test_app, test_app.post("/v1/pdf", files={"file": ("stored.pdf", io.BytesIO(stored))}))["status"] == "done"
+    first = create_sample_pdf("First new PDF of the bulk upload.").getvalue()
+    second = create_sample_pdf("Second new PDF of the bulk upload.").getvalue()
+    files = [
+        ("files", ("first.pdf", io.BytesIO(first))),
+        ("files", ("second.pdf", io.BytesIO(second))),
+        ("files", ("first-copy.pdf", io.BytesIO(first))),
+        ("files", ("stored-again.pdf", io.BytesIO(stored))),
+        ("files", ("notes.txt", io.BytesIO(b"not a pdf"))),
+    ]
+    response = test_app.post("/v1/pdf/bulk", files=files)
+    assert response.status_code == 200
+    batch = response.json()
+    results = {result["filename"]: result for result in batch["results"]}
+    assert [results[name]["status"] for name in ("first.pdf", "second.pdf", "first-copy.pdf", "stored-again.pdf", "notes.txt")] == [
+        "created", "created", "duplicate", "existing", "failed",
+    ]
+    assert results["first-copy.pdf"]["pdf_id"] == results["first.pdf"]["pdf_id"]
+    assert "embed" in results["first.pdf"]["timings"]
+    pdfs = test_app.get(f"/v1/chat/{batch['chat_id']}/pdfs").json()
+    assert sorted(pdf["filename"] for pdf in pdfs) == ["first.pdf", "second.pdf", "stored.pdf"]
+
+def test_bulk_upload_ingests_files_in_parallel(test_app):
+    def slow_prepare(job, temp_file_path):
+        time.sleep(0.5)
+        return prepare_pdf(job, temp_file_path)
+    files = [("files", (f"parallel-{i}.pdf", create_sample_pdf(f"Parallel bulk upload file number {i}."))) for i in range(4)]
+    with patch("app.services.pdf_processor.prepare_pdf", side_effect=slow_prepare):
+        response = test_app.post("/v1/pdf/bulk", files=files)
+    assert [result["status"] for result in response.json()["results"]] == ["created"] * 4
+    # Four 0.5s files finish in about the time of one, not the sum
+    assert response.json()["timings"]["total"] < 1.5
+
+def test_bulk_upload_rejected_when_bulk_queue_is_full(test_app):
+    queue = IngestionQueue(workers=1, max_depth=2, name="bulk_ingestion")
+    contents = [create_sample_pdf(f"Bulk file {i} arriving under load.").getvalue() for i in range(3)]
+    with patch("app.services.pdf_processor.get_bulk_ingestion_queue", return_value=queue):
+        response = test_app.post("/v1/pdf/bulk", files=[("files", (f"load-{i}.pdf", io.BytesIO(content))) for i, content in enumerate(contents)])
+        assert response.status_code == 429
+        assert "Retry-After" in response.headers
+        response = test_app.post("/v1/pdf/bulk", files=[("files", (f"load-{i}.pdf", io.BytesIO(content))) for i, content in enumerate(contents[:2])])
+    assert [result["status"] for result in response.json()["results"]] == ["created"] * 2
+    assert queue.depth == 0
+
+def test_chat_reports_server_timing_and_metrics(test_app, test_chat_id):
+    get_index_cache().clear()
+    with patch.object(Settings, "_llm", FakeStreamingLLM()):
+        with test_app.stream("POST", f"/v1/chat/{test_chat_id}", json={"message": "Which stages ran?"}) as response:
+            assert response.status_code == 200
+            body = "".join(response.iter_text())
+    assert body.startswith("Answer: ")
+    stages = {entry.split(";")[0].strip() for entry in response.headers["Server-Timing"].split(",")}
+    assert {"db", "index_query", "index_fetch", "index_deserialize", "history", "llm_queue", "retrieve", "llm_start", "total"} <= stages
+
+    metrics = test_app.get("/metrics")
+    assert metrics.status_code == 200
+    assert metrics.headers["content-type"].startswith("text/plain")
+    text = metrics.text
+    assert 'pdfchat_request_duration_seconds_count{method="POST",route="/v1/chat/{chat_id}",status="200"}' in text
+    assert 'pdfchat_stage_duration_seconds_count{operation="chat",stage="generate"}' in text
+    assert 'pdfchat_stage_duration_seconds_count{operation="chat",stage="persist"}' in text
+    assert 'pdfchat_queue_wait_seconds_count{queue="llm"}' in text
+    assert 'pdfchat_prompt_tokens_count{part="context"}' in text
+    assert 'pdfchat_cache_requests_total{cache="index",result="miss"}' in text
+    assert "pdfchat_index_loaded_bytes_count" in text
+    # The endpoint does not time itself
+    assert 'route="/metrics"' not in text
+
+def test_parallel_duplicate_uploads_ingested_once(test_app):
+    content = create_sample_pdf("A PDF uploaded by several clients at the same time.").getvalue()
+    calls = []
+    def slow_embed(job, temp_file_path, pages=None, reader=None):
+        calls.append(job.filename)
+        time.sleep(0.5)
+        return embed_pages(job, temp_file_path, pages, reader)
+    def upload(i):
+        if i == 3:
+            return test_app.post("/v1/pdf/bulk", files=[("files", (f"same-{i}.pdf", io.BytesIO(content)))])
+        return test_app.post("/v1/pdf", files={"file": (f"same-{i}.pdf", io.BytesIO(content))})
+    with patch("app.services.pdf_processor.embed_pages", side_effect=slow_embed):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            responses = list(pool.map(upload, range(4)))
+        jobs = [wait_for_job(test_app, response) for response in responses[:3]]
+    assert len(calls) == 1
+    bulk = responses[3].json()
+    assert [job["status"] for job in jobs] == ["done"] * 3
+    assert bulk["results"][0]["status"] in ("created", "existing")
+    pdf_ids = {job["pdf_id"] for job in jobs} | {bulk["results"][0]["pdf_id"]}
+    assert len(pdf_ids) == 1
+    chat_ids = [job["chat_id"] for job in jobs] + [bulk["chat_id"]]
+    assert len(set(chat_ids)) == 4
+    for chat_id in chat_ids:
+        assert [pdf["id"] for pdf in test_app.get(f"/v1/chat/{chat_id}/pdfs").json()] == list(pdf_ids)
+
+class SlowStreamingLLM(FakeStreamingLLM):
+    calls: List[str] = []
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs):
+        self.calls.append(prompt)
+        time.sleep(0.5)
+        return super().stream_complete(prompt, formatted, **kwargs)
+
+def test_concurrent_identical_questions_share_one_answer(test_app, test_chat_id):
+    get_answer_cache().clear()
+    llm = SlowStreamingLLM(calls=[])
+    def ask(message):
+        return test_app.post(f"/v1/chat/{test_chat_id}", json={"message": message})
+    with patch.object(Settings, "_llm", llm):
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            responses = list(pool.map(ask, ["Asked by everyone?", "asked by everyone", "Asked by everyone?", "Asked by everyone?"]))
+    assert [response.status_code for response in responses] == [200] * 4
+    assert len(llm.calls) == 1
+    assert len({response.text for response in responses}) == 1
+    assert responses[0].text.startswith("Answer: ")
+
+def create_paged_pdf(pages):
+    pdf_content = io.BytesIO()
+    c = canvas.Canvas(pdf_content, pagesize=letter)
+    for page in range(pages):
+        c.drawString(100, 750, f"Progressive page {page + 1} talks about topic{page + 1}.")
+        c.showPage()
+    c.save()
+    pdf_content.seek(0)
+    return pdf_content
+
+def test_page_batches_double_after_the_first():
+    assert page_batches(5, 8) == [(0, 5)]
+    assert page_batches(100, 0) == [(0, 100)]
+    assert page_batches(0, 8) == [(0, 0)]
+    assert page_batches(40, 4) == [(0, 4), (4, 8), (8, 16), (16, 32), (32, 40)]
+    # Resumed from the pages already indexed
+    assert page_batches(40, 4, 8) == [(8, 16), (16, 32), (32, 40)]
+    assert page_batches(5, 8, 2) == [(2, 5)]
+
+def test_progressive_ingestion_parses_the_pdf_once(test_app):
+    with patch.object(get_settings(), "INGEST_FIRST_BATCH_PAGES", 2), \
+            patch.object(get_settings(), "PDF_EXTRACT_WORKERS", 1), \
+            patch.object(get_settings(), "PDF_PAGE_TIMEOUT", 0), \
+            patch("app.services.pdf_extraction.PyPDF2.PdfReader", wraps=PyPDF2.PdfReader) as reader:
+        job = wait_for_job(test_app, test_app.post("/v1/pdf", files={"file": ("once.pdf", create_paged_pdf(9))}))
+    assert job["status"] == "done"
+    assert job["stats"]["pages_indexed"] == 9
+    # Four batches, one parse
+    assert reader.call_count == 1
+
+@pytest.mark.asyncio
+async def test_pdf_queryable_while_later_pages_are_indexed(test_app):
+    release = threading.Event()
+    def held_embed(job, temp_file_path, pages=None, reader=None):
+        if pages[0] > 0:
+            release.wait(10)
+        return embed_pages(job, temp_file_path, pages, reader)
+    with patch.object(get_settings(), "INGEST_FIRST_BATCH_PAGES", 2), \
+            patch("app.services.pdf_processor.embed_pages", side_effect=held_embed):
+        response = test_app.post("/v1/pdf", files={"file": ("progressive.pdf", create_paged_pdf(6))})
+        deadline = time.time() + 10
+        while not (job := test_app.get(f"/v1/pdf/jobs/{response.json()['job_id']}").json())["pdf_id"] and time.time() < deadline:
+            time.sleep(0.05)
+        assert job["status"] == "running"
+        assert job["stats"]["pages"] == 6 and job["stats"]["pages_indexed"] == 2
+        chat_id = job["chat_id"]
+        [info] = test_app.get(f"/v1/chat/{chat_id}/pdfs").json()
+        assert (info["page_count"], info["pages_indexed"], info["indexing"]) == (6, 2, True)
+
+        # The first pages are searchable, and not cached while the PDF grows
+        [store] = await get_chat_indices(chat_id)
+        assert not store.complete
+        assert {metadata["page_label"] for _, metadata in store.chunks} == {"1", "2"}
+        assert get_index_cache().get(store.pdf_id) is None
+        with patch.object(Settings, "_llm", FakeStreamingLLM()):
+            answer = test_app.post(f"/v1/chat/{chat_id}", json={"message": "What is on page one?"})
+        assert answer.status_code == 200
+        assert answer.headers["X-Answer-Cache"] == "miss"
+
+        release.set()
+        job = wait_for_job(test_app, response)
+    assert job["status"] == "done"
+    [info] = test_app.get(f"/v1/chat/{chat_id}/pdfs").json()
+    assert (info["pages_indexed"], info["indexing"]) == (6, False)
+    [store] = await get_chat_indices(chat_id)
+    assert store.complete
+    assert {metadata["page_label"] for _, metadata in store.chunks} == {str(page) for page in range(1, 7)}
+
+def test_failed_progressive_ingestion_keeps_pdf_and_resumes_on_reupload(test_app):
+    def failing_embed(job, temp_file_path, pages=None, reader=None):
+        if pages[0] >= failing_from:
+            raise RuntimeError("embedding API down")
+        return embed_pages(job, temp_file_path, pages, reader)
+    pdf_content = create_paged_pdf(9).getvalue()
+    with patch.object(get_settings(), "INGEST_FIRST_BATCH_PAGES", 2), \
+            patch("app.services.pdf_processor.embed_pages", side_effect=failing_embed):
+        failing_from = 2
+        job = wait_for_job(test_app, test_app.post("/v1/pdf", files={"file": ("broken.pdf", pdf_content)}))
+        assert job["status"] == "failed"
+        # Other chats may already use the pages stored so far, so the PDF stays
+        [pdf] = test_app.get(f"/v1/chat/{job['chat_id']}/pdfs").json()
+        assert pdf["id"] == job["pdf_id"]
+        assert (pdf["pages_indexed"], pdf["indexing"]) == (2, False)
+        assert "embedding API down" in pdf["index_error"]
+
+        # Uploading the file again, here to another chat, resumes where it stopped
+        failing_from = 4
+        resumed = wait_for_job(test_app, test_app.post("/v1/pdf", files={"file": ("broken.pdf", pdf_content)}))
+        assert resumed["status"] == "failed"
+        assert resumed["pdf_id"] == job["pdf_id"]
+        [pdf] = test_app.get(f"/v1/chat/{resumed['chat_id']}/pdfs").json()
+        assert pdf["pages_indexed"] == 4
+
+    db = next(get_db())
+    try:
+        # Indexing that stopped without an error, e.g. with its worker process, is resumed once stale
+        db.query(PDF).filter(PDF.id == job["pdf_id"]).update({"index_error": None, "indexed_at": datetime.now(timezone.utc)})
+        db.commit()
+        # While it is still being indexed elsewhere, uploads only attach it
+        fresh = wait_for_job(test_app, test_app.post("/v1/pdf", files={"file": ("broken.pdf", pdf_content)}), timeout=5)
+        assert fresh["status"] == "done"
+        [pdf] = test_app.get(f"/v1/chat/{fresh['chat_id']}/pdfs").json()
+        assert (pdf["pages_indexed"], pdf["indexing"]) == (4, True)
+        assert test_app.post("/v1/pdf", data={"chat_id": job["chat_id"]}, files={"file": ("broken.pdf", pdf_content)}).status_code == 400
+        db.query(PDF).filter(PDF.id == job["pdf_id"]).update({"indexed_at": datetime.now(timezone.utc) - timedelta(hours=1)})
+        db.commit()
+    finally:
+        db.close()
+    done = wait_for_job(test_app, test_app.post("/v1/pdf", data={"chat_id": job["chat_id"]}, files={"file": ("broken.pdf", pdf_content)}))
+    assert done["status"] == "done"
+    for chat_id in (job["chat_id"], resumed["chat_id"], fresh["chat_id"]):
+        [pdf] = test_app.get(f"/v1/chat/{chat_id}/pdfs").json()
+        assert (pdf["pages_indexed"], pdf["indexing"], pdf["index_error"]) == (9, False, None)
+    db = next(get_db())
+    try:
+        stored = db.get(PDF, job["pdf_id"])
+        store = load_embedding_store(stored)
+        assert store.complete
+        assert [json.loads(chunk.metadata_json)["page_label"] for chunk in stored.chunks] == [str(page) for page in range(1, 10)]
+    finally:
+        db.close()
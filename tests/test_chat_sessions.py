@@ -0,0 +1,36 @@
+import time
+from app.services.chat_sessions import ChatSession, ChatSessionPool
+
+def test_checkout_is_exclusive_and_checkin_returns():
+    pool = ChatSessionPool(max_sessions=2, ttl_seconds=60, history_length=3)
+    assert pool.checkout("chat") is None
+    session = ChatSession("chat", ["pdf"], retriever=None)
+    pool.checkin(session)
+    assert pool.checkout("chat") is session
+    # Checked out, so a concurrent turn gets none
+    assert pool.checkout("chat") is None
+    pool.checkin(session)
+    pool.invalidate("chat")
+    assert pool.checkout("chat") is None
+    assert pool.stats()["hits"] == 1 and pool.stats()["misses"] == 3
+
+def test_least_recently_used_and_idle_sessions_evicted():
+    pool = ChatSessionPool(max_sessions=2, ttl_seconds=60, history_length=3)
+    for chat_id in ("a", "b", "c"):
+        pool.checkin(ChatSession(chat_id, [], retriever=None))
+    assert pool.checkout("a") is None
+    assert pool.checkout("b") is not None
+    expiring = ChatSessionPool(max_sessions=2, ttl_seconds=0.01, history_length=3)
+    expiring.checkin(ChatSession("a", [], retriever=None))
+    time.sleep(0.02)
+    assert expiring.checkout("a") is None
+
+def test_remember_keeps_the_latest_messages():
+    pool = ChatSessionPool(max_sessions=2, ttl_seconds=60, history_length=3)
+    session = ChatSession("chat", [], retriever=None)
+    pool.checkin(session)
+    for i in range(5):
+        pool.remember("chat", f"m{i}", i % 2 == 0, f"message {i}")
+    pool.remember("other", "x", True, "no session, ignored")
+    assert list(session.messages) == ["m2", "m3", "m4"]
+    assert session.messages["m3"] == (False, "message 3")
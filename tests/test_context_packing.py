@@ -0,0 +1,35 @@
+from app.services.context_packing import pack_context, content_hash, shingles, jaccard
+
+PASSAGE = "The quarterly report shows revenue grew by twelve percent while operating costs stayed flat across all regions"
+
+def test_exact_duplicates_ignore_case_and_whitespace():
+    assert content_hash("Revenue  grew\nby 12%") == content_hash("revenue grew by 12% ")
+    kept, stats = pack_context([PASSAGE, PASSAGE.upper(), "Something else entirely"], [20, 20, 5], max_chunks=5)
+    assert kept == [0, 2]
+    assert stats["duplicate"] == 1
+
+def test_near_duplicates_dropped_but_similar_sentences_kept():
+    rechunked = "Summary: " + PASSAGE + " combined"
+    assert jaccard(shingles(PASSAGE), shingles(rechunked)) > 0.8
+    lookalike = "This is the first PDF in a multi-PDF test."
+    other = "This is the second PDF in a multi-PDF test."
+    texts = [PASSAGE, rechunked, lookalike, other]
+    kept, stats = pack_context(texts, [20] * 4, max_chunks=5, similarity_threshold=0.8)
+    assert kept == [0, 2, 3]
+    assert stats["near_duplicate"] == 1
+    # Without a threshold only exact copies are dropped
+    kept, _ = pack_context(texts, [20] * 4, max_chunks=5)
+    assert kept == [0, 1, 2, 3]
+
+def test_token_budget_and_chunk_limit():
+    texts = [f"chunk number {i}" for i in range(5)]
+    # The second chunk overflows the budget, the smaller third one still fits
+    kept, stats = pack_context(texts, [60, 50, 30, 10, 10], max_chunks=5, token_budget=100)
+    assert kept == [0, 2, 3]
+    assert stats["tokens"] == 100
+    assert stats["budget"] == 2
+    kept, _ = pack_context(texts, [60, 50, 30, 10, 10], max_chunks=2)
+    assert kept == [0, 1]
+    # The best chunk is kept even when it alone exceeds the budget
+    kept, stats = pack_context(texts, [500, 10, 10, 10, 10], max_chunks=5, token_budget=100)
+    assert kept[0] == 0 and stats["tokens"] > 100
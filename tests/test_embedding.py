@@ -0,0 +1,103 @@
+import time
+import asyncio
+import threading
+import pytest
+from typing import List
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from app.services.embedding import EmbeddingPipeline, TokenBucket
+
+class RateLimitError(Exception):
+    code = 429
+
+class FakeEmbedding(BaseEmbedding):
+    latency: float = 0.05
+    failures: int = 0
+    calls: int = 0
+    in_flight: int = 0
+    max_in_flight: int = 0
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return [float(len(query)), 1.0]
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return [float(len(text)), 1.0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            failing = self.failures > 0
+            if failing:
+                self.failures -= 1
+        try:
+            time.sleep(self.latency)
+            if failing:
+                raise RateLimitError("429 Resource has been exhausted")
+            return [self._get_text_embedding(text) for text in texts]
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+class LoopBoundEmbedding(FakeEmbedding):
+    # Like google-generativeai's async client, which belongs to the first
+    # event loop that uses it
+    _loop: object = PrivateAttr(default=None)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+        if loop is not self._loop:
+            raise RuntimeError("got Future attached to a different loop")
+        return [self._get_text_embedding(text) for text in texts]
+
+def test_pipeline_batches_concurrently_and_preserves_order():
+    model = FakeEmbedding()
+    texts = [f"chunk {i}" * (i + 1) for i in range(40)]
+    pipeline = EmbeddingPipeline(embed_model=model, batch_size=4, concurrency=5)
+    embeddings, stats = pipeline.embed(texts)
+    assert embeddings.shape == (40, 2)
+    assert [row[0] for row in embeddings] == [len(text) for text in texts]
+    assert stats["batches"] == 10
+    assert model.max_in_flight == 5
+    # 10 batches of 50ms at concurrency 5 is two rounds, not ten
+    assert stats["seconds"] < 0.3
+    assert stats["chunks_per_second"] > 0
+
+def test_pipeline_retries_rate_limited_batches():
+    model = FakeEmbedding(latency=0.01, failures=3)
+    pipeline = EmbeddingPipeline(embed_model=model, batch_size=10, concurrency=1, backoff_seconds=0.01)
+    embeddings, stats = pipeline.embed([f"text {i}" for i in range(20)])
+    assert embeddings.shape == (20, 2)
+    assert stats["retries"] == 3
+    assert model.calls == 5
+
+def test_pipeline_gives_up_after_max_retries():
+    model = FakeEmbedding(latency=0.0, failures=10)
+    pipeline = EmbeddingPipeline(embed_model=model, batch_size=10, max_retries=2, backoff_seconds=0.0)
+    with pytest.raises(RateLimitError):
+        pipeline.embed(["text"])
+    assert model.calls == 3
+
+def test_token_bucket_limits_request_rate():
+    model = FakeEmbedding(latency=0.0)
+    pipeline = EmbeddingPipeline(embed_model=model, batch_size=1, concurrency=10, rate_limiter=TokenBucket(rate=50, capacity=1))
+    start = time.perf_counter()
+    pipeline.embed([f"text {i}" for i in range(11)])
+    # One token up front, then 10 more at 50 per second
+    assert time.perf_counter() - start >= 0.18
+
+def test_pipeline_survives_repeated_ingestions_with_a_loop_bound_client():
+    # Every upload embeds through the same model; each must succeed, not just the first
+    model = LoopBoundEmbedding(latency=0.0)
+    pipeline = EmbeddingPipeline(embed_model=model, batch_size=2, concurrency=2)
+    for ingestion in range(3):
+        embeddings, stats = pipeline.embed([f"ingestion {ingestion} text {i}" for i in range(5)])
+        assert embeddings.shape == (5, 2)
+        assert stats["batches"] == 3
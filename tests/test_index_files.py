@@ -0,0 +1,26 @@
+import os
+import numpy as np
+from app.services.index_files import IndexDirectory
+from app.services.vector_store import serialize_embeddings, deserialize_vectors
+
+def test_publish_maps_vectors_read_only(tmp_path):
+    directory = IndexDirectory(str(tmp_path / "indexes"))
+    assert directory.open("pdf") is None
+    embeddings = np.random.default_rng(0).normal(size=(10, 4)).astype(np.float32)
+    matrix, _ = deserialize_vectors(directory.publish("pdf", serialize_embeddings(embeddings)))
+    assert np.array_equal(matrix, embeddings)
+    assert not matrix.flags.writeable
+    # Only the published file is left behind
+    assert os.listdir(directory.path) == ["pdf.vec"]
+
+def test_open_mappings_survive_replace_and_remove(tmp_path):
+    directory = IndexDirectory(str(tmp_path))
+    first = np.ones((3, 2), dtype=np.float32)
+    matrix, _ = deserialize_vectors(directory.publish("pdf", serialize_embeddings(first)))
+    directory.publish("pdf", serialize_embeddings(2 * first))
+    assert np.array_equal(matrix, first)
+    assert np.array_equal(deserialize_vectors(directory.open("pdf"))[0], 2 * first)
+    directory.remove("pdf")
+    directory.remove("pdf")
+    assert directory.open("pdf") is None
+    assert np.array_equal(matrix, first)
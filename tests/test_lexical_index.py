@@ -0,0 +1,36 @@
+import numpy as np
+from app.services.lexical_index import (
+    LexicalIndex, tokenize, corpus_statistics, serialize_lexical_index, deserialize_lexical_index,
+)
+
+TEXTS = [
+    "The mitochondria is the powerhouse of the cell.",
+    "Quarterly revenue grew while operating costs fell.",
+    "Revenue guidance for the next quarter was raised.",
+    "",
+]
+
+def search(index, query):
+    terms = tokenize(query)
+    idf, avg_length = corpus_statistics([index], terms)
+    return index.score(terms, idf, avg_length)
+
+def test_bm25_ranks_matching_chunks():
+    index = LexicalIndex.build(TEXTS)
+    scores = search(index, "Revenue this quarter?")
+    assert scores[0] == 0 and scores[3] == 0
+    assert scores[2] > scores[1] > 0
+    assert search(index, "photosynthesis").sum() == 0
+
+def test_chat_wide_statistics_span_indexes():
+    first, second = LexicalIndex.build(TEXTS[:2]), LexicalIndex.build(TEXTS[2:])
+    idf, avg_length = corpus_statistics([first, second], ["revenue"])
+    combined_idf, combined_avg = corpus_statistics([LexicalIndex.build(TEXTS)], ["revenue"])
+    assert idf == combined_idf
+    assert avg_length == combined_avg
+
+def test_lexical_index_round_trip():
+    index = LexicalIndex.build(TEXTS)
+    restored = deserialize_lexical_index(serialize_lexical_index(index))
+    assert restored.vocabulary.tolist() == index.vocabulary.tolist()
+    assert np.array_equal(search(restored, "revenue quarter"), search(index, "revenue quarter"))
@@ -0,0 +1,104 @@
+import time
+import asyncio
+import pytest
+import threading
+from app.services.llm_scheduler import (
+    LLMScheduler, LLMQueueFullError, LLMQueueTimeoutError, LLMDeadlineExceededError,
+)
+
+@pytest.mark.asyncio
+async def test_scheduler_limits_concurrency_in_fifo_order():
+    scheduler = LLMScheduler(max_concurrency=2, max_queue=10)
+    in_flight = 0
+    max_in_flight = 0
+    order = []
+
+    async def generate(i):
+        nonlocal in_flight, max_in_flight
+        lease = await scheduler.acquire()
+        try:
+            order.append(i)
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.02)
+            in_flight -= 1
+        finally:
+            lease.release()
+
+    await asyncio.gather(*(generate(i) for i in range(8)))
+    assert max_in_flight == 2
+    assert order == list(range(8))
+    assert scheduler.stats()["active"] == 0
+
+@pytest.mark.asyncio
+async def test_scheduler_rejects_when_queue_is_full():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=1)
+    lease = await scheduler.acquire()
+    waiting = asyncio.ensure_future(scheduler.acquire())
+    await asyncio.sleep(0)
+    with pytest.raises(LLMQueueFullError):
+        await scheduler.acquire()
+    assert scheduler.stats()["rejected"] == 1
+    lease.release()
+    # Releasing twice must not free a second slot
+    lease.release()
+    (await waiting).release()
+    assert scheduler.stats()["active"] == 0
+
+@pytest.mark.asyncio
+async def test_scheduler_queue_timeout_and_cancellation_free_their_place():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=2, queue_timeout=0.05)
+    lease = await scheduler.acquire()
+    with pytest.raises(LLMQueueTimeoutError):
+        await scheduler.acquire()
+    cancelled = asyncio.ensure_future(scheduler.acquire())
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+    assert scheduler.stats()["queued"] == 0
+    lease.release()
+    stats = scheduler.stats()
+    assert stats["active"] == 0
+    assert stats["timed_out"] == 1
+
+@pytest.mark.asyncio
+async def test_lease_deadline():
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=0, request_timeout=0.01)
+    lease = await scheduler.acquire()
+    lease.check_deadline()
+    time.sleep(0.02)
+    with pytest.raises(LLMDeadlineExceededError):
+        lease.check_deadline()
+    lease.release()
+
+@pytest.mark.asyncio
+async def test_hung_llm_call_gives_up_its_slot_at_the_deadline():
+    from unittest.mock import Mock
+    from app.services.llm_service import stream_chat_response
+    scheduler = LLMScheduler(max_concurrency=1, max_queue=0, request_timeout=0.3)
+    hang = threading.Event()
+
+    def tokens():
+        yield "first"
+        # A stuck LLM stream that never sends another token
+        hang.wait(10)
+        yield "late"
+
+    lease = await scheduler.acquire()
+    received = []
+    start = time.monotonic()
+    with pytest.raises(LLMDeadlineExceededError):
+        async for chunk in stream_chat_response(Mock(response_gen=tokens(), source_nodes=[]), lease):
+            received.append(chunk)
+    assert time.monotonic() - start < 2
+    assert received == ["Answer: ", "first"]
+    assert scheduler.stats()["active"] == 0
+
+    # The same for the call that starts generation
+    lease = await scheduler.acquire()
+    with pytest.raises(LLMDeadlineExceededError):
+        await lease.run(hang.wait, 10)
+    lease.release()
+    assert scheduler.stats()["active"] == 0
+    hang.set()
@@ -0,0 +1,35 @@
+from app.core.metrics import MetricsRegistry, span, start_request_timings, server_timing, STAGE_LATENCY
+
+def test_histogram_renders_cumulative_buckets():
+    registry = MetricsRegistry()
+    latency = registry.histogram("test_latency_seconds", "Test latency", ["route"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 2.0):
+        latency.labels("/a").observe(value)
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP test_latency_seconds Test latency", "# TYPE test_latency_seconds histogram"]
+    assert 'test_latency_seconds_bucket{route="/a",le="0.1"} 1' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="1"} 3' in lines
+    assert 'test_latency_seconds_bucket{route="/a",le="+Inf"} 4' in lines
+    assert 'test_latency_seconds_sum{route="/a"} 3.05' in lines
+    assert 'test_latency_seconds_count{route="/a"} 4' in lines
+
+def test_counter_and_label_escaping():
+    registry = MetricsRegistry()
+    hits = registry.counter("test_hits", "Test hits", ["name"])
+    hits.labels('quote"d').inc()
+    hits.labels('quote"d').inc(2)
+    # Registering the same name again returns the same counter
+    assert registry.counter("test_hits", "Test hits", ["name"]) is hits
+    assert 'test_hits_total{name="quote\\"d"} 3' in registry.render()
+
+def test_spans_collect_request_timings():
+    timings = start_request_timings()
+    before = STAGE_LATENCY.labels("test", "work").count
+    with span("test", "work"):
+        pass
+    with span("test", "work"):
+        pass
+    assert list(timings) == ["work"]
+    assert STAGE_LATENCY.labels("test", "work").count == before + 2
+    header = server_timing({"db": 0.0123, "retrieve": 0.5}, total=1.0)
+    assert header == "db;dur=12.3, retrieve;dur=500.0, total;dur=1000.0"
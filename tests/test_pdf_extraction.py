@@ -0,0 +1,91 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from PyPDF2._page import PageObject
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from app.services.pdf_extraction import extract_pages, extract_page_range, get_extraction_pool, replace_extraction_pool
+
+def create_multi_page_pdf(path, pages):
+    c = canvas.Canvas(str(path), pagesize=letter)
+    for page in range(pages):
+        c.drawString(100, 750, f"Content of page number {page + 1}.")
+        c.showPage()
+    c.save()
+
+def test_parallel_extraction_preserves_page_order(tmp_path):
+    path = tmp_path / "many.pdf"
+    create_multi_page_pdf(path, 40)
+    texts, timed_out = extract_pages(str(path), workers=3, page_timeout=30)
+    assert timed_out == []
+    assert len(texts) == 40
+    assert all(f"page number {i + 1}." in text for i, text in enumerate(texts))
+    assert texts == extract_pages(str(path), workers=1)[0]
+
+def test_slow_page_is_skipped_after_timeout(tmp_path):
+    path = tmp_path / "slow.pdf"
+    create_multi_page_pdf(path, 3)
+    original = PageObject.extract_text
+
+    def slow_second_page(page, *args, **kwargs):
+        text = original(page, *args, **kwargs)
+        if "page number 2." in text:
+            time.sleep(5)
+        return text
+
+    with patch.object(PageObject, "extract_text", slow_second_page):
+        start = time.perf_counter()
+        pages = extract_page_range(str(path), 0, 3, page_timeout=0.2)
+    assert time.perf_counter() - start < 2
+    assert [skipped for _, skipped in pages] == [False, True, False]
+    assert "page number 3." in pages[2][0]
+
+def create_heavy_pdf(path):
+    c = canvas.Canvas(str(path), pagesize=letter)
+    c.drawString(100, 750, "Content of page number 1.")
+    c.showPage()
+    # Thousands of text operators take PyPDF2 well over a second to extract
+    for i in range(20000):
+        c.drawString(10 + (i % 50) * 10, 10 + (i // 50) % 70 * 10, "x")
+    c.showPage()
+    c.save()
+
+def test_page_timeout_applies_off_the_main_thread(tmp_path):
+    # Ingestion extracts on worker threads, where no alarm can interrupt a page
+    path = tmp_path / "heavy.pdf"
+    create_heavy_pdf(path)
+    with ThreadPoolExecutor(max_workers=1) as thread:
+        texts, timed_out = thread.submit(extract_pages, str(path), 3, 0.2).result()
+    assert timed_out == [1]
+    assert "page number 1." in texts[0]
+
+def test_pool_replaced_after_a_worker_outlives_its_backstop(tmp_path):
+    path = tmp_path / "stuck.pdf"
+    create_heavy_pdf(path)
+    pool = get_extraction_pool(3)
+    # A 30s alarm that never gets to fire and a backstop of half a second
+    # leave the heavy page's worker busy after its range is given up on
+    processes = []
+    def replace(pool):
+        processes.extend(pool._processes.values())
+        replace_extraction_pool(pool)
+    with patch("app.services.pdf_extraction.BACKSTOP_SECONDS", -29.5), \
+            patch("app.services.pdf_extraction.replace_extraction_pool", replace), \
+            ThreadPoolExecutor(max_workers=1) as thread:
+        texts, timed_out = thread.submit(extract_pages, str(path), 3, 30).result()
+    assert 1 in timed_out
+    assert get_extraction_pool(3) is not pool
+    assert processes
+    for process in processes:
+        process.join(timeout=5)
+        assert not process.is_alive()
+
+def test_extract_page_range(tmp_path):
+    path = tmp_path / "range.pdf"
+    create_multi_page_pdf(path, 30)
+    texts, timed_out = extract_pages(str(path), workers=3, start=5, stop=25)
+    assert timed_out == []
+    assert len(texts) == 20
+    assert all(f"page number {i + 6}." in text for i, text in enumerate(texts))
+    # A stop past the end is cut to the last page
+    assert extract_pages(str(path), workers=1, start=28, stop=40)[0] == extract_pages(str(path), workers=1)[0][28:]
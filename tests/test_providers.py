@@ -0,0 +1,55 @@
+import os
+import sys
+import subprocess
+import pytest
+from llama_index.core import Settings
+from llama_index.core.llms.mock import MockLLM
+from llama_index.core.embeddings import MockEmbedding
+from app.core.config import get_settings
+from app.core.providers import LLM_PROVIDERS, EMBEDDING_PROVIDERS, register_llm_provider, register_embedding_provider, get_llm, get_embed_model, reset_models
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def clean_models():
+    saved = Settings._llm, Settings._embed_model, dict(LLM_PROVIDERS), dict(EMBEDDING_PROVIDERS)
+    reset_models()
+    yield
+    Settings._llm, Settings._embed_model = saved[:2]
+    LLM_PROVIDERS.clear()
+    LLM_PROVIDERS.update(saved[2])
+    EMBEDDING_PROVIDERS.clear()
+    EMBEDDING_PROVIDERS.update(saved[3])
+
+def test_models_created_once_on_first_use(clean_models, monkeypatch):
+    created = []
+    def fake_llm(settings):
+        created.append("llm")
+        return MockLLM()
+    register_llm_provider("fake", fake_llm)
+    register_embedding_provider("fake", lambda settings: MockEmbedding(embed_dim=4))
+    monkeypatch.setattr(get_settings(), "LLM_PROVIDER", "fake")
+    monkeypatch.setattr(get_settings(), "EMBEDDING_PROVIDER", "fake")
+    assert created == []
+    llm = get_llm()
+    assert get_llm() is llm and Settings.llm is llm
+    assert created == ["llm"]
+    assert get_embed_model().embed_dim == 4
+
+def test_models_set_directly_are_kept(clean_models):
+    llm = MockLLM()
+    Settings.llm = llm
+    assert get_llm() is llm
+
+def test_unknown_provider_rejected(clean_models, monkeypatch):
+    monkeypatch.setattr(get_settings(), "LLM_PROVIDER", "nope")
+    with pytest.raises(ValueError, match="nope"):
+        get_llm()
+
+def test_importing_app_loads_no_models():
+    code = "import sys, app.main; print([m for m in sys.modules if m.startswith('llama_index')])"
+    env = {**os.environ, "PYTHONPATH": ROOT, "GOOGLE_API_KEY": "unused", "SQLALCHEMY_DATABASE_URL": "sqlite:///./unused.db"}
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+    # Tables are created at startup, not on import
+    assert not os.path.exists(os.path.join(ROOT, "unused.db"))
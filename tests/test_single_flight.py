@@ -0,0 +1,47 @@
+import time
+import threading
+import pytest
+from app.core.single_flight import SingleFlight
+
+def test_followers_share_the_leaders_result():
+    flights = SingleFlight()
+    future, leader = flights.join("key")
+    assert leader
+    assert flights.join("key") == (future, False)
+    assert flights.lead("key", future, lambda x: x * 2, 21) == 42
+    assert future.result() == 42
+    assert len(flights) == 0
+    # A finished key starts a new flight
+    assert flights.join("key")[1]
+
+def test_errors_shared_and_finish_idempotent():
+    flights = SingleFlight()
+    future, _ = flights.join("key")
+    with pytest.raises(ValueError):
+        flights.lead("key", future, lambda: (_ for _ in ()).throw(ValueError("boom")))
+    flights.finish("key", future, "late")
+    with pytest.raises(ValueError):
+        future.result()
+    # Waiters giving up cannot cancel it for the others
+    other, _ = flights.join("other")
+    assert not other.cancel()
+
+def test_concurrent_callers_run_once():
+    flights = SingleFlight()
+    calls, results = [], []
+    started = threading.Barrier(5)
+    def work():
+        calls.append(1)
+        time.sleep(0.2)
+        return "shared"
+    def call():
+        started.wait()
+        future, leader = flights.join("key")
+        results.append(flights.lead("key", future, work) if leader else future.result(timeout=5))
+    threads = [threading.Thread(target=call) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == ["shared"] * 5
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from llama_index.core.schema import QueryBundle
+from app.services.vector_store import (
+    EmbeddingStore, serialize_embeddings, deserialize_vectors, deserialize_embeddings, embedding_storage, normalize_rows, HEADER,
+)
+from app.services.llm_service import ChatRetriever
+
+def make_embeddings(rows=500, dim=64, seed=0):
+    return normalize_rows(np.random.default_rng(seed).normal(size=(rows, dim))).astype(np.float32)
+
+@pytest.mark.parametrize("storage,bytes_per_value,tolerance", [("float32", 4, 0), ("float16", 2, 1e-3), ("int8", 1, 1e-2)])
+def test_storage_formats_round_trip(storage, bytes_per_value, tolerance):
+    embeddings = make_embeddings()
+    blob = serialize_embeddings(embeddings, storage)
+    scales = 4 * len(embeddings) if storage == "int8" else 0
+    assert len(blob) == HEADER.size + scales + embeddings.size * bytes_per_value
+    assert embedding_storage(blob) == storage
+    matrix, _ = deserialize_vectors(blob)
+    assert matrix.dtype.itemsize == bytes_per_value
+    assert np.abs(deserialize_embeddings(blob) - embeddings).max() <= tolerance
+
+def test_unknown_storage_rejected():
+    with pytest.raises(ValueError):
+        serialize_embeddings(make_embeddings(), "int4")
+
+def test_quantized_stores_rank_like_float32():
+    embeddings = make_embeddings(rows=2000)
+    chunks = [(f"chunk {i}", {}) for i in range(len(embeddings))]
+    exact = ChatRetriever([EmbeddingStore("a", embeddings, chunks)], similarity_top_k=5)
+    query = embeddings[7] + 0.5 * make_embeddings(rows=1, seed=1)[0]
+    expected = [(n.node.node_id, n.score) for n in exact.retrieve(QueryBundle(query_str="q", embedding=query.tolist()))]
+    for storage in ("float16", "int8"):
+        matrix, scales = deserialize_vectors(serialize_embeddings(embeddings, storage))
+        store = EmbeddingStore("a", matrix, chunks, scales=scales)
+        assert store.quantized and store.nbytes < EmbeddingStore("a", embeddings, chunks).nbytes
+        results = ChatRetriever([store], similarity_top_k=5).retrieve(QueryBundle(query_str="q", embedding=query.tolist()))
+        assert [n.node.node_id for n in results] == [node_id for node_id, _ in expected]
+        assert [n.score for n in results] == pytest.approx([score for _, score in expected], abs=1e-2)